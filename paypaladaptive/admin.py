@@ -1,11 +1,13 @@
 from django.contrib import admin
 
 from . import models
+from .api import ratelimit
 
 
 def update_adaptive_instance(modeladmin, request, queryset):
-    for instance in queryset:
-        instance.update(save=True)
+    with ratelimit.priority(ratelimit.PRIORITY_BACKGROUND):
+        for instance in queryset:
+            instance.update(save=True)
 
 update_adaptive_instance.short_description = u"Update"
 
@@ -17,13 +19,48 @@ class PaymentAdmin(admin.ModelAdmin):
     search_fields = ('=id', '=pay_key')
 
 
+class PayoutAdmin(admin.ModelAdmin):
+    list_display = ('created_date', 'status')
+    list_filter = ('status',)
+
+
 class PreapprovalAdmin(admin.ModelAdmin):
     list_display = ('preapproval_key', 'valid_until_date', 'status')
     actions = [update_adaptive_instance]
 
 
 class RefundAdmin(admin.ModelAdmin):
-    pass
+    list_display = ('created_date', 'payment', 'money', 'status')
+    list_filter = ('status',)
+    raw_id_fields = ('payment',)
+
+
+class SettlementAdmin(admin.ModelAdmin):
+    list_display = ('name', 'action', 'status', 'created_date',
+                    'completed_date')
+    list_filter = ('action', 'status')
+
+
+class SettlementItemAdmin(admin.ModelAdmin):
+    list_display = ('settlement', 'preapproval', 'payment', 'status',
+                    'updated_date')
+    list_filter = ('status',)
+    raw_id_fields = ('settlement', 'preapproval', 'payment')
+
+
+class StatusTransitionAdmin(admin.ModelAdmin):
+    list_display = ('created_date', 'object_type', 'object_id', 'old_status',
+                    'status')
+    list_filter = ('object_type', 'status')
+    search_fields = ('=object_id',)
+
+
+class SlowCallAdmin(admin.ModelAdmin):
+    list_display = ('created_date', 'endpoint', 'total', 'wait', 'connect',
+                    'tls', 'first_byte', 'request_bytes', 'response_bytes',
+                    'status_code', 'correlation_id')
+    list_filter = ('endpoint', 'status_code')
+    search_fields = ('=correlation_id',)
 
 
 class IPNLogAdmin(admin.ModelAdmin):
@@ -35,6 +72,11 @@ class IPNLogAdmin(admin.ModelAdmin):
 
 
 admin.site.register(models.Payment, PaymentAdmin)
+admin.site.register(models.Payout, PayoutAdmin)
 admin.site.register(models.Preapproval, PreapprovalAdmin)
 admin.site.register(models.Refund, RefundAdmin)
+admin.site.register(models.Settlement, SettlementAdmin)
+admin.site.register(models.StatusTransition, StatusTransitionAdmin)
+admin.site.register(models.SettlementItem, SettlementItemAdmin)
+admin.site.register(models.SlowCall, SlowCallAdmin)
 admin.site.register(models.IPNLog, IPNLogAdmin)
@@ -0,0 +1,92 @@
+"""
+Concurrency limits per endpoint class.
+
+Each endpoint class (and the IPN verification, named "IPN") can be given its
+own limit of concurrent calls with the PAYPAL_BULKHEADS setting, e.g.
+
+    PAYPAL_BULKHEADS = {'Pay': 20, 'Refund': 2, 'PaymentDetails': 4}
+
+so a batch job flooding one class of calls can't take up all the threads
+and sockets needed by the others. Calls wait for at most
+PAYPAL_BULKHEAD_MAX_WAIT seconds for a free slot before BulkheadFullError is
+raised. Limits apply per process.
+
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from paypaladaptive import settings
+from paypaladaptive import metrics
+
+from .errors import BulkheadFullError
+from . import deadline
+
+
+class Bulkhead(object):
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.in_flight = 0
+        self._condition = threading.Condition(threading.Lock())
+
+    def acquire(self, max_wait=None):
+        deadline = None if max_wait is None else time.time() + max_wait
+
+        with self._condition:
+            while self.in_flight >= self.limit:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        metrics.incr('paypaladaptive_bulkhead_rejected_total',
+                                     bulkhead=self.name)
+                        raise BulkheadFullError(
+                            "Too many concurrent %s calls" % self.name)
+                self._condition.wait(remaining)
+
+            self.in_flight += 1
+            metrics.set_gauge('paypaladaptive_bulkhead_limit', self.limit,
+                              bulkhead=self.name)
+            metrics.set_gauge('paypaladaptive_bulkhead_in_flight',
+                              self.in_flight, bulkhead=self.name)
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            metrics.set_gauge('paypaladaptive_bulkhead_in_flight',
+                              self.in_flight, bulkhead=self.name)
+            self._condition.notify()
+
+
+_bulkheads = {}
+_bulkheads_lock = threading.Lock()
+
+
+def get_bulkhead(name):
+    """Return the bulkhead for name, or None if it has no limit"""
+    limit = settings.BULKHEADS.get(name)
+    if limit is None:
+        return None
+
+    with _bulkheads_lock:
+        bulkhead = _bulkheads.get(name)
+        if bulkhead is None or bulkhead.limit != limit:
+            bulkhead = _bulkheads[name] = Bulkhead(name, limit)
+        return bulkhead
+
+
+@contextmanager
+def slot(name):
+    """Hold one of the concurrent slots of the bulkhead name"""
+    bulkhead = get_bulkhead(name)
+    if bulkhead is None:
+        yield
+        return
+
+    bulkhead.acquire(deadline.bound(settings.BULKHEAD_MAX_WAIT))
+    try:
+        yield
+    finally:
+        bulkhead.release()
@@ -0,0 +1,68 @@
+"""
+Read-through cache for responses of read-only Paypal endpoints.
+
+Calls that refresh the status of an object, e.g. when the user returns from
+Paypal, must not be answered with a response cached before the status
+changed. They are made within ``fresh``, which skips reading the cache but
+still stores the new response:
+
+    with cache.fresh():
+        payment.update()
+
+"""
+import hashlib
+import threading
+from contextlib import contextmanager
+
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from paypaladaptive import settings
+from paypaladaptive.helpers import get_cache
+
+
+KEY_PREFIX = 'paypaladaptive:response'
+
+_local = threading.local()
+
+
+@contextmanager
+def fresh():
+    """Make calls within the block ask Paypal instead of the cache"""
+    previous = getattr(_local, 'fresh', False)
+    _local.fresh = True
+    try:
+        yield
+    finally:
+        _local.fresh = previous
+
+
+def is_fresh():
+    return getattr(_local, 'fresh', False)
+
+
+def make_key(name, data):
+    """
+    Build a cache key from an endpoint name and its request data. The data is
+    serialized with sorted keys so equal requests map to the same key.
+
+    """
+    normalized = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder)
+    return '%s:%s:%s' % (KEY_PREFIX, name,
+                         hashlib.sha1(normalized).hexdigest())
+
+
+def get_response(key):
+    return get_cache(settings.RESPONSE_CACHE_ALIAS).get(key)
+
+
+def set_response(key, raw_response, timeout):
+    get_cache(settings.RESPONSE_CACHE_ALIAS).set(key, raw_response, timeout)
+
+
+def delete_response(key):
+    get_cache(settings.RESPONSE_CACHE_ALIAS).delete(key)
@@ -0,0 +1,205 @@
+"""
+Cassettes of calls to Paypal, to replay them without a network.
+
+With PAYPAL_CASSETTE set to a file and PAYPAL_CASSETTE_MODE to 'record',
+the response to every request UrlRequest makes is appended to the
+cassette. In 'replay' mode UrlRequest answers from the cassette and never
+connects to Paypal; requests that weren't recorded raise CassetteError.
+From code, e.g. in tests and benchmarks:
+
+    with use_cassette('payments.cassette', mode='record'):
+        payment.process(receivers)
+
+Requests are matched on the endpoint, the last part of the url path with
+the query string, and the body normalized: JSON with sorted keys and
+without the return, cancel and IPN urls and the preapproval dates, which
+differ between runs, and forms with sorted fields. A request recorded
+several times is answered with the responses in the order they were
+recorded, then with the last one again.
+
+The file starts with MAGIC, followed by a record per response: the SHA-1 of
+the request, the status code (0 if there was none), the length of the
+response and the response. Only hashes of the requests are kept, so
+credentials and payloads are not written to the cassette. It is memory
+mapped and indexed when opened for replay, responses are read from the
+map as they are replayed.
+
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import urllib
+import urlparse
+from contextlib import contextmanager
+
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+
+from paypaladaptive import settings
+
+from .errors import CassetteError
+
+
+MAGIC = 'PPCASSETTE1\n'
+RECORD = struct.Struct('>20sHI')
+MODES = ('record', 'replay')
+
+# request fields that differ between recording and replaying the same flow
+VOLATILE_FIELDS = frozenset(['returnUrl', 'cancelUrl', 'ipnNotificationUrl',
+                             'startingDate', 'endingDate'])
+
+_cassettes = {}
+_cassettes_lock = threading.Lock()
+_active = None
+
+
+def endpoint_name(url):
+    """The last part of the path of url, with the query string"""
+    parsed = urlparse.urlsplit(url)
+    name = parsed.path.rstrip('/').rsplit('/', 1)[-1]
+    if parsed.query:
+        name += '?' + parsed.query
+    return name
+
+
+def normalize(data):
+    """The request body data as it is matched"""
+    if not data:
+        return ''
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+
+    try:
+        body = json.loads(data)
+    except ValueError:
+        return urllib.urlencode(sorted(
+            urlparse.parse_qsl(data, keep_blank_values=True)))
+
+    if isinstance(body, dict):
+        body = dict((key, value) for key, value in body.items()
+                    if key not in VOLATILE_FIELDS)
+    return json.dumps(body, sort_keys=True)
+
+
+def request_key(url, data):
+    return hashlib.sha1('%s\n%s' % (endpoint_name(url),
+                                    normalize(data))).digest()
+
+
+class Cassette(object):
+    """A cassette file opened to record to or replay from"""
+
+    def __init__(self, path, mode='replay'):
+        if mode not in MODES:
+            raise ValueError('Cassette mode must be one of %s, not %r'
+                             % (', '.join(MODES), mode))
+
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._map = None
+        self._index = {}
+        self._played = {}
+
+        if mode == 'record':
+            if not os.path.exists(path) or not os.path.getsize(path):
+                with open(path, 'wb') as f:
+                    f.write(MAGIC)
+            else:
+                self._check_magic()
+        else:
+            self._load()
+
+    def _check_magic(self):
+        with open(self.path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise CassetteError('%s is not a cassette' % self.path)
+
+    def _load(self):
+        self._check_magic()
+
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == len(MAGIC):
+                return
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        size = len(self._map)
+        offset = len(MAGIC)
+        while offset + RECORD.size <= size:
+            key, code, length = RECORD.unpack_from(self._map, offset)
+            offset += RECORD.size
+            if offset + length > size:
+                # cut short while recording
+                break
+            self._index.setdefault(key, []).append((offset, length, code))
+            offset += length
+
+    def record(self, url, data, code, response):
+        """Append the response to a request"""
+        if not isinstance(response, basestring):
+            response = str(response)
+        if isinstance(response, unicode):
+            response = response.encode('utf-8')
+
+        record = RECORD.pack(request_key(url, data), code or 0,
+                             len(response)) + response
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                f.write(record)
+
+    def play(self, url, data):
+        """Return the status code and the response recorded for a request"""
+        key = request_key(url, data)
+        with self._lock:
+            responses = self._index.get(key)
+            if not responses:
+                raise CassetteError('No %s request like this in %s'
+                                    % (endpoint_name(url), self.path))
+            played = self._played.get(key, 0)
+            self._played[key] = played + 1
+
+        offset, length, code = responses[min(played, len(responses) - 1)]
+        return code or None, self._map[offset:offset + length]
+
+    def rewind(self):
+        """Answer requests with their first recorded response again"""
+        with self._lock:
+            self._played.clear()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._index = {}
+
+
+def get_cassette():
+    """The cassette in use, or None to call Paypal"""
+    if _active is not None:
+        return _active
+
+    if settings.CASSETTE is None:
+        return None
+
+    key = (settings.CASSETTE, settings.CASSETTE_MODE)
+    with _cassettes_lock:
+        if key not in _cassettes:
+            _cassettes[key] = Cassette(*key)
+        return _cassettes[key]
+
+
+@contextmanager
+def use_cassette(path, mode='replay'):
+    """Record or replay calls to Paypal with the cassette at path"""
+    global _active
+
+    previous, _active = _active, Cassette(path, mode)
+    try:
+        yield _active
+    finally:
+        _active.close()
+        _active = previous
@@ -0,0 +1,181 @@
+"""
+Circuit breakers for the Paypal hosts we talk to.
+
+There is one breaker per endpoint family, e.g. AdaptivePayments,
+AdaptiveAccounts and the webscr IPN verification. A breaker opens when the
+share of failed (or, if PAYPAL_CIRCUIT_BREAKER_SLOW_CALL is set, slow) calls
+within the last PAYPAL_CIRCUIT_BREAKER_WINDOW seconds reaches
+PAYPAL_CIRCUIT_BREAKER_FAILURE_RATE. While open, calls fail immediately with
+CircuitOpenError. After PAYPAL_CIRCUIT_BREAKER_RESET_TIMEOUT seconds a single
+probe call is let through; the breaker closes if it succeeds and opens again
+if it fails. A probe cut short by a deadline counts as neither, the next call
+probes again.
+
+Breakers are kept per process.
+
+"""
+import threading
+import time
+from collections import deque
+from urlparse import urlparse
+
+from paypaladaptive import settings
+from paypaladaptive import metrics
+
+from .errors import CircuitOpenError
+
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, name, failure_rate=0.5, min_calls=20, window=60,
+                 reset_timeout=30, slow_call=None):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.slow_call = slow_call
+
+        self._lock = threading.Lock()
+        self._results = deque()
+        self._failures = 0
+        self._probing = False
+        self.state = STATE_CLOSED
+        self.opened_at = None
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may be made right now"""
+        with self._lock:
+            if self.state == STATE_OPEN:
+                retry_after = self.opened_at + self.reset_timeout - time.time()
+                if retry_after > 0:
+                    metrics.incr('paypaladaptive_circuit_rejected_total',
+                                 breaker=self.name)
+                    raise CircuitOpenError(self.name, retry_after)
+                self._set_state(STATE_HALF_OPEN)
+
+            if self.state == STATE_HALF_OPEN:
+                if self._probing:
+                    metrics.incr('paypaladaptive_circuit_rejected_total',
+                                 breaker=self.name)
+                    raise CircuitOpenError(self.name, self.reset_timeout)
+                self._probing = True
+
+    def record(self, success, duration):
+        """Record the outcome of a call let through by before_call"""
+        failed = not success or (self.slow_call is not None
+                                 and duration > self.slow_call)
+        now = time.time()
+
+        with self._lock:
+            if self.state == STATE_HALF_OPEN:
+                self._probing = False
+                if failed:
+                    self._open(now)
+                else:
+                    self._reset()
+                    self._set_state(STATE_CLOSED)
+                return
+
+            self._results.append((now, failed))
+            self._failures += failed
+            while self._results and self._results[0][0] < now - self.window:
+                __, old_failed = self._results.popleft()
+                self._failures -= old_failed
+
+            calls = len(self._results)
+            if (self.state == STATE_CLOSED and calls >= self.min_calls
+                    and self._failures >= self.failure_rate * calls):
+                self._open(now)
+
+    def release(self):
+        """
+        Let go of a call let through by before_call without an outcome, e.g.
+        one cut short by our own deadline. A probe is let through again.
+
+        """
+        with self._lock:
+            self._probing = False
+
+    @property
+    def available(self):
+        """Whether a call made now would be let through"""
+        if self.state == STATE_OPEN:
+            return time.time() >= self.opened_at + self.reset_timeout
+        if self.state == STATE_HALF_OPEN:
+            return not self._probing
+        return True
+
+    def _open(self, now):
+        self._reset()
+        self.opened_at = now
+        self._set_state(STATE_OPEN)
+
+    def _reset(self):
+        self._results.clear()
+        self._failures = 0
+
+    def _set_state(self, state):
+        self.state = state
+        metrics.set_gauge('paypaladaptive_circuit_open',
+                          int(state != STATE_CLOSED), breaker=self.name)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_name(url):
+    """
+    Name of the breaker guarding a url: the host and the first part of the
+    path, e.g. "svcs.paypal.com/AdaptivePayments".
+
+    """
+    parsed = urlparse(url)
+    return '%s/%s' % (parsed.netloc, parsed.path.strip('/').split('/')[0])
+
+
+def get_breaker(url):
+    """Return the breaker for url, or None if breakers are disabled"""
+    if not settings.CIRCUIT_BREAKER_ENABLED:
+        return None
+
+    name = breaker_name(url)
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name,
+                failure_rate=settings.CIRCUIT_BREAKER_FAILURE_RATE,
+                min_calls=settings.CIRCUIT_BREAKER_MIN_CALLS,
+                window=settings.CIRCUIT_BREAKER_WINDOW,
+                reset_timeout=settings.CIRCUIT_BREAKER_RESET_TIMEOUT,
+                slow_call=settings.CIRCUIT_BREAKER_SLOW_CALL,
+                )
+        return _breakers[name]
+
+
+def is_available(url=None):
+    """
+    Whether calls to url (the Adaptive Payments endpoint by default) are
+    currently let through. Use this to show a "try again later" page
+    instead of starting a checkout that would fail.
+
+    """
+    breaker = get_breaker(url or settings.PAYPAL_ENDPOINT)
+    return breaker is None or breaker.available
+
+
+def get_states():
+    """Return a dict of breaker names and their current state"""
+    with _breakers_lock:
+        return dict((name, b.state) for name, b in _breakers.items())
+
+
+def reset_all():
+    with _breakers_lock:
+        _breakers.clear()
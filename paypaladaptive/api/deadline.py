@@ -0,0 +1,65 @@
+"""
+Deadlines for calls to Paypal.
+
+Calls made within the ``within`` context manager have to be done before the
+deadline:
+
+    with deadline.within(0.8):
+        payment.update()
+
+All waits on the way to Paypal (rate limiter, bulkheads, coalesced calls)
+and the HTTP request itself are bounded by the time left, and
+DeadlineExceeded is raised once it has passed. A nested deadline can only
+shorten the one around it.
+
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from .errors import DeadlineExceeded
+
+
+_local = threading.local()
+
+
+@contextmanager
+def within(seconds):
+    """Make all Paypal calls within the block finish in seconds"""
+    previous = getattr(_local, 'expires', None)
+    expires = time.time() + seconds
+    if previous is not None:
+        expires = min(expires, previous)
+
+    _local.expires = expires
+    try:
+        yield
+    finally:
+        _local.expires = previous
+
+
+def remaining():
+    """Seconds left until the deadline, or None if there is none"""
+    expires = getattr(_local, 'expires', None)
+    if expires is None:
+        return None
+    return expires - time.time()
+
+
+def check():
+    """Raise DeadlineExceeded if the deadline has passed, else return the
+    seconds left (None without a deadline)"""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded('Deadline for calling Paypal exceeded')
+    return left
+
+
+def bound(max_wait):
+    """Shorten max_wait (None for no limit) to the time left"""
+    left = remaining()
+    if left is None:
+        return max_wait
+
+    left = max(left, 0)
+    return left if max_wait is None else min(max_wait, left)
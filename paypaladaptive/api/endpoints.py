@@ -1,5 +1,6 @@
 """Endpoints for (parts of) Paypal Adaptive API."""
 import logging
+import time
 from datetime import datetime, timedelta
 
 try:
@@ -12,13 +13,23 @@ from django.core.serializers.json import DjangoJSONEncoder
 from moneyed import Money
 
 from paypaladaptive import settings
+from paypaladaptive import logs
+from paypaladaptive import metrics
+from paypaladaptive import slowcalls
 
 from .errors import *
 from .datatypes import ReceiverList, MoneyList
 from .httpwrapper import UrlRequest
+from . import bulkhead
+from . import cache
+from . import deadline
+from . import ratelimit
+from . import singleflight
 
 
 logger = logging.getLogger(__name__)
+# request and response bodies, logged at DEBUG
+payload_logger = logging.getLogger(__name__ + '.payload')
 
 
 class PaypalAdaptiveEndpoint(object):
@@ -27,6 +38,17 @@ class PaypalAdaptiveEndpoint(object):
     error_class = Exception
     url = None
 
+    # Seconds to cache successful responses for. Only set this on endpoints
+    # that don't change any state on Paypal's side.
+    cache_timeout = None
+
+    # Whether identical concurrent calls may share a single request. Only
+    # set this on idempotent endpoints.
+    coalesce = False
+
+    # Rate limiting priority used unless one is set with ratelimit.priority()
+    priority = ratelimit.PRIORITY_DEFAULT
+
     def __init__(self, *args, **kwargs):
         self.data = {'requestEnvelope': {'errorLanguage': 'en_US'}}
         self.headers = {}
@@ -53,32 +75,140 @@ class PaypalAdaptiveEndpoint(object):
         self.headers.update(headers)
 
     def call(self):
-        request = UrlRequest().call(
-            self.url,
-            data=json.dumps(self.data, cls=DjangoJSONEncoder),
-            headers=self.headers,
-            )
-        self.raw_response = request.response
-        self.response = json.loads(request.response)
-
-        # logger.debug('headers are: %s', str(self.headers))
-        logger.debug('request is: %s', str(self.data))
-        logger.debug('response is: %s', str(self.raw_response))
+        cache_timeout = self.get_cache_timeout()
+        raw_response = None
+
+        if cache_timeout is not None and not cache.is_fresh():
+            raw_response = cache.get_response(self.cache_key)
+
+        start = time.time()
+        if raw_response is None:
+            self.raw_response, self.response = self._timed_request()
+        else:
+            metrics.incr('paypaladaptive_response_cache_hits_total',
+                         endpoint=self.__class__.__name__)
+            # don't write back a response we just read from the cache
+            cache_timeout = None
+            self.raw_response = raw_response
+            self.response = json.loads(raw_response)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            envelope = self.response.get('responseEnvelope', {})
+            logs.log(logger, logging.DEBUG, 'Paypal call',
+                     endpoint=self.__class__.__name__,
+                     duration=time.time() - start,
+                     cached=raw_response is not None,
+                     ack=envelope.get('ack'),
+                     correlationId=envelope.get('correlationId'))
+        logs.log(payload_logger, logging.DEBUG, 'Paypal payload',
+                 endpoint=self.__class__.__name__,
+                 request=logs.redacted(self.data),
+                 response=logs.redacted(self.raw_response))
 
         if ('responseEnvelope' not in self.response
                 or 'ack' not in self.response['responseEnvelope']
                 or self.response['responseEnvelope']['ack']
                 not in ['Success', 'SuccessWithWarning']):
             error_message = 'unknown'
+            error_id = None
             try:
                 error_message = self.response['error'][0]['message']
+                error_id = self.response['error'][0].get('errorId')
             except KeyError:
                 pass
 
-            raise self.error_class(error_message)
+            error = self.error_class(error_message)
+            error.error_id = error_id
+            raise error
+
+        if cache_timeout is not None:
+            cache.set_response(self.cache_key, self.raw_response,
+                               cache_timeout)
 
         return self.response
 
+    def _timed_request(self):
+        """Make the request, recording its duration and outcome"""
+        endpoint = self.__class__.__name__
+        start = time.time()
+        try:
+            raw_response, response = self._request()
+        except Exception, e:
+            metrics.incr('paypaladaptive_requests_failed_total',
+                         endpoint=endpoint, error=e.__class__.__name__)
+            raise
+        finally:
+            metrics.histogram('paypaladaptive_request_duration_seconds',
+                              time.time() - start, endpoint=endpoint)
+
+        ack = response.get('responseEnvelope', {}).get('ack', 'None')
+        metrics.incr('paypaladaptive_responses_total', endpoint=endpoint,
+                     ack=ack)
+        return raw_response, response
+
+    def _request(self):
+        """
+        Call Paypal and return the raw and the parsed response. Identical
+        concurrent calls to coalescing endpoints share one request.
+
+        """
+        if self.coalesce and settings.COALESCE_REQUESTS:
+            return singleflight.do(
+                self.cache_key, self._send,
+                across_processes=settings.COALESCE_ACROSS_PROCESSES)
+
+        return self._send()
+
+    def _send(self):
+        start = time.time()
+        deadline.check()
+
+        body = json.dumps(self.data, cls=DjangoJSONEncoder)
+        with bulkhead.slot(self.__class__.__name__):
+            # a call refused by the bulkhead doesn't spend a token
+            ratelimit.acquire(self.priority)
+            request = UrlRequest().call(self.url, data=body,
+                                        headers=self.headers)
+
+        slowcalls.record(self.__class__.__name__, start, request, len(body))
+
+        if settings.METRICS_ENABLED:
+            endpoint = self.__class__.__name__
+            metrics.incr('paypaladaptive_request_bytes_total', len(body),
+                         endpoint=endpoint)
+            if isinstance(request.response, basestring):
+                metrics.incr('paypaladaptive_response_bytes_total',
+                             len(request.response), endpoint=endpoint)
+
+        return request.response, json.loads(request.response)
+
+    def get_cache_timeout(self):
+        """
+        Return the number of seconds to cache responses for, or None if
+        responses from this endpoint should not be cached. Timeouts can be
+        overridden per endpoint with the PAYPAL_RESPONSE_CACHE_TIMEOUTS
+        setting.
+
+        """
+        if not settings.RESPONSE_CACHE_ENABLED:
+            return None
+
+        return settings.RESPONSE_CACHE_TIMEOUTS.get(self.__class__.__name__,
+                                                    self.cache_timeout)
+
+    @property
+    def cache_key(self):
+        return cache.make_key(self.__class__.__name__, self.data)
+
+    @classmethod
+    def invalidate_cache(cls, *args, **kwargs):
+        """
+        Remove the cached response for a call made with the given arguments.
+
+        """
+        if settings.RESPONSE_CACHE_ENABLED:
+            cache.delete_response(cls(*args, **kwargs).cache_key)
+
     def prepare_data(self, *args, **kwargs):
         """
         Override this to set the correct data for the Endpoint. Has to return
@@ -108,6 +238,7 @@ class Pay(PaypalAdaptiveEndpoint):
 
     url = '%s%s' % (settings.PAYPAL_ENDPOINT, 'Pay')
     error_class = PayError
+    priority = ratelimit.PRIORITY_INTERACTIVE
 
     def prepare_data(self, money, return_url, cancel_url, receivers,
                      ipn_url=None, **kwargs):
@@ -154,6 +285,8 @@ class PaymentDetails(PaypalAdaptiveEndpoint):
 
     url = '%s%s' % (settings.PAYPAL_ENDPOINT, 'PaymentDetails')
     error_class = PaypalAdaptiveApiError
+    cache_timeout = 30
+    coalesce = True
 
     def prepare_data(self, payKey=None, transactionId=None, trackingId=None):
         """Prepare data for PaymentDetails API call"""
@@ -181,18 +314,33 @@ class Refund(PaypalAdaptiveEndpoint):
     """
     Models the Refund API operation
 
-    Currently only a full refund is supported.
+    Refunds the full payment unless receivers with the amounts to refund
+    are given.
 
     """
 
     url = '%s%s' % (settings.PAYPAL_ENDPOINT, 'Refund')
     error_class = RefundError
 
-    def prepare_data(self, pay_key):
+    def prepare_data(self, pay_key, receivers=None, currency_code=None):
         if not pay_key:
             raise ValueError("a payKey must be provided")
 
-        return {'payKey': pay_key}
+        data = {'payKey': pay_key}
+
+        if receivers is not None:
+            if (not isinstance(receivers, ReceiverList)
+                    or len(receivers) < 1):
+                raise ValueError("receivers must be an instance of "
+                                 "ReceiverList")
+            if not currency_code:
+                raise ValueError("currency_code is required to refund "
+                                 "receivers")
+
+            data.update({'currencyCode': currency_code,
+                         'receiverList': {'receiver': receivers.to_dict()}})
+
+        return data
 
 
 class CancelPreapproval(PaypalAdaptiveEndpoint):
@@ -223,6 +371,7 @@ class Preapprove(PaypalAdaptiveEndpoint):
 
     url = '%s%s' % (settings.PAYPAL_ENDPOINT, 'Preapproval')
     error_class = PreapproveError
+    priority = ratelimit.PRIORITY_INTERACTIVE
 
     def prepare_data(self, money, return_url, cancel_url, ipn_url=None,
                      starting_date=datetime.utcnow(),
@@ -262,6 +411,8 @@ class PreapprovalDetails(PaypalAdaptiveEndpoint):
 
     url = '%s%s' % (settings.PAYPAL_ENDPOINT, 'PreapprovalDetails')
     error_class = PaypalAdaptiveApiError
+    cache_timeout = 30
+    coalesce = True
 
     def prepare_data(self, preapprovalKey):
         """Prepare data for PreapprovalDetails API call"""
@@ -277,6 +428,8 @@ class GetVerifiedStatus(PaypalAdaptiveEndpoint):
 
     url = '%s%s' % (settings.PAYPAL_ENDPOINT_ACCOUNTS, 'GetVerifiedStatus')
     error_class = PaypalAdaptiveApiError
+    cache_timeout = 600
+    coalesce = True
 
     def prepare_data(self, email_address, first_name, last_name):
         """Prepare data for PreapprovalDetails API call"""
@@ -288,6 +441,8 @@ class GetVerifiedStatus(PaypalAdaptiveEndpoint):
 
 class ShippingAddress(PaypalAdaptiveEndpoint):
     url = '%s%s' % (settings.PAYPAL_ENDPOINT, 'GetShippingAddresses')
+    cache_timeout = 300
+    coalesce = True
 
     def prepare_data(self, paykey):
         return {'key': paykey}
@@ -296,6 +451,7 @@ class ShippingAddress(PaypalAdaptiveEndpoint):
 class ConvertCurrency(PaypalAdaptiveEndpoint):
     url = '%s%s' % (settings.PAYPAL_ENDPOINT, 'ConvertCurrency')
     error_class = PaypalAdaptiveApiError
+    coalesce = True
 
     def prepare_data(self, convert_from, convert_to, **kwargs):
         if (not isinstance(convert_from, MoneyList) or len(convert_from) < 1):
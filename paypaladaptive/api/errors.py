@@ -1,5 +1,6 @@
 class PaypalAdaptiveApiError(RuntimeError):
-    pass
+    # errorId of the Failure ack Paypal answered with, if any
+    error_id = None
 
 
 class PayError(PaypalAdaptiveApiError):
@@ -23,4 +24,40 @@ class IpnError(PaypalAdaptiveApiError):
 
 
 class ReceiverError(PaypalAdaptiveApiError):
-    pass
\ No newline at end of file
+    pass
+
+
+class DeadlineExceeded(PaypalAdaptiveApiError):
+    """
+    Raised when a call to Paypal could not be finished before the deadline
+    set with deadline.within(). The call may have reached Paypal.
+
+    """
+
+
+class PaypalUnavailableError(PaypalAdaptiveApiError):
+    """Raised when a call to Paypal is not made, to protect us or Paypal"""
+
+    retry_after = 1
+
+
+class RateLimitExceeded(PaypalUnavailableError):
+    pass
+
+
+class BulkheadFullError(PaypalUnavailableError):
+    pass
+
+
+class CircuitOpenError(PaypalUnavailableError):
+    """Raised instead of calling Paypal while a circuit breaker is open"""
+
+    def __init__(self, breaker, retry_after):
+        super(CircuitOpenError, self).__init__(
+            'Circuit breaker for %s is open' % breaker)
+        self.breaker = breaker
+        self.retry_after = retry_after
+
+
+class CassetteError(PaypalAdaptiveApiError):
+    """Raised when a replayed request was not recorded in the cassette"""
@@ -1,29 +1,146 @@
+import httplib
+import socket
+import threading
+import time
 import urllib2
 
+from paypaladaptive import tracing
+
+from . import cassette, circuitbreaker, deadline
+from .errors import DeadlineExceeded
+
+
+_local = threading.local()
+
+
+def _timed_connect(connection, connect):
+    """
+    Run connect(), noting the time spent on opening the socket as 'connect'
+    and on the rest, the TLS handshake for HTTPS, as 'tls'.
+
+    """
+    timings = getattr(_local, 'timings', None)
+    if timings is None:
+        return connect()
+
+    create_connection = connection._create_connection
+
+    def timed_create_connection(*args, **kwargs):
+        sock = create_connection(*args, **kwargs)
+        timings['connect'] = time.time() - start
+        return sock
+
+    start = time.time()
+    connection._create_connection = timed_create_connection
+    try:
+        connect()
+    finally:
+        connection._create_connection = create_connection
+    if 'connect' in timings:
+        timings['tls'] = time.time() - start - timings['connect']
+
+
+class TimedHTTPConnection(httplib.HTTPConnection):
+    def connect(self):
+        _timed_connect(self, lambda: httplib.HTTPConnection.connect(self))
+
+
+class TimedHTTPSConnection(httplib.HTTPSConnection):
+    def connect(self):
+        _timed_connect(self, lambda: httplib.HTTPSConnection.connect(self))
+
+
+class TimedHTTPHandler(urllib2.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(TimedHTTPConnection, req)
+
+
+class TimedHTTPSHandler(urllib2.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(TimedHTTPSConnection, req, context=self._context)
+
+
+_opener = urllib2.build_opener(TimedHTTPHandler, TimedHTTPSHandler)
+
+
+def urlopen(request, **kwargs):
+    return _opener.open(request, **kwargs)
+
 
 class UrlResponse(object):
 
-    def __init__(self, data, meta, code):
+    def __init__(self, data, meta, code, timings=None):
         self.data = data
         self.meta = meta
         self.code = code
+        self.timings = timings or {}
 
 
 class UrlRequest(object):
 
+    @tracing.traced('paypaladaptive.http')
     def call(self, url, data=None, headers=None):
         if headers is None:
             headers = {}
 
+        span = tracing.current_span()
+        span.set_attribute('http.url', url.split('?')[0])
+        span.set_attribute('http.method', 'GET' if data is None else 'POST')
+
+        recording = cassette.get_cassette()
+        if recording is not None and recording.mode == 'replay':
+            code, response = recording.play(url, data)
+            self._response = UrlResponse(response, {}, code)
+            if code is not None:
+                span.set_attribute('http.status_code', code)
+            return self
+
+        timeout = deadline.check()
+
+        breaker = circuitbreaker.get_breaker(url)
+        if breaker is not None:
+            breaker.before_call()
+
         request = urllib2.Request(url, data=data, headers=headers)
+        kwargs = {} if timeout is None else {'timeout': timeout}
+        start = time.time()
+        timings = _local.timings = {}
+        succeeded = truncated = False
 
         try:
-            response = urllib2.urlopen(request)
+            response = urlopen(request, **kwargs)
+            timings['first_byte'] = time.time() - start
+
+            data = response.read()
+            timings['total'] = time.time() - start
+            self._response = UrlResponse(data, response.info(),
+                                         response.getcode(), timings)
+            succeeded = True
+        except (urllib2.URLError, socket.timeout), e:
+            reason = getattr(e, 'reason', e)
+            if timeout is not None and isinstance(reason, socket.timeout):
+                truncated = True
+                raise DeadlineExceeded('Call to %s timed out' % url)
+            timings['total'] = time.time() - start
+            self._response = UrlResponse(reason, {}, None, timings)
+        finally:
+            _local.timings = None
+            # every call let through by the breaker has to be accounted
+            # for, or a probe would keep it half-open for good
+            if breaker is not None:
+                if truncated:
+                    # cut short by our deadline, neither a success nor a
+                    # failure of Paypal
+                    breaker.release()
+                else:
+                    breaker.record(succeeded, time.time() - start)
+
+        if recording is not None:
+            recording.record(url, request.get_data(), self._response.code,
+                             self._response.data)
 
-            self._response = UrlResponse(response.read(), response.info(),
-                                         response.getcode())
-        except urllib2.URLError, e:
-            self._response = UrlResponse(e.reason, {}, None)
+        if self._response.code is not None:
+            span.set_attribute('http.status_code', self._response.code)
 
         return self
 
@@ -34,3 +151,13 @@ class UrlRequest(object):
     @property
     def code(self):
         return self._response.code
+
+    @property
+    def timings(self):
+        """
+        Seconds from the start of the request until the socket was
+        connected, spent on the TLS handshake, until the first byte of the
+        response and until the whole response was read
+
+        """
+        return self._response.timings
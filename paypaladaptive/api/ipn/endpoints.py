@@ -1,6 +1,8 @@
 import logging
+import threading
 import time
 import urllib
+from contextlib import contextmanager
 
 try:
     import json
@@ -14,6 +16,11 @@ from moneyed import Money, Currency
 from pytz import utc
 
 from paypaladaptive import settings
+from paypaladaptive import logs
+from paypaladaptive import metrics
+from paypaladaptive import slowcalls
+from paypaladaptive import tracing
+from paypaladaptive.api import bulkhead
 from paypaladaptive.api.errors import IpnError
 from paypaladaptive.api.httpwrapper import UrlRequest
 from paypaladaptive.models import IPNLog
@@ -23,6 +30,24 @@ from .constants import *
 
 logger = logging.getLogger(__name__)
 
+_local = threading.local()
+
+
+@contextmanager
+def unverified():
+    """
+    Accept IPNs in this thread without asking Paypal, to replay IPNs that
+    were verified when they came in. They are not logged again, and are
+    counted as replayed rather than verified.
+
+    """
+    previous = getattr(_local, 'unverified', False)
+    _local.unverified = True
+    try:
+        yield
+    finally:
+        _local.unverified = previous
+
 
 class Transaction(object):
 
@@ -81,13 +106,28 @@ class IPN(object):
         # logger.debug("request body: %s", request.body)
 
         ipn_log = None
-        if settings.IPN_LOG_ENABLED:
+        replaying = getattr(_local, 'unverified', False)
+        # replayed IPNs were logged when they came in
+        if settings.IPN_LOG_ENABLED and not replaying:
             ipn_log = IPNLog()
             ipn_log._start_time = time.time()
             ipn_log.path = request.path
             ipn_log.post = json.dumps(request.POST, cls=DjangoJSONEncoder)
             ipn_log.save()
 
+        self.verify_request(request, ipn_log)
+        self.parse_request(request)
+
+        if ipn_log:
+            ipn_log.save()
+        self.ipn_log = ipn_log
+
+    @tracing.traced('paypaladaptive.ipn.verify')
+    def verify_request(self, request, ipn_log=None):
+        """Check with Paypal that the request is theirs"""
+        if getattr(_local, 'unverified', False):
+            return
+
         # verify that the request is paypal's
         url = '%s?cmd=_notify-validate' % settings.PAYPAL_PAYMENT_HOST
         # post_data = {}
@@ -95,10 +135,33 @@ class IPN(object):
         #     post_data[k] = unicode(v).encode('utf-8')
         # data = urllib.urlencode(post_data)
         # verify_request = UrlRequest().call(url, data=data)
-        verify_request = UrlRequest().call(url, data=request.body)
+        start = time.time()
+        try:
+            with bulkhead.slot('IPN'):
+                verify_request = UrlRequest().call(url, data=request.body)
+        except Exception, e:
+            metrics.incr('paypaladaptive_requests_failed_total',
+                         endpoint='IPN', error=e.__class__.__name__)
+            raise
+        finally:
+            metrics.histogram('paypaladaptive_request_duration_seconds',
+                              time.time() - start, endpoint='IPN')
+
+        slowcalls.record('IPN', start, verify_request, len(request.body))
+        logs.log(logger, logging.DEBUG, 'PayPal IPN verification',
+                 duration=time.time() - start, code=verify_request.code,
+                 response=verify_request.response)
+
+        if settings.METRICS_ENABLED:
+            metrics.incr('paypaladaptive_request_bytes_total',
+                         len(request.body), endpoint='IPN')
+            if isinstance(verify_request.response, basestring):
+                metrics.incr('paypaladaptive_response_bytes_total',
+                             len(verify_request.response), endpoint='IPN')
 
         # check code
         if verify_request.code != 200:
+            metrics.incr('paypaladaptive_ipns_total', outcome='error')
             raise IpnError('PayPal response code was %s' % verify_request.code)
 
         # check response
@@ -108,8 +171,12 @@ class IPN(object):
             ipn_log.save()
 
         if raw_response != 'VERIFIED':
+            metrics.incr('paypaladaptive_ipns_total', outcome='invalid')
             raise IpnError('PayPal response was "%s"' % raw_response)
 
+    @tracing.traced('paypaladaptive.ipn.parse')
+    def parse_request(self, request):
+        """Read the fields of the IPN from the request"""
         # check transaction type
         raw_type = request.POST.get('transaction_type', None)
         allowed_types = [
@@ -121,7 +188,12 @@ class IPN(object):
 
         if raw_type in allowed_types:
             self.type = raw_type
+            if getattr(_local, 'unverified', False):
+                metrics.incr('paypaladaptive_ipns_total', outcome='replayed')
+            else:
+                metrics.incr('paypaladaptive_ipns_total', outcome='verified')
         else:
+            metrics.incr('paypaladaptive_ipns_total', outcome='unknown_type')
             raise IpnError('Unknown transaction_type received: %s' % raw_type)
 
         self.transactions = self.process_transactions(request.POST)
@@ -182,9 +254,11 @@ class IPN(object):
                                          IPN_ACTION_TYPE_CREATE]):
             raise IpnError("unknown action type: %s" % self.action_type)
 
-        if ipn_log:
-            ipn_log.save()
-        self.ipn_log = ipn_log
+        span = tracing.current_span()
+        span.set_attribute('paypal.ipn_type', self.type or '')
+        span.set_attribute('paypal.pay_key_hash',
+                           tracing.key_hash(self.pay_key) or '')
+        span.set_attribute('paypal.status', self.status or '')
 
     @classmethod
     def process_int(cls, int_str, default='null'):
@@ -0,0 +1,123 @@
+"""
+Rate limiting of outbound calls to Paypal, shared between processes.
+
+Tokens are counted in the cache set by PAYPAL_RATE_LIMIT_CACHE_ALIAS, so all
+processes and nodes using the same cache draw from the same bucket. The bucket
+holds PAYPAL_RATE_LIMIT_BURST tokens and is refilled completely every
+burst / rate seconds. The windows are fixed, so up to twice the burst may be
+sent within a short time around a refill: keep the burst at or below half of
+what Paypal allows over that time.
+
+Each call has a priority. Lower priorities may only use a share of the bucket
+(see PAYPAL_RATE_LIMIT_SHARES), leaving the rest to interactive calls such as
+Pay during checkout. Use the ``priority`` context manager to mark background
+work:
+
+    with ratelimit.priority(ratelimit.PRIORITY_BACKGROUND):
+        payment.update()
+
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from paypaladaptive import settings
+from paypaladaptive import metrics
+from paypaladaptive.helpers import get_cache
+
+from .errors import RateLimitExceeded
+from . import deadline
+
+
+KEY_PREFIX = 'paypaladaptive:ratelimit'
+
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_DEFAULT = 'default'
+PRIORITY_BACKGROUND = 'background'
+
+_local = threading.local()
+
+
+@contextmanager
+def priority(value):
+    """Run all Paypal calls made within the block with the given priority"""
+    previous = getattr(_local, 'priority', None)
+    _local.priority = value
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def get_priority(default=PRIORITY_DEFAULT):
+    return getattr(_local, 'priority', None) or default
+
+
+class RateLimiter(object):
+
+    def __init__(self, name, rate, burst=None):
+        self.name = name
+        self.rate = float(rate)
+        self.burst = burst or int(math.ceil(self.rate))
+        self.window = self.burst / self.rate
+
+    def acquire(self, priority=PRIORITY_DEFAULT, max_wait=None):
+        """
+        Take a token from the bucket, waiting for the next refill if there are
+        none left for this priority. Raises RateLimitExceeded if that takes
+        longer than max_wait seconds. Returns the number of seconds waited.
+
+        """
+        cache = get_cache(settings.RATE_LIMIT_CACHE_ALIAS)
+        allowed = self.burst * settings.RATE_LIMIT_SHARES.get(priority, 1.0)
+        start = time.time()
+
+        while True:
+            now = time.time()
+            window = int(now / self.window)
+            key = '%s:%s:%s' % (KEY_PREFIX, self.name, window)
+
+            cache.add(key, 0, int(math.ceil(self.window)) + 1)
+            try:
+                used = cache.incr(key)
+            except ValueError:
+                # the window expired between add and incr
+                continue
+
+            if used <= allowed:
+                waited = now - start
+                metrics.observe('paypaladaptive_rate_limit_wait_seconds',
+                                waited, priority=priority)
+                return waited
+
+            # leave the token for calls with a higher priority
+            try:
+                cache.decr(key)
+            except ValueError:
+                pass
+
+            next_window = (window + 1) * self.window
+            if max_wait is not None and next_window - start > max_wait:
+                metrics.incr('paypaladaptive_rate_limit_rejected_total',
+                             priority=priority)
+                raise RateLimitExceeded(
+                    "Rate limit for %s exceeded, waited %.2f seconds"
+                    % (self.name, now - start))
+
+            time.sleep(max(next_window - now, 0))
+
+
+def get_limiter():
+    """Return the limiter for calls to Paypal, or None if it's disabled"""
+    if settings.RATE_LIMIT is None:
+        return None
+    return RateLimiter('api', settings.RATE_LIMIT, settings.RATE_LIMIT_BURST)
+
+
+def acquire(default_priority=PRIORITY_DEFAULT):
+    """Take a token for one call to Paypal if rate limiting is enabled"""
+    limiter = get_limiter()
+    if limiter is not None:
+        limiter.acquire(get_priority(default_priority),
+                        max_wait=deadline.bound(settings.RATE_LIMIT_MAX_WAIT))
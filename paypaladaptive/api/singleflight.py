@@ -0,0 +1,141 @@
+"""
+Coalescing of identical concurrent requests.
+
+Callers asking for the same key while a call for that key is in flight wait
+for it to finish and get its result, instead of making a call of their own.
+Calls are coalesced between threads of a process and, optionally, between
+processes using a lock in the Django cache.
+
+"""
+import copy
+import sys
+import threading
+import time
+import uuid
+
+from paypaladaptive import settings
+from paypaladaptive.helpers import get_cache
+
+from . import deadline
+from .errors import DeadlineExceeded
+
+
+KEY_PREFIX = 'paypaladaptive:singleflight'
+
+# How long the result of a call is kept around for waiting processes
+RESULT_TIMEOUT = 10
+POLL_INTERVAL = 0.05
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class Group(object):
+    """Coalesces calls between the threads of the current process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """
+        Call func and return its result, unless a call for key is already in
+        flight in which case a copy of its result is returned (or its
+        exception raised) instead. A call cut short by the deadline of the
+        caller that made it is made again, as the deadline of the waiting
+        caller may be later.
+
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+
+            if leader:
+                break
+
+            call.done.wait(deadline.bound(None))
+            if not call.done.is_set():
+                raise DeadlineExceeded('Deadline exceeded waiting for a '
+                                       'coalesced call')
+            if call.exc_info is None:
+                return copy.deepcopy(call.result)
+            if not isinstance(call.exc_info[1], DeadlineExceeded):
+                raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+
+        try:
+            call.result = func()
+        except Exception:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+    def in_flight(self, key):
+        return key in self._calls
+
+
+_group = Group()
+
+
+def do(key, func, across_processes=False):
+    """
+    Call func once for all identical concurrent requests. With
+    across_processes the result is also shared with other processes through
+    the cache configured by PAYPAL_COALESCE_CACHE_ALIAS, so it has to be
+    picklable.
+
+    """
+    if across_processes:
+        return _group.do(key, lambda: _do_shared(key, func))
+    return _group.do(key, func)
+
+
+def _do_shared(key, func):
+    cache = get_cache(settings.COALESCE_CACHE_ALIAS)
+    lock_key = '%s:lock:%s' % (KEY_PREFIX, key)
+    give_up = time.time() + deadline.bound(settings.COALESCE_TIMEOUT)
+
+    while time.time() < give_up:
+        token = uuid.uuid4().hex
+        if cache.add(lock_key, token, settings.COALESCE_TIMEOUT):
+            try:
+                result = func()
+                cache.set(_result_key(key, token), result, RESULT_TIMEOUT)
+                return result
+            finally:
+                cache.delete(lock_key)
+
+        # Another process is making the call, wait for it to finish
+        token = cache.get(lock_key)
+        while token is not None and time.time() < give_up:
+            result = cache.get(_result_key(key, token))
+            if result is not None:
+                return result
+
+            if cache.get(lock_key) != token:
+                # finished without a result, try to make the call ourselves
+                result = cache.get(_result_key(key, token))
+                if result is not None:
+                    return result
+                break
+
+            time.sleep(POLL_INTERVAL)
+
+    # Gave up on waiting for the other process
+    return func()
+
+
+def _result_key(key, token):
+    return '%s:result:%s:%s' % (KEY_PREFIX, key, token)
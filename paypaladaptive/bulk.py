@@ -0,0 +1,34 @@
+"""Helpers for making many calls to Paypal concurrently"""
+from multiprocessing.pool import ThreadPool
+
+from django.db import connection
+
+
+def run_concurrently(func, items, workers=1):
+    """
+    Call func for each item using a pool of worker threads and yield
+    (item, result) tuples in order of completion. With a single worker the
+    calls are made in the current thread.
+
+    Each worker thread uses its own database connection, which is closed once
+    it's done with an item.
+
+    """
+    if workers <= 1:
+        for item in items:
+            yield item, func(item)
+        return
+
+    def call(item):
+        try:
+            return item, func(item)
+        finally:
+            connection.close()
+
+    pool = ThreadPool(workers)
+    try:
+        for result in pool.imap_unordered(call, items):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
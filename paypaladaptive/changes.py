@@ -0,0 +1,47 @@
+"""
+Feed of the status changes of payments, preapprovals and refunds.
+
+Every status change is logged as a StatusTransition in the same transaction
+as the change itself. Their ids increase, so a consumer mirroring statuses
+only has to remember the id of the last change it has seen:
+
+    from paypaladaptive.changes import iter_changes
+
+    for change in iter_changes(since=cursor, object_types=['payment']):
+        mirror(change.object_id, change.status)
+        cursor = change.id
+
+Ids are assigned when a change is logged, not when it is committed, so a
+change may become visible after one with a higher id. Changes younger than
+PAYPAL_CHANGE_FEED_DELAY seconds are held back so that transactions still
+in flight can commit first.
+
+"""
+from datetime import timedelta
+
+from django.utils import timezone
+
+from . import settings
+from .models import StatusTransition
+
+
+def changes(since=0, limit=100, object_types=None):
+    """Return up to limit changes after the cursor since, oldest first"""
+    settled = timezone.now() - timedelta(seconds=settings.CHANGE_FEED_DELAY)
+    queryset = StatusTransition.objects.filter(pk__gt=since,
+                                               created_date__lte=settled)
+    if object_types:
+        queryset = queryset.filter(object_type__in=object_types)
+    return list(queryset.order_by('pk')[:limit])
+
+
+def iter_changes(since=0, batch_size=500, object_types=None):
+    """Iterate over all changes after the cursor since, in batches"""
+    while True:
+        batch = changes(since, batch_size, object_types)
+        for change in batch:
+            yield change
+
+        if len(batch) < batch_size:
+            return
+        since = batch[-1].pk
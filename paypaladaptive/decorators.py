@@ -1,24 +1,40 @@
 import logging
+import math
 
-from django.http import HttpResponseBadRequest
+from django.http import HttpResponseBadRequest, HttpResponse
 
+from . import logs, tracing
 from .api.ipn import IPN
-from .api import IpnError
+from .api import IpnError, PaypalUnavailableError
 
 
 logger = logging.getLogger(__name__)
 
 
 def takes_ipn(function):
+    @tracing.traced('paypaladaptive.ipn')
     def _view(request, *args, **kwargs):
         try:
             kwargs['ipn'] = IPN(request)
         except IpnError, e:
-            logger.warning("PayPal IPN verify failed: %s", e)
-            logger.debug("Request was: %s", request)
+            logs.log(logger, logging.WARNING, "PayPal IPN verify failed",
+                     path=request.path, error=e)
+            logs.log(logger, logging.DEBUG, "PayPal IPN request",
+                     path=request.path, post=logs.redacted(request.POST))
             return HttpResponseBadRequest('verify failed')
-
-        logger.debug("Incoming IPN call: %s", str(request))
+        except PaypalUnavailableError, e:
+            # Paypal resends IPNs that aren't acknowledged
+            logs.log(logger, logging.WARNING, "PayPal IPN not verified",
+                     path=request.path, error=e)
+            response = HttpResponse('verification unavailable', status=503)
+            response['Retry-After'] = int(math.ceil(e.retry_after))
+            return response
+
+        if logger.isEnabledFor(logging.DEBUG):
+            ipn = kwargs['ipn']
+            logs.log(logger, logging.DEBUG, "Incoming IPN call",
+                     path=request.path, type=ipn.type, status=ipn.status,
+                     trackingId=ipn.trackingId)
 
         return function(request, *args, **kwargs)
 
@@ -0,0 +1,774 @@
+"""
+Local stand-in for Paypal's Adaptive Payments and Adaptive Accounts APIs,
+for integration and load tests without the sandbox.
+
+Run it with
+
+    python -m paypaladaptive.emulator --port 8765 --latency 0.2 \\
+        --error-rate 0.01 --max-rps 50
+
+and point the app at it:
+
+    PAYPAL_ENDPOINT = 'http://127.0.0.1:8765/AdaptivePayments/'
+    PAYPAL_ENDPOINT_ACCOUNTS = 'http://127.0.0.1:8765/AdaptiveAccounts/'
+    PAYPAL_PAYMENT_HOST = 'http://127.0.0.1:8765/webscr'
+
+Pay, PaymentDetails, Preapproval, PreapprovalDetails, Refund,
+CancelPreapproval, ConvertCurrency and GetVerifiedStatus are implemented
+against payments and preapprovals kept in memory. Following next_url() to
+the payment host approves the payment or preapproval, sends the IPN to its
+ipnNotificationUrl and redirects to its returnUrl; Emulator.approve() does
+the same from code. The _notify-validate postback answers VERIFIED for IPNs
+sent by the emulator and INVALID for anything else.
+
+From tests, serve() runs the emulator in a background thread:
+
+    server = emulator.serve()
+    ...
+    server.shutdown()
+
+"""
+import logging
+import random
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+import uuid
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from optparse import OptionParser
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+
+from dateutil.parser import parse as parse_date
+from pytz import timezone, utc
+
+
+logger = logging.getLogger(__name__)
+
+PACIFIC = timezone('US/Pacific')
+
+MAX_RECEIVERS = 6
+
+ERROR_INTERNAL = '520002'
+ERROR_INVALID_PARAMETER = '580022'
+
+# units of each currency per US dollar, used by ConvertCurrency
+DEFAULT_RATES = {
+    'USD': Decimal('1'),
+    'AUD': Decimal('1.52'),
+    'CAD': Decimal('1.36'),
+    'EUR': Decimal('0.92'),
+    'GBP': Decimal('0.79'),
+    'HUF': Decimal('355'),
+    'JPY': Decimal('150'),
+    'SEK': Decimal('10.5'),
+    }
+
+OPERATIONS = {
+    'Pay': 'pay',
+    'PaymentDetails': 'payment_details',
+    'Preapproval': 'preapproval',
+    'PreapprovalDetails': 'preapproval_details',
+    'Refund': 'refund',
+    'CancelPreapproval': 'cancel_preapproval',
+    'ConvertCurrency': 'convert_currency',
+    'GetVerifiedStatus': 'get_verified_status',
+    }
+
+
+class EmulatorError(Exception):
+    """Makes the emulator answer with a Failure ack"""
+
+    def __init__(self, message, error_id=ERROR_INVALID_PARAMETER):
+        super(EmulatorError, self).__init__(message)
+        self.message = message
+        self.error_id = error_id
+
+
+def post_ipn(url, body):
+    """Send an IPN the way Paypal does"""
+    request = urllib2.Request(
+        url, data=body,
+        headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    return urllib2.urlopen(request, timeout=30).read()
+
+
+def _amount(value, name='amount'):
+    try:
+        amount = Decimal(str(value))
+    except (InvalidOperation, TypeError):
+        raise EmulatorError('Invalid request parameter: %s' % name)
+    if amount <= 0:
+        raise EmulatorError('Invalid request parameter: %s' % name)
+    return amount.quantize(Decimal('0.01'))
+
+
+def _bool(value):
+    return 'true' if value else 'false'
+
+
+def _ipn_date(moment=None):
+    moment = moment or datetime.utcnow().replace(tzinfo=utc)
+    return moment.astimezone(PACIFIC).strftime('%a %b %d %H:%M:%S %Z %Y')
+
+
+def _iso_date(value):
+    """Dates of preapprovals in IPNs, with Paypal's offset"""
+    moment = parse_date(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=utc)
+    return moment.astimezone(PACIFIC).isoformat()
+
+
+class Emulator(object):
+    """
+    WSGI application emulating Paypal.
+
+    latency is the number of seconds each request takes, or a (min, max)
+    range. error_rate is the share of API calls answered with an internal
+    error, and fail() makes the next calls of an operation fail. Over
+    max_rps requests per second are answered with 503 Service Unavailable.
+    IPNs are sent right away by ipn_sender(url, body), or after ipn_delay
+    seconds from a background thread.
+
+    """
+
+    def __init__(self, latency=0, error_rate=0, max_rps=None, rates=None,
+                 ipn_delay=None, ipn_sender=post_ipn, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_rps = max_rps
+        self.rates = dict(DEFAULT_RATES, **(rates or {}))
+        self.ipn_delay = ipn_delay
+        self.ipn_sender = ipn_sender
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget all payments, preapprovals, IPNs and injected failures"""
+        with self._lock:
+            self.payments = {}
+            self.preapprovals = {}
+            self.calls = []
+            self.sent_ipns = set()
+            self._failures = {}
+            self._outbox = []
+            self._window = (0, 0)
+
+    def fail(self, operation, times=1, message='Internal Error'):
+        """Answer the next times calls of operation with an error"""
+        with self._lock:
+            self._failures[operation] = (times, message)
+
+    # WSGI
+
+    def __call__(self, environ, start_response):
+        if self._throttled():
+            start_response('503 Service Unavailable',
+                           [('Content-Type', 'text/plain'),
+                            ('Retry-After', '1')])
+            return ['Too many requests']
+
+        self._sleep()
+
+        query = urlparse.parse_qs(environ.get('QUERY_STRING', ''))
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = environ['wsgi.input'].read(length) if length else ''
+        cmd = query.get('cmd', [''])[0]
+
+        if cmd == '_notify-validate':
+            return self._respond(start_response, '200 OK', 'text/plain',
+                                 self.validate_ipn(body))
+
+        if cmd in ('_ap-payment', '_ap-preapproval'):
+            key = (query.get('paykey') or query.get('preapprovalkey')
+                   or [''])[0]
+            try:
+                return_url = self.approve(key)
+            except (KeyError, EmulatorError), e:
+                return self._respond(start_response, '404 Not Found',
+                                     'text/plain', str(e))
+            start_response('302 Found', [('Location', return_url)])
+            return ['']
+
+        operation = environ.get('PATH_INFO', '').rstrip('/').rsplit('/')[-1]
+        if operation not in OPERATIONS:
+            return self._respond(start_response, '404 Not Found',
+                                 'text/plain', 'Unknown operation')
+
+        try:
+            data = json.loads(body or '{}')
+        except ValueError:
+            data = None
+        response = self.call(operation, data)
+        return self._respond(start_response, '200 OK', 'application/json',
+                             json.dumps(response))
+
+    def _respond(self, start_response, status, content_type, body):
+        start_response(status, [('Content-Type', content_type),
+                                ('Content-Length', str(len(body)))])
+        return [body]
+
+    def _throttled(self):
+        if self.max_rps is None:
+            return False
+        second = int(time.time())
+        with self._lock:
+            start, count = self._window
+            if start != second:
+                start, count = second, 0
+            self._window = (start, count + 1)
+        return count >= self.max_rps
+
+    def _sleep(self):
+        latency = self.latency
+        if isinstance(latency, (list, tuple)):
+            latency = self.random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+    # API
+
+    def call(self, operation, data):
+        """Answer a call of operation with request data as Paypal would"""
+        with self._lock:
+            self.calls.append((operation, data))
+            try:
+                if not isinstance(data, dict):
+                    raise EmulatorError('Invalid request')
+                self._inject_failure(operation)
+                response = getattr(self, OPERATIONS[operation])(data)
+            except EmulatorError, e:
+                response = self._envelope('Failure')
+                response['error'] = [{
+                    'errorId': e.error_id,
+                    'domain': 'PLATFORM',
+                    'subdomain': 'Application',
+                    'severity': 'Error',
+                    'category': 'Application',
+                    'message': e.message,
+                    }]
+            else:
+                response.update(self._envelope('Success'))
+            outbox, self._outbox = self._outbox, []
+
+        self._send_ipns(outbox)
+        return response
+
+    def _inject_failure(self, operation):
+        times, message = self._failures.get(operation, (0, None))
+        if times:
+            self._failures[operation] = (times - 1, message)
+            raise EmulatorError(message, ERROR_INTERNAL)
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise EmulatorError('Internal Error', ERROR_INTERNAL)
+
+    def _envelope(self, ack):
+        return {'responseEnvelope': {
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'ack': ack,
+            'correlationId': uuid.uuid4().hex[:13],
+            'build': 'emulator',
+            }}
+
+    def _key(self, prefix):
+        return '%s-%s' % (prefix, uuid.uuid4().hex[:17].upper())
+
+    def pay(self, data):
+        currency = data.get('currencyCode')
+        if currency not in self.rates:
+            raise EmulatorError('Invalid request parameter: currencyCode')
+
+        raw_receivers = data.get('receiverList', {}).get('receiver') or []
+        if not 0 < len(raw_receivers) <= MAX_RECEIVERS:
+            raise EmulatorError('Invalid request parameter: receiverList')
+        receivers = [{'email': r.get('email'),
+                      'amount': _amount(r.get('amount'), 'receiver.amount'),
+                      'primary': r.get('primary') in (True, 'true')}
+                     for r in raw_receivers]
+        if len([r for r in receivers if r['primary']]) > 1:
+            raise EmulatorError('There can only be one primary receiver')
+
+        tracking_id = data.get('trackingId')
+        if tracking_id and any(p['trackingId'] == tracking_id
+                               for p in self.payments.values()):
+            raise EmulatorError('Invalid request parameter: trackingId is '
+                                'not unique')
+
+        payment = {
+            'payKey': self._key('AP'),
+            'status': 'CREATED',
+            'actionType': data.get('actionType', 'PAY'),
+            'currencyCode': currency,
+            'receivers': receivers,
+            'refunded': {},
+            'senderEmail': data.get('senderEmail'),
+            'trackingId': tracking_id,
+            'memo': data.get('memo'),
+            'returnUrl': data.get('returnUrl'),
+            'cancelUrl': data.get('cancelUrl'),
+            'ipnNotificationUrl': data.get('ipnNotificationUrl'),
+            'date': datetime.utcnow().replace(tzinfo=utc),
+            }
+
+        if data.get('preapprovalKey'):
+            self._charge_preapproval(data['preapprovalKey'], payment)
+        if payment['senderEmail']:
+            # implicit approval or charged with a preapproval
+            self._complete_payment(payment)
+
+        self.payments[payment['payKey']] = payment
+        return {'payKey': payment['payKey'],
+                'paymentExecStatus': payment['status']}
+
+    def _charge_preapproval(self, key, payment):
+        preapproval = self.preapprovals.get(key)
+        if preapproval is None:
+            raise EmulatorError('Invalid request parameter: preapprovalKey')
+        if (preapproval['status'] != 'ACTIVE'
+                or not preapproval['approved']):
+            raise EmulatorError('The preapproval key has not been '
+                                'authorized or is not active')
+        if preapproval['currencyCode'] != payment['currencyCode']:
+            raise EmulatorError('The currency does not match the '
+                                'preapproval')
+
+        total = sum(r['amount'] for r in payment['receivers'])
+        max_number = preapproval['maxNumberOfPayments']
+        if max_number is not None and preapproval['curPayments'] >= max_number:
+            raise EmulatorError('The maximum number of payments for this '
+                                'preapproval has been reached')
+        if (preapproval['curPaymentsAmount'] + total
+                > preapproval['maxTotalAmountOfAllPayments']):
+            raise EmulatorError('The total amount of all payments exceeds '
+                                'the maximum total amount')
+
+        preapproval['curPayments'] += 1
+        preapproval['curPaymentsAmount'] += total
+        preapproval['curPeriodAttempts'] += 1
+        payment['senderEmail'] = preapproval['senderEmail']
+
+    def _complete_payment(self, payment):
+        payment['status'] = 'COMPLETED'
+        for receiver in payment['receivers']:
+            receiver['transactionId'] = uuid.uuid4().hex[:17].upper()
+
+        fields = {
+            'transaction_type': 'Adaptive Payment PAY',
+            'status': 'COMPLETED',
+            'pay_key': payment['payKey'],
+            'action_type': payment['actionType'],
+            'sender_email': payment['senderEmail'] or '',
+            'fees_payer': 'EACHRECEIVER',
+            'payment_request_date': _ipn_date(payment['date']),
+            'reverse_all_parallel_payments_on_error': 'false',
+            'return_url': payment['returnUrl'] or '',
+            'cancel_url': payment['cancelUrl'] or '',
+            'ipn_notification_url': payment['ipnNotificationUrl'] or '',
+            'charset': 'windows-1252',
+            'notify_version': 'UNVERSIONED',
+            'verify_sign': uuid.uuid4().hex,
+            }
+        if payment['trackingId']:
+            fields['trackingId'] = payment['trackingId']
+        if payment['memo']:
+            fields['memo'] = payment['memo']
+        for i, receiver in enumerate(payment['receivers']):
+            prefix = 'transaction[%s].' % i
+            fields.update({
+                prefix + 'id': receiver['transactionId'],
+                prefix + 'id_for_sender_txn': receiver['transactionId'],
+                prefix + 'receiver': receiver['email'],
+                prefix + 'amount': '%s %s' % (payment['currencyCode'],
+                                              receiver['amount']),
+                prefix + 'status': 'Completed',
+                prefix + 'status_for_sender_txn': 'Completed',
+                prefix + 'is_primary_receiver': _bool(receiver['primary']),
+                prefix + 'pending_reason': 'NONE',
+                })
+        self._queue_ipn(payment['ipnNotificationUrl'], fields)
+
+    def payment_details(self, data):
+        payment = self.payments.get(data.get('payKey'))
+        if payment is None and data.get('trackingId'):
+            for candidate in self.payments.values():
+                if candidate['trackingId'] == data['trackingId']:
+                    payment = candidate
+        if payment is None:
+            raise EmulatorError('Invalid request parameter: payKey')
+
+        infos = []
+        for receiver in payment['receivers']:
+            info = {'receiver': {'email': receiver['email'],
+                                 'amount': str(receiver['amount']),
+                                 'primary': _bool(receiver['primary'])},
+                    'pendingRefund': 'false'}
+            if 'transactionId' in receiver:
+                refunded = payment['refunded'].get(receiver['email'])
+                info.update({
+                    'transactionId': receiver['transactionId'],
+                    'senderTransactionId': receiver['transactionId'],
+                    'transactionStatus': ('REFUNDED' if refunded
+                                          else 'COMPLETED'),
+                    'senderTransactionStatus': 'COMPLETED',
+                    })
+                if refunded:
+                    info['refundedAmount'] = str(refunded)
+            infos.append(info)
+
+        response = dict((k, payment[k]) for k in (
+            'payKey', 'status', 'actionType', 'currencyCode', 'trackingId',
+            'memo', 'senderEmail', 'returnUrl', 'cancelUrl',
+            'ipnNotificationUrl') if payment[k] is not None)
+        response.update({'feesPayer': 'EACHRECEIVER',
+                         'reverseAllParallelPaymentsOnError': 'false',
+                         'paymentInfoList': {'paymentInfo': infos}})
+        return response
+
+    def preapproval(self, data):
+        currency = data.get('currencyCode')
+        if currency not in self.rates:
+            raise EmulatorError('Invalid request parameter: currencyCode')
+        if not data.get('startingDate') or not data.get('endingDate'):
+            raise EmulatorError('Invalid request parameter: startingDate')
+        max_number = data.get('maxNumberOfPayments')
+
+        preapproval = {
+            'preapprovalKey': self._key('PA'),
+            'status': 'ACTIVE',
+            'approved': False,
+            'currencyCode': currency,
+            'maxTotalAmountOfAllPayments': _amount(
+                data.get('maxTotalAmountOfAllPayments'),
+                'maxTotalAmountOfAllPayments'),
+            'maxNumberOfPayments': (int(max_number)
+                                    if max_number is not None else None),
+            'curPayments': 0,
+            'curPaymentsAmount': Decimal('0.00'),
+            'curPeriodAttempts': 0,
+            'startingDate': data['startingDate'],
+            'endingDate': data['endingDate'],
+            'pinType': data.get('pinType', 'NOT_REQUIRED'),
+            'senderEmail': data.get('senderEmail'),
+            'returnUrl': data.get('returnUrl'),
+            'cancelUrl': data.get('cancelUrl'),
+            'ipnNotificationUrl': data.get('ipnNotificationUrl'),
+            }
+        self.preapprovals[preapproval['preapprovalKey']] = preapproval
+        return {'preapprovalKey': preapproval['preapprovalKey']}
+
+    def _preapproval_ipn(self, preapproval):
+        fields = {
+            'transaction_type': 'Adaptive Payment PREAPPROVAL',
+            'status': preapproval['status'],
+            'approved': _bool(preapproval['approved']),
+            'preapproval_key': preapproval['preapprovalKey'],
+            'sender_email': preapproval['senderEmail'] or '',
+            'currency_code': preapproval['currencyCode'],
+            'max_total_amount_of_all_payments': str(
+                preapproval['maxTotalAmountOfAllPayments']),
+            'current_number_of_payments': str(preapproval['curPayments']),
+            'current_total_amount_of_all_payments': '%s %s' % (
+                preapproval['currencyCode'],
+                preapproval['curPaymentsAmount']),
+            'current_period_attempts': str(preapproval['curPeriodAttempts']),
+            'starting_date': _iso_date(preapproval['startingDate']),
+            'ending_date': _iso_date(preapproval['endingDate']),
+            'pin_type': preapproval['pinType'],
+            'payment_period': 'NO_PERIOD_SPECIFIED',
+            'day_of_week': 'NO_DAY_SPECIFIED',
+            'date_of_month': '0',
+            'return_url': preapproval['returnUrl'] or '',
+            'cancel_url': preapproval['cancelUrl'] or '',
+            'ipn_notification_url': preapproval['ipnNotificationUrl'] or '',
+            'charset': 'windows-1252',
+            'notify_version': 'UNVERSIONED',
+            'verify_sign': uuid.uuid4().hex,
+            }
+        if preapproval['maxNumberOfPayments'] is not None:
+            fields['max_number_of_payments'] = str(
+                preapproval['maxNumberOfPayments'])
+        self._queue_ipn(preapproval['ipnNotificationUrl'], fields)
+
+    def preapproval_details(self, data):
+        preapproval = self.preapprovals.get(data.get('preapprovalKey'))
+        if preapproval is None:
+            raise EmulatorError('Invalid request parameter: preapprovalKey')
+
+        response = dict((k, preapproval[k]) for k in (
+            'status', 'currencyCode', 'startingDate', 'endingDate',
+            'pinType', 'senderEmail', 'returnUrl', 'cancelUrl',
+            'ipnNotificationUrl') if preapproval[k] is not None)
+        response.update({
+            'approved': _bool(preapproval['approved']),
+            'curPayments': str(preapproval['curPayments']),
+            'curPaymentsAmount': str(preapproval['curPaymentsAmount']),
+            'curPeriodAttempts': str(preapproval['curPeriodAttempts']),
+            'maxTotalAmountOfAllPayments': str(
+                preapproval['maxTotalAmountOfAllPayments']),
+            })
+        if preapproval['maxNumberOfPayments'] is not None:
+            response['maxNumberOfPayments'] = str(
+                preapproval['maxNumberOfPayments'])
+        return response
+
+    def refund(self, data):
+        payment = self.payments.get(data.get('payKey'))
+        if payment is None:
+            raise EmulatorError('Invalid request parameter: payKey')
+        if payment['status'] != 'COMPLETED':
+            raise EmulatorError('The payment has not been completed')
+
+        amounts = dict((r['email'], r['amount'])
+                       for r in payment['receivers'])
+        requested = data.get('receiverList', {}).get('receiver')
+        if requested is None:
+            requested = [{'email': email,
+                          'amount': amount - payment['refunded'].get(email, 0)}
+                         for email, amount in amounts.items()]
+
+        infos = []
+        for receiver in requested:
+            email = receiver.get('email')
+            amount = Decimal(str(receiver.get('amount', 0)))
+            refunded = payment['refunded'].get(email, Decimal('0.00'))
+            if email not in amounts:
+                status = 'NOT_PROCESSED'
+            elif refunded >= amounts[email]:
+                status = 'ALREADY_REVERSED_OR_REFUNDED'
+            elif amount <= 0 or refunded + amount > amounts[email]:
+                status = 'NOT_PROCESSED'
+            else:
+                status = 'REFUNDED'
+                payment['refunded'][email] = refunded + amount
+            infos.append({'receiver': {'email': email,
+                                       'amount': str(amounts.get(email, 0))},
+                          'refundStatus': status,
+                          'refundNetAmount': str(amount),
+                          'refundGrossAmount': str(amount)})
+
+        full = all(payment['refunded'].get(email, 0) >= amount
+                   for email, amount in amounts.items())
+        for info in infos:
+            info['refundHasBecomeFull'] = _bool(full)
+
+        return {'currencyCode': payment['currencyCode'],
+                'refundInfoList': {'refundInfo': infos}}
+
+    def cancel_preapproval(self, data):
+        preapproval = self.preapprovals.get(data.get('preapprovalKey'))
+        if preapproval is None:
+            raise EmulatorError('Invalid request parameter: preapprovalKey')
+
+        preapproval['status'] = 'CANCELED'
+        self._preapproval_ipn(preapproval)
+        return {}
+
+    def convert_currency(self, data):
+        base_amounts = data.get('baseAmountList', {}).get('currency') or []
+        codes = data.get('convertToCurrencyList', {}).get('currencyCode')
+        if isinstance(codes, basestring):
+            codes = [codes]
+        if not base_amounts or not codes:
+            raise EmulatorError('Invalid request parameter: baseAmountList')
+        for code in [a.get('code') for a in base_amounts] + list(codes):
+            if code not in self.rates:
+                raise EmulatorError('Invalid request parameter: currency '
+                                    'code %s' % code)
+
+        conversions = []
+        for base in base_amounts:
+            amount = _amount(base.get('amount'))
+            dollars = amount / self.rates[base['code']]
+            conversions.append({
+                'baseAmount': {'code': base['code'], 'amount': str(amount)},
+                'currencyList': {'currency': [
+                    {'code': code,
+                     'amount': str((dollars * self.rates[code])
+                                   .quantize(Decimal('0.01')))}
+                    for code in codes]},
+                })
+        return {'estimatedAmountTable': {
+            'currencyConversionList': conversions}}
+
+    def get_verified_status(self, data):
+        if not data.get('emailAddress'):
+            raise EmulatorError('Invalid request parameter: emailAddress')
+        return {'accountStatus': 'VERIFIED',
+                'userInfo': {
+                    'emailAddress': data['emailAddress'],
+                    'accountType': 'PERSONAL',
+                    'accountId': uuid.uuid4().hex[:13].upper(),
+                    'name': {'firstName': data.get('firstName', ''),
+                             'lastName': data.get('lastName', '')}}}
+
+    # Approval and IPNs
+
+    def approve(self, key, sender_email='buyer@example.com'):
+        """
+        Approve a payment or preapproval as the user would on Paypal,
+        sending its IPN. Returns the URL the user is sent back to.
+
+        """
+        with self._lock:
+            if key in self.payments:
+                payment = self.payments[key]
+                if payment['status'] != 'CREATED':
+                    raise EmulatorError('The payment is %s'
+                                        % payment['status'])
+                payment['senderEmail'] = sender_email
+                self._complete_payment(payment)
+                return_url = payment['returnUrl']
+            else:
+                preapproval = self.preapprovals[key]
+                if preapproval['status'] != 'ACTIVE':
+                    raise EmulatorError('The preapproval is %s'
+                                        % preapproval['status'])
+                preapproval['approved'] = True
+                preapproval['senderEmail'] = sender_email
+                self._preapproval_ipn(preapproval)
+                return_url = preapproval['returnUrl']
+            outbox, self._outbox = self._outbox, []
+
+        self._send_ipns(outbox)
+        return return_url
+
+    def _queue_ipn(self, url, fields):
+        if not url:
+            return
+        body = urllib.urlencode(sorted(fields.items()))
+        self.sent_ipns.add(body)
+        self._outbox.append((url, body))
+
+    def _send_ipns(self, outbox):
+        for url, body in outbox:
+            if self.ipn_delay is None:
+                self._send_ipn(url, body)
+            else:
+                timer = threading.Timer(self.ipn_delay, self._send_ipn,
+                                        (url, body))
+                timer.daemon = True
+                timer.start()
+
+    def _send_ipn(self, url, body):
+        try:
+            self.ipn_sender(url, body)
+        except Exception, e:
+            logger.warning('Could not send IPN to %s: %s', url, e)
+
+    def validate_ipn(self, body):
+        """Answer of the _notify-validate postback"""
+        with self._lock:
+            return 'VERIFIED' if body in self.sent_ipns else 'INVALID'
+
+    # In process
+
+    def request_class(self):
+        """
+        A stand-in for UrlRequest calling the emulator in process rather
+        than over HTTP, to patch paypaladaptive.api.endpoints.UrlRequest
+        with in tests.
+
+        """
+        emulator = self
+
+        class EmulatorRequest(object):
+            timings = {}
+
+            def call(self, url, data=None, headers=None):
+                parts = urlparse.urlsplit(url)
+                body = data or ''
+                environ = {
+                    'REQUEST_METHOD': 'GET' if data is None else 'POST',
+                    'PATH_INFO': parts.path,
+                    'QUERY_STRING': parts.query,
+                    'CONTENT_LENGTH': str(len(body)),
+                    'wsgi.input': StringIO(body),
+                    }
+                statuses = []
+                response = ''.join(emulator(
+                    environ, lambda status, headers: statuses.append(status)))
+                code, reason = statuses[0].split(' ', 1)
+
+                # answered like urllib2 answers HTTP errors
+                if int(code) >= 400:
+                    self.code, self.response = None, reason
+                else:
+                    self.code, self.response = int(code), response
+                return self
+
+        return EmulatorRequest
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve(emulator=None, host='127.0.0.1', port=0):
+    """
+    Serve the emulator from a background thread. Returns the server, with
+    the root URL as server.url and the emulator as server.emulator. Stop it
+    with server.shutdown().
+
+    """
+    if emulator is None:
+        emulator = Emulator()
+
+    server = make_server(host, port, emulator,
+                         server_class=ThreadingWSGIServer,
+                         handler_class=QuietHandler)
+    server.emulator = emulator
+    server.url = 'http://%s:%s/' % (host, server.server_port)
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = OptionParser(description='Emulate Paypal Adaptive APIs')
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=8765)
+    parser.add_option('--latency', type='float', default=0,
+                      help='seconds each request takes')
+    parser.add_option('--latency-max', type='float', default=None,
+                      help='spread latency up to this many seconds')
+    parser.add_option('--error-rate', type='float', default=0,
+                      help='share of calls answered with an error')
+    parser.add_option('--max-rps', type='int', default=None,
+                      help='requests per second before answering 503')
+    parser.add_option('--ipn-delay', type='float', default=None,
+                      help='seconds to wait before sending IPNs')
+    options, args = parser.parse_args()
+
+    latency = options.latency
+    if options.latency_max is not None:
+        latency = (options.latency, options.latency_max)
+
+    emulator = Emulator(latency=latency, error_rate=options.error_rate,
+                        max_rps=options.max_rps,
+                        ipn_delay=options.ipn_delay)
+    server = make_server(options.host, options.port, emulator,
+                         server_class=ThreadingWSGIServer)
+    print 'Emulating Paypal on http://%s:%s/' % (options.host, options.port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
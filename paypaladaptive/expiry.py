@@ -0,0 +1,86 @@
+"""
+Expiry of stale payments and preapprovals.
+
+Paykeys expire a few hours after the payment was created and a preapproval
+can't be used after its valid_until_date. sweep() moves such rows to the
+expired status so queries for pending objects, reconciliation and delayed
+updates only see live objects. Run it periodically, e.g. with the
+expire_stale celery task:
+
+    CELERYBEAT_SCHEDULE = {
+        'paypal-expiry': {
+            'task': 'paypaladaptive.tasks.expire_stale',
+            'schedule': timedelta(minutes=15),
+        },
+    }
+
+Rows are expired with bulk UPDATEs of at most PAYPAL_EXPIRY_BATCH_SIZE rows,
+selected on the indexed created_date and valid_until_date columns, so locks
+are held briefly even when there is a large backlog. The changes are logged
+as StatusTransitions, but no status signals are sent.
+
+"""
+from django.utils import timezone
+
+from . import settings, metrics, statuscache
+from .models import Payment, Preapproval, StatusTransition
+from .transactions import atomic
+
+
+EXPIRING_PAYMENT_STATUSES = ('created',)
+EXPIRING_PREAPPROVAL_STATUSES = ('created', 'returned', 'approved')
+
+
+def _expire(queryset, statuses, batch_size):
+    """Expire the rows of queryset in batches, return the number expired"""
+    queryset = queryset.filter(status__in=statuses)
+    expired = 0
+
+    while True:
+        with atomic():
+            rows = list(queryset.select_for_update()
+                                .values_list('pk', 'status')[:batch_size])
+            if not rows:
+                break
+
+            ids = [pk for pk, __ in rows]
+            expired += (queryset.model.objects.filter(pk__in=ids)
+                                              .update(status='expired'))
+            StatusTransition.log_many(queryset.model, rows, 'expired')
+
+        statuscache.forget(queryset.model, ids)
+
+        if len(rows) < batch_size:
+            break
+
+    return expired
+
+
+def expire_payments(now=None, batch_size=None):
+    now = now or timezone.now()
+    queryset = Payment.objects.filter(
+        created_date__lt=now - settings.PAYMENT_EXPIRY)
+    return _expire(queryset, EXPIRING_PAYMENT_STATUSES,
+                   batch_size or settings.EXPIRY_BATCH_SIZE)
+
+
+def expire_preapprovals(now=None, batch_size=None):
+    now = now or timezone.now()
+    queryset = Preapproval.objects.filter(valid_until_date__lt=now)
+    return _expire(queryset, EXPIRING_PREAPPROVAL_STATUSES,
+                   batch_size or settings.EXPIRY_BATCH_SIZE)
+
+
+def sweep(now=None, batch_size=None):
+    """
+    Expire stale payments and preapprovals, return the number of expired
+    rows of each, e.g. {'payments': 12, 'preapprovals': 3}.
+
+    """
+    counts = {'payments': expire_payments(now, batch_size),
+              'preapprovals': expire_preapprovals(now, batch_size)}
+
+    for model, count in counts.items():
+        metrics.incr('paypaladaptive_expired_total', count, model=model)
+
+    return counts
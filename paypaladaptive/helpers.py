@@ -1,5 +1,23 @@
 from django.conf import settings
+try:
+    from django.core.cache import caches
+except ImportError:  # Django < 1.7
+    from django.core.cache import get_cache as _get_cache
+    caches = None
+
+
+_cache_instances = {}
 
 
 def get_http_protocol():
     return getattr(settings, 'DEFAULT_HTTP_PROTOCOL', 'http')
+
+
+def get_cache(alias):
+    """Return the Django cache backend configured under ``alias``."""
+    if caches is not None:
+        return caches[alias]
+
+    if alias not in _cache_instances:
+        _cache_instances[alias] = _get_cache(alias)
+    return _cache_instances[alias]
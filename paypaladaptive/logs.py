@@ -0,0 +1,120 @@
+"""
+Structured logging.
+
+Log records are a short message followed by key=value fields:
+
+    logs.log(logger, logging.DEBUG, 'Paypal call', endpoint='Pay',
+             duration=0.412, ack='Success')
+
+Nothing is formatted unless the logger is enabled for the level, and
+values wrapped in ``lazy`` or ``redacted`` are only turned into strings
+when the record is emitted. The fields are also set on the record as
+``record.fields`` for handlers that write them out as JSON.
+
+Credentials and email addresses are replaced by ``redact``.
+
+"""
+import re
+
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+REDACTED = '********'
+
+SENSITIVE_KEYS = frozenset([
+    'x-paypal-security-userid',
+    'x-paypal-security-password',
+    'x-paypal-security-signature',
+    'password',
+    'signature',
+    ])
+
+EMAIL_RE = re.compile(r'[^@\s"\'<>,;:]+@([^@\s"\'<>,;:]+)')
+
+
+def _text(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def _redact_email(match):
+    return '***@%s' % match.group(1)
+
+
+def redact(value):
+    """
+    Returns a copy of value with credentials and email addresses replaced,
+    descending into dicts, lists and tuples.
+
+    """
+    if isinstance(value, dict):
+        return dict((k, REDACTED if str(k).lower() in SENSITIVE_KEYS
+                     else redact(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if isinstance(value, basestring):
+        return EMAIL_RE.sub(_redact_email, value)
+    return value
+
+
+class lazy(object):
+    """Defers calling function(*args) until the value is formatted"""
+
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+
+    def __str__(self):
+        return _text(self.function(*self.args))
+
+
+def _redacted_json(value):
+    if isinstance(value, basestring):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return redact(value)
+    return json.dumps(redact(value), cls=DjangoJSONEncoder, sort_keys=True)
+
+
+def redacted(value):
+    """
+    Lazily formats value, a dict or a JSON string, as redacted JSON
+
+    """
+    return lazy(_redacted_json, value)
+
+
+class Fields(object):
+    """Formats fields as key=value pairs when the record is emitted"""
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        pairs = []
+        for key in sorted(self.fields):
+            value = self.fields[key]
+            if value is None:
+                continue
+            if isinstance(value, float):
+                value = '%.3f' % value
+            else:
+                value = _text(value)
+                if not value or ' ' in value or '"' in value:
+                    value = json.dumps(value)
+            pairs.append('%s=%s' % (key, value))
+        return ' '.join(pairs)
+
+
+def log(logger, level, message, **fields):
+    """Log message with fields, if logger is enabled for level"""
+    if logger.isEnabledFor(level):
+        logger.log(level, '%s %s', message, Fields(fields),
+                   extra={'fields': fields})
@@ -0,0 +1,78 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dateutil.parser import parse as parse_date
+
+from paypaladaptive.models import IPNLog
+from paypaladaptive.replay import VERIFIED, replay, report
+
+
+class Command(BaseCommand):
+    help = ('Replay logged IPNs Paypal verified through the IPN view '
+            'without verifying them again, and report latencies and '
+            'changed outcomes.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--since', help='only IPNs logged from this date'),
+        make_option('--until', help='only IPNs logged before this date'),
+        make_option('--path', help='only IPNs to paths containing this'),
+        make_option('--status', help='only IPNs answered with this status '
+                                     'code, or "none" if never answered'),
+        make_option('--limit', type='int', help='replay at most this many'),
+        make_option('--processes', type='int', default=1,
+                    help='replay from a pool of this many processes'),
+        make_option('--rate', type='float',
+                    help='replay at most this many IPNs per second'),
+    )
+
+    def handle(self, *args, **options):
+        ipn_logs = IPNLog.objects.all()
+
+        try:
+            if options['since']:
+                ipn_logs = ipn_logs.filter(
+                    created_date__gte=parse_date(options['since']))
+            if options['until']:
+                ipn_logs = ipn_logs.filter(
+                    created_date__lt=parse_date(options['until']))
+        except ValueError, e:
+            raise CommandError('Invalid date: %s' % e)
+
+        if options['path']:
+            ipn_logs = ipn_logs.filter(path__contains=options['path'])
+
+        status = options['status']
+        if status is not None:
+            if status.lower() == 'none':
+                ipn_logs = ipn_logs.filter(return_status_code=None)
+            elif status.isdigit():
+                ipn_logs = ipn_logs.filter(return_status_code=int(status))
+            else:
+                raise CommandError('Invalid status: %s' % status)
+
+        if options['limit']:
+            ipn_logs = IPNLog.objects.filter(pk__in=list(
+                ipn_logs.order_by('pk').values_list('pk', flat=True)
+                [:options['limit']]))
+
+        skipped = ipn_logs.exclude(verify_request_response=VERIFIED).count()
+        summary = report(replay(ipn_logs, processes=options['processes'],
+                                rate=options['rate']))
+
+        if skipped:
+            self.stdout.write("Skipped %s IPNs Paypal didn't verify"
+                              % skipped)
+        self.stdout.write('Replayed %s IPNs' % summary['replayed'])
+        for status_code, count in sorted(summary['counts'].items()):
+            self.stdout.write('  %s: %s' % (status_code, count))
+
+        if summary['latency']:
+            self.stdout.write('Latency ' + ', '.join(
+                '%s %.1fms' % (name, summary['latency'][name] * 1000)
+                for name in ('p50', 'p90', 'p99', 'max')))
+
+        self.stdout.write('%s answered differently' % len(summary['changed']))
+        for pk, logged, status_code in summary['changed']:
+            self.stdout.write('  IPNLog %s: %s -> %s'
+                              % (pk, logged, status_code))
@@ -0,0 +1,207 @@
+"""
+In-process metrics about calls to Paypal.
+
+Counters and gauges are kept per name and label set. Observed values are
+summarized as count, sum and max, and latencies are kept as histograms.
+
+Metrics can be exported in the Prometheus text format with
+render_prometheus() (served by the metrics view if PAYPAL_METRICS_VIEW is
+set), and are passed on to the sinks listed in PAYPAL_METRICS_SINKS, e.g. to
+forward them to statsd. Nothing is recorded if PAYPAL_METRICS_ENABLED is
+False.
+
+"""
+import threading
+
+try:
+    from django.utils.module_loading import import_string
+except ImportError:
+    from django.utils.module_loading import import_by_path as import_string
+
+from . import settings
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.gauges = {}
+            self.summaries = {}
+            self.histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def incr(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            count, total, maximum = self.summaries.get(key, (0, 0, value))
+            self.summaries[key] = (count + 1, total + value,
+                                   max(maximum, value))
+
+    def histogram(self, name, value, **labels):
+        key = self._key(name, labels)
+        buckets = settings.METRICS_BUCKETS
+        with self._lock:
+            counts, total = self.histograms.get(
+                key, ([0] * (len(buckets) + 1), 0))
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    break
+            else:
+                i = len(buckets)
+            counts[i] += 1
+            self.histograms[key] = (counts, total + value)
+
+    def snapshot(self):
+        """Return a copy of all metrics as a dict"""
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'summaries': dict(self.summaries),
+                'histograms': dict((key, (list(counts), total))
+                                   for key, (counts, total)
+                                   in self.histograms.items()),
+            }
+
+
+class Sink(object):
+    """
+    Base class for sinks set with PAYPAL_METRICS_SINKS. Each method gets the
+    metric name, the value and a dict of labels.
+
+    """
+
+    def incr(self, name, value, labels):
+        pass
+
+    def set_gauge(self, name, value, labels):
+        pass
+
+    def observe(self, name, value, labels):
+        pass
+
+    def histogram(self, name, value, labels):
+        pass
+
+
+registry = Registry()
+
+_sinks = (None, [])
+_sinks_lock = threading.Lock()
+
+
+def get_sinks():
+    global _sinks
+    paths, sinks = _sinks
+    if paths != settings.METRICS_SINKS:
+        with _sinks_lock:
+            paths = list(settings.METRICS_SINKS)
+            sinks = [import_string(path)() for path in paths]
+            _sinks = (paths, sinks)
+    return sinks
+
+
+def incr(name, value=1, **labels):
+    if settings.METRICS_ENABLED:
+        registry.incr(name, value, **labels)
+        for sink in get_sinks():
+            sink.incr(name, value, labels)
+
+
+def set_gauge(name, value, **labels):
+    if settings.METRICS_ENABLED:
+        registry.set_gauge(name, value, **labels)
+        for sink in get_sinks():
+            sink.set_gauge(name, value, labels)
+
+
+def observe(name, value, **labels):
+    if settings.METRICS_ENABLED:
+        registry.observe(name, value, **labels)
+        for sink in get_sinks():
+            sink.observe(name, value, labels)
+
+
+def histogram(name, value, **labels):
+    if settings.METRICS_ENABLED:
+        registry.histogram(name, value, **labels)
+        for sink in get_sinks():
+            sink.histogram(name, value, labels)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, unicode(value).replace('\\', '\\\\')
+                                         .replace('"', '\\"')
+                                         .replace('\n', '\\n'))
+        for name, value in labels)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render_prometheus(snapshot=None):
+    """Render the metrics in the Prometheus text exposition format"""
+    if snapshot is None:
+        snapshot = registry.snapshot()
+
+    lines = []
+
+    def render(metrics, kind, samples):
+        seen = set()
+        for (name, labels), value in sorted(metrics.items()):
+            if name not in seen:
+                seen.add(name)
+                lines.append('# TYPE %s %s' % (name, kind))
+            for suffix, extra, sample in samples(value):
+                lines.append('%s%s%s %s' % (
+                    name, suffix, _format_labels(labels + extra),
+                    _format_value(sample)))
+
+    render(snapshot['counters'], 'counter', lambda v: [('', (), v)])
+    render(snapshot['gauges'], 'gauge', lambda v: [('', (), v)])
+    render(snapshot['summaries'], 'summary',
+           lambda (count, total, maximum): [('_count', (), count),
+                                            ('_sum', (), total)])
+    render(dict(((name + '_max', labels), maximum)
+                for (name, labels), (__, __, maximum)
+                in snapshot['summaries'].items()),
+           'gauge', lambda v: [('', (), v)])
+
+    def buckets((counts, total)):
+        samples = []
+        cumulative = 0
+        bounds = list(settings.METRICS_BUCKETS) + ['+Inf']
+        for bound, count in zip(bounds, counts):
+            cumulative += count
+            samples.append(('_bucket', (('le', bound),), cumulative))
+        samples.append(('_count', (), cumulative))
+        samples.append(('_sum', (), total))
+        return samples
+
+    render(snapshot['histograms'], 'histogram', buckets)
+
+    return '\n'.join(lines) + '\n'
@@ -2,10 +2,11 @@
 import ast
 import logging
 from datetime import datetime, timedelta
+from decimal import Decimal
 
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.urlresolvers import reverse
-from django.db import models, transaction
+from django.db import models
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.sites.models import Site
 from django.utils import timezone
@@ -15,11 +16,17 @@ except ImportError:
     import django.utils.simplejson as json
 
 from djmoney.models.fields import MoneyField
+from moneyed import Money
 from shortuuidfield import ShortUUIDField
 
 from .helpers import get_http_protocol
 from . import settings
 from . import api
+from . import signals
+from . import statuscache
+from . import profiling
+from . import tracing
+from .transactions import atomic
 
 
 logger = logging.getLogger(__name__)
@@ -29,7 +36,8 @@ class PaypalAdaptive(models.Model):
     """Base fields used by all PaypalAdaptive models"""
     money = MoneyField(_(u'money'), max_digits=settings.MAX_DIGITS,
                        decimal_places=settings.DECIMAL_PLACES)
-    created_date = models.DateTimeField(_(u'created on'), auto_now_add=True)
+    created_date = models.DateTimeField(_(u'created on'), auto_now_add=True,
+                                        db_index=True)
     secret_uuid = ShortUUIDField(verbose_name=_(u'secret UUID'))  # to verify return_url
     debug_request = models.TextField(_(u'raw request'), blank=True, null=True)
     debug_response = models.TextField(_(u'raw response'), blank=True,
@@ -42,17 +50,49 @@ class PaypalAdaptive(models.Model):
     class Meta:
         abstract = True
 
-    def call(self, endpoint_class, *args, **kwargs):
-        endpoint = endpoint_class(*args, **kwargs)
+    def __init__(self, *args, **kwargs):
+        super(PaypalAdaptive, self).__init__(*args, **kwargs)
+        self._original_status = getattr(self, 'status', None)
 
-        try:
-            res = endpoint.call()
-        finally:
-            self.debug_request = json.dumps(endpoint.data, cls=DjangoJSONEncoder)
-            self.debug_response = endpoint.raw_response
-            self.save()
+    def save(self, *args, **kwargs):
+        is_new = self.pk is None
+
+        super(PaypalAdaptive, self).save(*args, **kwargs)
+
+        if getattr(self, 'status', None) != self._original_status:
+            self.status_changed(self._original_status)
+            self._original_status = self.status
+        elif is_new:
+            statuscache.publish(self)
+
+    def status_changed(self, old_status):
+        """Called after a change of status has been saved"""
+        StatusTransition.objects.create(
+            object_type=self._meta.model_name, object_id=self.pk,
+            old_status=old_status or '', status=self.status)
+        statuscache.publish(self)
+        signals.dispatch(self, old_status)
 
-        return res, endpoint
+    def call(self, endpoint_class, *args, **kwargs):
+        with tracing.span('paypaladaptive.call',
+                          **{'paypal.endpoint': endpoint_class.__name__,
+                             'paypal.object_type': self._meta.model_name,
+                             'paypal.object_id': self.pk}) as span:
+            endpoint = endpoint_class(*args, **kwargs)
+
+            try:
+                res = endpoint.call()
+                if getattr(endpoint, 'paykey', None):
+                    span.set_attribute('paypal.pay_key_hash',
+                                       tracing.key_hash(endpoint.paykey))
+            finally:
+                self.debug_request = json.dumps(endpoint.data,
+                                                cls=DjangoJSONEncoder)
+                self.debug_response = endpoint.raw_response
+                with tracing.span('paypaladaptive.save'):
+                    self.save()
+
+            return res, endpoint
 
     def get_amount(self):
         return self.money.amount
@@ -118,6 +158,15 @@ class PaypalAdaptive(models.Model):
 
             return response
 
+    def invalidate_update_cache(self):
+        """Drop any cached response of this object's update endpoint"""
+        try:
+            kwargs = self.get_update_kwargs()
+        except ValueError:
+            return
+
+        self.update_endpoint.invalidate_cache(**kwargs)
+
     @property
     def debug_request_dict(self):
         return json.loads(self.debug_request)
@@ -127,6 +176,54 @@ class PaypalAdaptive(models.Model):
         return json.loads(self.debug_response)
 
 
+class Payout(models.Model):
+    """
+    Models a payout to more receivers than fit in a single Pay call. It is
+    made as several Payments, see paypaladaptive.payouts.
+
+    """
+
+    STATUS_CHOICES = (
+        ('new', _(u'New')),  # no payment has been processed yet
+        ('created', _(u'Created')),  # payments wait for sender approval
+        ('partial', _(u'Partial')),  # some payments failed
+        ('completed', _(u'Completed')),  # all payments are completed
+        ('error', _(u'Error')),  # all payments failed
+    )
+
+    created_date = models.DateTimeField(_(u'created on'), auto_now_add=True)
+    status = models.CharField(_(u'status'), max_length=10,
+                              choices=STATUS_CHOICES, default='new')
+    plan = models.TextField(_(u'plan'))  # receivers of each payment
+
+    def get_plan(self):
+        return json.loads(self.plan)
+
+    def refresh_status(self, save=True):
+        """Aggregate the status of the payout from its payments"""
+        counts = dict((row['status'], row['count']) for row in
+                      self.payments.values('status')
+                                   .annotate(count=models.Count('pk')))
+        total = sum(counts.values())
+        failed = counts.get('error', 0) + counts.get('canceled', 0)
+
+        if total and counts.get('completed', 0) == total:
+            self.status = 'completed'
+        elif total and failed == total:
+            self.status = 'error'
+        elif failed:
+            self.status = 'partial'
+        elif counts.get('new', 0) == total:
+            self.status = 'new'
+        else:
+            self.status = 'created'
+
+        if save:
+            self.save()
+
+        return self.status
+
+
 class Payment(PaypalAdaptive):
     """Models a payment made using Paypal"""
 
@@ -140,12 +237,19 @@ class Payment(PaypalAdaptive):
         ('returned', _(u'Returned')),  # user has returned via return_url
         ('completed', _(u'Completed')),  # the payment has been completed
         ('refunded', _(u'Refunded')),  # payment has been refunded
+        ('expired', _(u'Expired')),  # the paykey expired before payment
     )
 
     pay_key = models.CharField(_(u'paykey'), max_length=255)
     status = models.CharField(_(u'status'), max_length=10,
                               choices=STATUS_CHOICES, default='new')
     status_detail = models.TextField(_(u'detailed status'), blank=True)
+    payout = models.ForeignKey(Payout, blank=True, null=True,
+                               related_name='payments')
+    payout_batch = models.PositiveIntegerField(blank=True, null=True)
+    # name of the paykey pool while the payment is waiting to be claimed
+    pool = models.CharField(_(u'paykey pool'), max_length=100, blank=True,
+                            db_index=True)
 
     def save(self, *args, **kwargs):
         is_new = self.id is None
@@ -172,7 +276,9 @@ class Payment(PaypalAdaptive):
         cancel_url = reverse('paypal-adaptive-payment-cancel', kwargs=kwargs)
         return "%s://%s%s" % (get_http_protocol(), current_site, cancel_url)
 
-    @transaction.atomic
+    @tracing.traced('paypaladaptive.Payment.process')
+    @profiling.profiled('Payment.process')
+    @atomic
     def process(self, receivers, preapproval=None, **kwargs):
         """Process the payment"""
         if self.status != 'new':
@@ -181,11 +287,15 @@ class Payment(PaypalAdaptive):
                 "it's status is not new."
                 )
 
-        endpoint_kwargs = {
-            'money': self.money,
-            'return_url': self.return_url,
-            'cancel_url': self.cancel_url,
-            }
+        # Site lookups and reversing URLs
+        with tracing.span('paypaladaptive.urls'):
+            endpoint_kwargs = {
+                'money': self.money,
+                'return_url': self.return_url,
+                'cancel_url': self.cancel_url,
+                }
+            if settings.USE_IPN:
+                endpoint_kwargs['ipn_url'] = self.ipn_url
 
         # Update return_url with ?next param
         if 'next' in kwargs:
@@ -198,10 +308,6 @@ class Payment(PaypalAdaptive):
                                             kwargs.pop('cancel'))
             endpoint_kwargs.update({'cancel_url': return_cancel})
 
-        # Set ipn_url
-        if settings.USE_IPN:
-            endpoint_kwargs.update({'ipn_url': self.ipn_url})
-
         # Append extra arguments
         endpoint_kwargs.update(**kwargs)
 
@@ -228,6 +334,11 @@ class Payment(PaypalAdaptive):
         # Call endpoint
         res, endpoint = self.call(api.Pay, **endpoint_kwargs)
 
+        if preapproval is not None:
+            preapproval.invalidate_update_cache()
+            if endpoint.status == 'COMPLETED':
+                preapproval.record_payment(self.money)
+
         self.pay_key = endpoint.paykey
 
         if endpoint.status == 'ERROR':
@@ -255,32 +366,29 @@ class Payment(PaypalAdaptive):
 
         self.save()
 
-        return self.status in ['created', 'completed']
-
-    @transaction.atomic
-    def refund(self):
-        """Refund this payment"""
+        span = tracing.current_span()
+        span.set_attribute('paypal.pay_key_hash',
+                           tracing.key_hash(self.pay_key) or '')
+        span.set_attribute('paypal.status', self.status)
 
-        # TODO: flow should create a Refund object and call Refund.process()
+        return self.status in ['created', 'completed']
 
-        self.save()
+    def refund(self, receivers=None):
+        """
+        Refund this payment. Refunds the full amount unless a ReceiverList of
+        the amounts to refund per receiver is given. Returns the Refund.
 
+        """
         if self.status != 'completed':
             raise ValueError('Cannot refund a Payment until it is completed.')
 
-        res, refund_call = self.call(api.Refund, self.pay_key)
-
-        self.status = 'refunded'
-        self.save()
-
-        refund = Refund(payment=self,
-                        debug_request=json.dumps(
-                            refund_call.data,
-                            cls=DjangoJSONEncoder,
-                            ),
-                        debug_response=refund_call.raw_response,
-                        )
+        refund = Refund(payment=self, money=self.money)
+        if receivers is not None:
+            refund.set_receivers(receivers)
         refund.save()
+        refund.process()
+
+        return refund
 
     def get_update_kwargs(self):
         if not self.pay_key:
@@ -308,23 +416,116 @@ class Payment(PaypalAdaptive):
 
 
 class Refund(PaypalAdaptive):
-    """Models a refund make using Paypal"""
+    """
+    Models a refund made using Paypal. A refund without receivers refunds
+    the full payment, otherwise only the amounts given per receiver.
+
+    """
 
     STATUS_CHOICES = (
-        ('new', _(u'New')),
-        ('created', _(u'Created')),
-        ('error', _(u'Error')),
-        ('canceled', _(u'Canceled')),
-        ('returned', _(u'Returned')),
-        ('completed', _(u'Completed')),
+        ('new', _(u'New')),  # just saved locally
+        ('processing', _(u'Processing')),  # call to Paypal was started
+        ('pending', _(u'Pending')),  # Paypal will complete the refund later
+        ('completed', _(u'Completed')),  # the refund has been made
+        ('error', _(u'Error')),  # see status_detail
     )
 
-    payment = models.OneToOneField(Payment)
+    # refundStatus values of receivers that have been refunded
+    REFUNDED_STATUSES = ('REFUNDED', 'ALREADY_REVERSED_OR_REFUNDED')
+    PENDING_STATUSES = ('REFUNDED_PENDING',)
+
+    payment = models.ForeignKey(Payment, related_name='refunds')
     status = models.CharField(_(u'status'), max_length=10,
-                              choices=STATUS_CHOICES, default='new')
+                              choices=STATUS_CHOICES, default='new',
+                              db_index=True)
     status_detail = models.TextField(_(u'detailed status'), blank=True)
+    receivers = models.TextField(_(u'receivers'), blank=True)
+    is_full = models.BooleanField(_(u'refunds full payment'), default=False)
+
+    def set_receivers(self, receivers):
+        """Only refund the amounts of a ReceiverList"""
+        self.receivers = json.dumps(receivers.to_dict(), cls=DjangoJSONEncoder)
+        self.money = Money(receivers.total_amount, self.payment.currency)
+
+    def get_receivers(self):
+        if not self.receivers:
+            return None
+        return api.ReceiverList([api.Receiver(**r)
+                                 for r in json.loads(self.receivers)])
+
+    def process(self, update_payment=True):
+        """
+        Make the refund on Paypal. A payment that has been refunded in full
+        is marked refunded, unless update_payment is False.
+
+        The refund is marked as processing before Paypal is called. If the
+        call is interrupted the refund stays processing and will not be sent
+        again, see paypaladaptive.refunds.recover() to resolve it.
+
+        """
+        payment = self.payment
+        if payment.status != 'completed':
+            raise ValueError('Cannot refund a Payment until it is completed.')
+
+        claimed = Refund.objects.filter(
+            pk=self.pk, status='new').update(status='processing')
+        if not claimed:
+            raise ValueError("This refund has already been processed.")
+        self.status = 'processing'
 
-    # TODO: finish model
+        kwargs = {}
+        receivers = self.get_receivers()
+        if receivers is not None:
+            kwargs = {'receivers': receivers,
+                      'currency_code': self.currency.code}
+
+        try:
+            res, endpoint = self.call(api.Refund, payment.pay_key, **kwargs)
+        except api.PaypalUnavailableError:
+            # nothing was sent to Paypal
+            self.status = 'new'
+            self.save()
+            raise
+        except api.RefundError, e:
+            self.status = 'error'
+            self.status_detail = unicode(e)
+            self.save()
+            raise
+
+        self._parse_refund_info(res)
+        self.save()
+
+        if (update_payment and self.is_full
+                and self.status in ('completed', 'pending')):
+            payment.status = 'refunded'
+            payment.save()
+        payment.invalidate_update_cache()
+
+        return self.status in ('completed', 'pending')
+
+    def _parse_refund_info(self, response):
+        infos = response.get('refundInfoList', {}).get('refundInfo', [])
+        statuses = [info.get('refundStatus') for info in infos]
+
+        if not statuses:
+            self.status = 'error'
+        elif all(s in self.REFUNDED_STATUSES for s in statuses):
+            self.status = 'completed'
+        elif all(s in self.REFUNDED_STATUSES + self.PENDING_STATUSES
+                 for s in statuses):
+            self.status = 'pending'
+        else:
+            self.status = 'error'
+
+        self.is_full = not self.receivers or any(
+            info.get('refundHasBecomeFull') == 'true' for info in infos)
+        self.status_detail = '\n'.join(
+            '%s: %s' % (info.get('receiver', {}).get('email'),
+                        info.get('refundStatus'))
+            for info in infos)
+
+    def __unicode__(self):
+        return u'%s' % self.payment
 
 
 class Preapproval(PaypalAdaptive):
@@ -343,15 +544,33 @@ class Preapproval(PaypalAdaptive):
         ('approved', _(u'Approved')),
         ('used', _(u'Used')),
         ('returned', _(u'Returned')),
+        ('expired', _(u'Expired')),  # valid_until_date has passed
     )
 
     valid_until_date = models.DateTimeField(_(u'valid until'),
-                                            default=default_valid_date)
+                                            default=default_valid_date,
+                                            db_index=True)
     preapproval_key = models.CharField(_(u'preapprovalkey'), max_length=255)
     status = models.CharField(_(u'status'), max_length=10,
                               choices=STATUS_CHOICES, default='new')
     status_detail = models.TextField(_(u'detailed status'), blank=True)
 
+    # Local ledger of the payments made with this preapproval, kept up to
+    # date from Pay results, IPNs and PreapprovalDetails responses
+    max_number_of_payments = models.PositiveIntegerField(
+        _(u'max number of payments'), blank=True, null=True)
+    current_number_of_payments = models.PositiveIntegerField(
+        _(u'number of payments'), default=0)
+    current_total_amount = models.DecimalField(
+        _(u'amount used'), max_digits=settings.MAX_DIGITS,
+        decimal_places=settings.DECIMAL_PLACES, default=0)
+    current_period_attempts = models.PositiveIntegerField(
+        _(u'payments in current period'), default=0)
+    max_number_of_payments_per_period = models.PositiveIntegerField(
+        _(u'max number of payments per period'), blank=True, null=True)
+    ledger_updated_date = models.DateTimeField(_(u'ledger updated on'),
+                                               blank=True, null=True)
+
     def save(self, *args, **kwargs):
         is_new = self.id is None
 
@@ -379,7 +598,7 @@ class Preapproval(PaypalAdaptive):
                              kwargs=kwargs)
         return "%s://%s%s" % (get_http_protocol(), current_site, cancel_url)
 
-    @transaction.atomic
+    @atomic
     def process(self, **kwargs):
         """Process the preapproval"""
 
@@ -416,7 +635,7 @@ class Preapproval(PaypalAdaptive):
 
         return self.status == 'created'
 
-    @transaction.atomic
+    @atomic
     def cancel_preapproval(self):
         res, cancel = self.call(api.CancelPreapproval,
                                 preapproval_key=self.preapproval_key)
@@ -425,15 +644,99 @@ class Preapproval(PaypalAdaptive):
 
         self.status = 'canceled'
         self.save()
+        self.invalidate_update_cache()
         return self.status == 'canceled'
 
-    @transaction.atomic
+    @atomic
     def mark_as_used(self):
         self.status = 'used'
         self.save()
 
         return self.status == 'used'
 
+    def update(self, save=True, fields=None):
+        response = super(Preapproval, self).update(save=False, fields=fields)
+
+        if response is not None:
+            self.set_ledger(
+                number=response.get('curPayments'),
+                amount=response.get('curPaymentsAmount'),
+                period_attempts=response.get('curPeriodAttempts'),
+                max_number=response.get('maxNumberOfPayments'),
+                max_per_period=response.get('maxNumberOfPaymentsPerPeriod'))
+            if save:
+                self.save()
+
+        return response
+
+    def set_ledger(self, number=None, amount=None, period_attempts=None,
+                   max_number=None, max_per_period=None):
+        """Set the ledger from values reported by Paypal"""
+        if number is not None:
+            self.current_number_of_payments = int(number)
+        if amount is not None:
+            self.current_total_amount = Decimal(str(amount))
+        if period_attempts is not None:
+            self.current_period_attempts = int(period_attempts)
+        if max_number is not None:
+            self.max_number_of_payments = int(max_number)
+        if max_per_period is not None:
+            self.max_number_of_payments_per_period = int(max_per_period)
+        self.ledger_updated_date = timezone.now()
+
+    def record_payment(self, money):
+        """Add a payment made with this preapproval to the ledger"""
+        Preapproval.objects.filter(pk=self.pk).update(
+            current_number_of_payments=(
+                models.F('current_number_of_payments') + 1),
+            current_total_amount=(
+                models.F('current_total_amount') + money.amount),
+            current_period_attempts=models.F('current_period_attempts') + 1)
+
+        ledger = Preapproval.objects.values(
+            'current_number_of_payments', 'current_total_amount',
+            'current_period_attempts').get(pk=self.pk)
+        for field, value in ledger.items():
+            setattr(self, field, value)
+
+        if (self.max_number_of_payments is not None and
+                self.current_number_of_payments >=
+                self.max_number_of_payments):
+            self.status = 'used'
+            self.save()
+
+    @property
+    def ledger_is_stale(self):
+        return (self.ledger_updated_date is None or
+                self.ledger_updated_date <
+                timezone.now() - settings.PREAPPROVAL_LEDGER_MAX_AGE)
+
+    def can_charge(self, money, refresh=True):
+        """
+        Check whether money can be paid with this preapproval. The check uses
+        the local ledger, which is refreshed from Paypal first if it is stale
+        and refresh is True.
+
+        """
+        if refresh and self.ledger_is_stale:
+            self.update()
+
+        if self.status != 'approved':
+            return False
+        if self.valid_until_date < timezone.now():
+            return False
+        if (self.max_number_of_payments is not None and
+                self.current_number_of_payments >=
+                self.max_number_of_payments):
+            return False
+        if (self.max_number_of_payments_per_period is not None and
+                self.current_period_attempts >=
+                self.max_number_of_payments_per_period):
+            return False
+        if money.currency != self.money.currency:
+            return False
+        return self.current_total_amount + money.amount <= self.money.amount
+
     def get_update_kwargs(self):
         if self.preapproval_key is None:
             raise ValueError("Can't update unprocessed preapprovals")
@@ -466,6 +769,131 @@ class Preapproval(PaypalAdaptive):
         return self.preapproval_key
 
 
+class StatusTransition(models.Model):
+    """
+    Append-only log of status changes of payments, preapprovals and refunds.
+    The ids serve as cursors of the change feed, see paypaladaptive.changes.
+
+    """
+
+    object_type = models.CharField(_(u'object type'), max_length=20)
+    object_id = models.PositiveIntegerField(_(u'object id'))
+    old_status = models.CharField(_(u'old status'), max_length=10,
+                                  blank=True)
+    status = models.CharField(_(u'status'), max_length=10)
+    created_date = models.DateTimeField(_(u'created on'), auto_now_add=True,
+                                        db_index=True)
+
+    class Meta:
+        index_together = [('object_type', 'object_id')]
+
+    @classmethod
+    def log_many(cls, model, rows, status):
+        """Log the change of (pk, old status) rows of model to status"""
+        cls.objects.bulk_create([
+            cls(object_type=model._meta.model_name, object_id=pk,
+                old_status=old_status, status=status)
+            for pk, old_status in rows])
+
+    def __unicode__(self):
+        return u'%s %s: %s -> %s' % (self.object_type, self.object_id,
+                                     self.old_status, self.status)
+
+
+class SlowCall(models.Model):
+    """
+    Journal of calls to Paypal that took longer than
+    PAYPAL_SLOW_CALL_THRESHOLD, capped at PAYPAL_SLOW_CALL_JOURNAL_SIZE
+    entries. See paypaladaptive.slowcalls.
+
+    """
+
+    created_date = models.DateTimeField(_(u'created on'), auto_now_add=True,
+                                        db_index=True)
+    endpoint = models.CharField(_(u'endpoint'), max_length=50)
+    status_code = models.SmallIntegerField(_(u'status code'), blank=True,
+                                           null=True)
+    correlation_id = models.CharField(_(u'correlation id'), max_length=50,
+                                      blank=True)
+    # in seconds, wait is spent in the rate limiter and bulkheads
+    wait = models.FloatField(_(u'wait'), blank=True, null=True)
+    connect = models.FloatField(_(u'connect'), blank=True, null=True)
+    tls = models.FloatField(_(u'TLS'), blank=True, null=True)
+    first_byte = models.FloatField(_(u'first byte'), blank=True, null=True)
+    total = models.FloatField(_(u'total'))
+    request_bytes = models.PositiveIntegerField(_(u'request bytes'),
+                                                blank=True, null=True)
+    response_bytes = models.PositiveIntegerField(_(u'response bytes'),
+                                                 blank=True, null=True)
+
+    class Meta:
+        ordering = ['-id']
+
+    def __unicode__(self):
+        return u'%s %.3fs' % (self.endpoint, self.total)
+
+
+class Settlement(models.Model):
+    """
+    Models a batch of charges or cancellations of Preapprovals, e.g. all
+    pledges of a crowdfunding campaign. See paypaladaptive.settlement.
+
+    """
+
+    ACTION_CHOICES = (
+        ('charge', _(u'Charge')),  # pay with each preapproval
+        ('cancel', _(u'Cancel')),  # cancel each preapproval
+    )
+
+    STATUS_CHOICES = (
+        ('new', _(u'New')),
+        ('running', _(u'Running')),
+        ('completed', _(u'Completed')),  # all items have been processed
+    )
+
+    name = models.CharField(_(u'name'), max_length=255, unique=True)
+    action = models.CharField(_(u'action'), max_length=10,
+                              choices=ACTION_CHOICES)
+    status = models.CharField(_(u'status'), max_length=10,
+                              choices=STATUS_CHOICES, default='new')
+    created_date = models.DateTimeField(_(u'created on'), auto_now_add=True)
+    completed_date = models.DateTimeField(_(u'completed on'), blank=True,
+                                          null=True)
+
+    def __unicode__(self):
+        return self.name
+
+
+class SettlementItem(models.Model):
+    """Checkpoint of a single Preapproval within a Settlement"""
+
+    STATUS_CHOICES = (
+        ('new', _(u'New')),
+        ('processing', _(u'Processing')),  # call to Paypal was started
+        ('completed', _(u'Completed')),
+        ('failed', _(u'Failed')),
+    )
+
+    settlement = models.ForeignKey(Settlement, related_name='items')
+    preapproval = models.ForeignKey(Preapproval,
+                                    related_name='settlement_items')
+    payment = models.ForeignKey(Payment, blank=True, null=True,
+                                related_name='settlement_items')
+    status = models.CharField(_(u'status'), max_length=10,
+                              choices=STATUS_CHOICES, default='new',
+                              db_index=True)
+    status_detail = models.TextField(_(u'detailed status'), blank=True)
+    updated_date = models.DateTimeField(_(u'updated on'), auto_now=True)
+
+    class Meta:
+        unique_together = ('settlement', 'preapproval')
+
+    @property
+    def tracking_id(self):
+        """Paypal trackingId of the payment made for this item"""
+        return 'settlement-%s-%s' % (self.settlement_id, self.id)
+
+
 class IPNLog(models.Model):
     created_date = models.DateTimeField(_(u'created on'), auto_now_add=True)
     path = models.TextField()
@@ -0,0 +1,135 @@
+"""
+Pools of payments created ahead of time for fixed-price checkouts.
+
+Creating a payment waits for a Pay call to Paypal before the buyer can be
+redirected. For products with a fixed price and fixed receivers, payments
+can be created in the background instead and claimed by a checkout with a
+single UPDATE. Pools are configured with PAYPAL_PAYKEY_POOLS:
+
+    PAYPAL_PAYKEY_POOLS = {
+        'tier-25': {
+            'amount': '25.00',
+            'currency': 'USD',
+            'receivers': [{'email': 'campaign@example.com',
+                           'amount': '25.00'}],
+            'size': 20,
+        },
+    }
+
+and kept full by running the refill_paykey_pools celery task every minute
+or so. A checkout then claims a payment, and falls back to creating one when
+the pool is empty:
+
+    payment = claim('tier-25')
+    if payment is None:
+        payment = Payment(money=Money(25, USD))
+        payment.save()
+        payment.process(receivers)
+    return HttpResponseRedirect(payment.next_url())
+
+Claimed payments are used like any other payment, but their return and
+cancel urls can't carry a next parameter. Pooled payments that are older
+than PAYPAL_PAYKEY_POOL_MAX_AGE are retired before their paykey expires.
+
+"""
+import logging
+
+from django.utils import timezone
+
+from moneyed import Money
+
+from . import settings, metrics, statuscache
+from .api import Receiver, ReceiverList, PaypalAdaptiveApiError, ratelimit
+from .models import Payment, StatusTransition
+from .transactions import atomic
+
+
+logger = logging.getLogger(__name__)
+
+
+def _available(name, now=None):
+    oldest = (now or timezone.now()) - settings.PAYKEY_POOL_MAX_AGE
+    return Payment.objects.filter(pool=name, status='created',
+                                  created_date__gte=oldest)
+
+
+def claim(name):
+    """Take a ready payment out of the pool, or None if the pool is empty"""
+    while True:
+        ids = list(_available(name).order_by('created_date')
+                                   .values_list('pk', flat=True)[:1])
+        if not ids:
+            metrics.incr('paypaladaptive_paykey_pool_misses_total', pool=name)
+            return None
+
+        # another checkout may have claimed it, or retire() expired it, in
+        # the meantime
+        if _available(name).filter(pk=ids[0]).update(pool=''):
+            metrics.incr('paypaladaptive_paykey_pool_hits_total', pool=name)
+            return Payment.objects.get(pk=ids[0])
+
+
+@atomic
+def retire(name, now=None):
+    """Expire pooled payments that are too old to be claimed"""
+    oldest = (now or timezone.now()) - settings.PAYKEY_POOL_MAX_AGE
+    rows = list(Payment.objects.select_for_update()
+                               .filter(pool=name, created_date__lt=oldest)
+                               .values_list('pk', 'status'))
+    if not rows:
+        return 0
+
+    Payment.objects.filter(pk__in=[pk for pk, __ in rows]).update(
+        pool='', status='expired')
+    StatusTransition.log_many(Payment, rows, 'expired')
+    statuscache.forget(Payment, [pk for pk, __ in rows])
+    return len(rows)
+
+
+def refill(name, **kwargs):
+    """
+    Retire old payments of the pool and create new ones until it is full,
+    passing kwargs on to Payment.process(). Returns the number of payments
+    retired and created.
+
+    """
+    template = settings.PAYKEY_POOLS[name]
+    money = Money(template['amount'], template['currency'])
+
+    retired = retire(name)
+    missing = template['size'] - _available(name).count()
+    created = 0
+
+    with ratelimit.priority(ratelimit.PRIORITY_BACKGROUND):
+        for __ in range(missing):
+            receivers = ReceiverList([Receiver(**r)
+                                      for r in template['receivers']])
+            payment = Payment(money=money)
+            payment.save()
+
+            try:
+                processed = payment.process(receivers, **kwargs)
+            except PaypalAdaptiveApiError, e:
+                logger.warning('Could not refill paykey pool %s: %s',
+                               name, e)
+                payment.delete()
+                break
+
+            if not processed or payment.status != 'created':
+                logger.warning('Could not refill paykey pool %s: payment '
+                               '%s is %s', name, payment.pk, payment.status)
+                break
+
+            payment.pool = name
+            payment.save()
+            created += 1
+
+    metrics.set_gauge('paypaladaptive_paykey_pool_size',
+                      _available(name).count(), pool=name)
+
+    return {'retired': retired, 'created': created}
+
+
+def refill_all(**kwargs):
+    return dict((name, refill(name, **kwargs))
+                for name in settings.PAYKEY_POOLS)
@@ -0,0 +1,165 @@
+"""
+Payouts to more receivers than fit in a single Pay call.
+
+Paypal accepts at most six receivers per payment. plan() splits any number of
+receivers into batches that each fit a Pay call, grouped by currency, and
+create_payout() stores them as Payments linked to a Payout:
+
+    from paypaladaptive.payouts import create_payout, execute_payout
+
+    receivers = [Receiver(amount=Money(seller.balance, USD),
+                          email=seller.email) for seller in sellers]
+    payout = create_payout(receivers)
+    execute_payout(payout, workers=4, senderEmail=PAYPAL_EMAIL)
+    payout.status  # 'completed', 'partial', ...
+
+Receivers with a plain amount are paid in the default currency. With a
+primary receiver the payout is made as chained payments: the primary is part
+of every batch, receiving what it passes on to the secondary receivers of that
+batch, and its own share is added to the first batch.
+
+"""
+import logging
+from decimal import Decimal
+
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from moneyed import Money
+
+from . import settings
+from .api import (Receiver, ReceiverList, ReceiverError, PayError,
+                  PaypalUnavailableError, ratelimit)
+from .bulk import run_concurrently
+from .models import Payment, Payout
+
+
+logger = logging.getLogger(__name__)
+
+MAX_RECEIVERS = 6
+
+
+class Batch(object):
+    """Receivers paid with a single Pay call"""
+
+    def __init__(self, currency, receivers):
+        self.currency = currency
+        self.receivers = ReceiverList(receivers)
+
+    @property
+    def money(self):
+        """Amount the sender pays"""
+        for receiver in self.receivers.receivers:
+            if receiver.primary:
+                return Money(receiver.amount, self.currency)
+        return Money(self.receivers.total_amount, self.currency)
+
+
+def _amount(receiver, default_currency):
+    amount = receiver.amount
+    if isinstance(amount, Money):
+        return amount.amount, amount.currency.code
+    return Decimal(str(amount)), default_currency
+
+
+def plan(receivers, currency=None):
+    """Split an iterable of Receivers into a list of Batches"""
+    currency = currency or settings.DEFAULT_CURRENCY
+
+    groups = {}
+    primary = None
+    for receiver in receivers:
+        amount, code = _amount(receiver, currency)
+        receiver = Receiver(email=receiver.email, amount=amount,
+                            primary=receiver.primary)
+
+        if receiver.primary:
+            if primary is not None:
+                raise ReceiverError("There can only be one primary Receiver.")
+            primary = (receiver, code)
+        else:
+            groups.setdefault(code, []).append(receiver)
+
+    if primary is None:
+        return [Batch(code, group[i:i + MAX_RECEIVERS])
+                for code, group in sorted(groups.items())
+                for i in range(0, len(group), MAX_RECEIVERS)]
+
+    primary, code = primary
+    if set(groups) - set([code]):
+        raise ReceiverError("Chained payouts must be in a single currency.")
+
+    secondaries = groups.get(code, [])
+    own_share = primary.amount - sum(r.amount for r in secondaries)
+    if own_share < 0:
+        raise ReceiverError("The primary Receiver's amount must cover the "
+                            "amounts of all secondary receivers.")
+
+    size = MAX_RECEIVERS - 1
+    batches = []
+    for i in range(0, max(len(secondaries), 1), size):
+        batch = secondaries[i:i + size]
+        amount = sum(r.amount for r in batch)
+        if i == 0:
+            amount += own_share
+        batches.append(Batch(code, [Receiver(email=primary.email,
+                                             amount=amount,
+                                             primary=True)] + batch))
+    return batches
+
+
+def create_payout(receivers, currency=None):
+    """Plan a payout and save it with a new Payment for each batch"""
+    batches = plan(receivers, currency)
+
+    payout = Payout(plan=json.dumps(
+        [{'currency': b.currency, 'receivers': b.receivers.to_dict()}
+         for b in batches],
+        cls=DjangoJSONEncoder))
+    payout.save()
+
+    Payment.objects.bulk_create([
+        Payment(payout=payout, payout_batch=i, money=batch.money)
+        for i, batch in enumerate(batches)])
+
+    return payout
+
+
+def execute_payout(payout, workers=1, **kwargs):
+    """
+    Process all new payments of a payout, passing kwargs on to
+    Payment.process(), and return the aggregated status of the payout.
+
+    Payments are sent with a trackingId of payout-<payout id>-<batch>.
+    Payments that could not be sent because Paypal was unavailable stay new,
+    so calling execute_payout() again retries them.
+
+    """
+    batches = payout.get_plan()
+
+    def process(payment):
+        batch = batches[payment.payout_batch]
+        receivers = ReceiverList([Receiver(**r) for r in batch['receivers']])
+        tracking_id = 'payout-%s-%s' % (payout.pk, payment.payout_batch)
+
+        try:
+            with ratelimit.priority(ratelimit.PRIORITY_BACKGROUND):
+                payment.process(receivers, trackingId=tracking_id, **kwargs)
+        except PaypalUnavailableError, e:
+            logger.warning('Could not send %s: %s', tracking_id, e)
+        except PayError, e:
+            payment.status = 'error'
+            payment.status_detail = unicode(e)
+            payment.save()
+        except Exception:
+            logger.exception('Sending %s failed', tracking_id)
+
+    payments = list(payout.payments.filter(status='new'))
+    for __ in run_concurrently(process, payments, workers=workers):
+        pass
+
+    return payout.refresh_status()
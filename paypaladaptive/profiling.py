@@ -0,0 +1,98 @@
+"""
+Sampled profiling of the IPN and return views and Payment.process.
+
+With PAYPAL_PROFILE_DIR set, a share of PAYPAL_PROFILE_SAMPLE_RATE of the
+calls of each profiled function runs under cProfile. The profiles are
+added up per function and process and written to the directory as
+<name>.<pid>.prof after each sampled call, e.g. views.ipn.1234.prof, so
+hot spots under production traffic can be found without redeploying.
+load() adds up the profiles of all processes:
+
+    from paypaladaptive import profiling
+
+    profiling.load('views.ipn').sort_stats('cumulative').print_stats(20)
+
+The files are pstats dumps and can also be read with other tools, e.g.
+snakeviz or gprof2dot.
+
+"""
+import cProfile
+import glob
+import logging
+import os
+import pstats
+import random
+import threading
+from functools import wraps
+
+from . import settings
+
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_lock = threading.Lock()
+_stats = {}
+_random = random.Random()
+
+
+def _sampled():
+    if settings.PROFILE_DIR is None or not settings.PROFILE_SAMPLE_RATE:
+        return False
+    # profiles can't be nested, the outermost one covers the inner calls
+    if getattr(_local, 'profiling', False):
+        return False
+    return _random.random() < settings.PROFILE_SAMPLE_RATE
+
+
+def _save(name, profile):
+    """Add profile to the profiles of name and write them to disk"""
+    path = os.path.join(settings.PROFILE_DIR,
+                        '%s.%s.prof' % (name, os.getpid()))
+    try:
+        with _lock:
+            if name in _stats:
+                _stats[name].add(profile)
+            else:
+                _stats[name] = pstats.Stats(profile)
+            _stats[name].dump_stats(path)
+    except (IOError, OSError), e:
+        logger.warning('Could not save profile of %s: %s', name, e)
+
+
+def profiled(name):
+    """Decorator profiling a sample of the calls of the function as name"""
+    def decorator(function):
+        @wraps(function)
+        def _profiled(*args, **kwargs):
+            if not _sampled():
+                return function(*args, **kwargs)
+
+            profile = cProfile.Profile()
+            _local.profiling = True
+            try:
+                return profile.runcall(function, *args, **kwargs)
+            finally:
+                _local.profiling = False
+                _save(name, profile)
+        return _profiled
+    return decorator
+
+
+def load(name, directory=None):
+    """
+    The profiles of name written by all processes added up, as
+    pstats.Stats, or None if there are none
+
+    """
+    directory = directory or settings.PROFILE_DIR
+    paths = sorted(glob.glob(os.path.join(directory, '%s.*.prof' % name)))
+    if not paths:
+        return None
+    return pstats.Stats(*paths)
+
+
+def reset():
+    """Forget the profiles of this process"""
+    with _lock:
+        _stats.clear()
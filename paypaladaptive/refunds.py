@@ -0,0 +1,215 @@
+"""
+Refunding large numbers of payments, e.g. when an event is canceled.
+
+    from paypaladaptive.refunds import refund_payments
+
+    report = refund_payments(Payment.objects.filter(order__event=event),
+                             workers=8)
+
+A Refund is created for each completed payment that has no refund yet, then
+the refunds are made concurrently with background rate-limit priority.
+Every refund is claimed before Paypal is called, so calling refund_payments()
+again after an interruption only sends the refunds that were never sent.
+Refunds that were interrupted mid-call are left processing and resolved by
+recover(), never sent again blindly.
+
+"""
+import logging
+from decimal import Decimal
+
+from django.db.models import Count
+
+from moneyed import Money
+
+from . import api, statuscache
+from .api import cache, ratelimit
+from .bulk import run_concurrently
+from .models import Payment, Refund, StatusTransition
+from .transactions import atomic
+
+
+logger = logging.getLogger(__name__)
+
+
+# Statuses of refunds that keep a payment from being refunded again
+ACTIVE_STATUSES = ('new', 'processing', 'pending', 'completed')
+
+
+def refund_payments(payments, receivers=None, workers=1, batch_size=500):
+    """
+    Refund all completed payments of a queryset and return a report.
+
+    receivers may be a callable returning the ReceiverList of amounts to
+    refund for a Payment, or None for a full refund.
+
+    """
+    create_refunds(payments, receivers=receivers, batch_size=batch_size)
+
+    refunds = Refund.objects.filter(payment__in=payments)
+    recover(refunds)
+    execute(refunds, workers=workers, batch_size=batch_size)
+
+    return report(refunds)
+
+
+def create_refunds(payments, receivers=None, batch_size=500):
+    """Create a Refund for each completed payment without an active one"""
+    payments = (payments.filter(status='completed')
+                        .exclude(refunds__status__in=ACTIVE_STATUSES))
+
+    refunds = []
+    for payment in payments.iterator():
+        refund = Refund(payment=payment, money=payment.money)
+        if receivers is not None:
+            refund.set_receivers(receivers(payment))
+        refunds.append(refund)
+
+    Refund.objects.bulk_create(refunds, batch_size=batch_size)
+
+    return len(refunds)
+
+
+def execute(refunds, workers=1, batch_size=500):
+    """Process all new refunds of a queryset"""
+    refund_ids = list(refunds.filter(status='new')
+                             .values_list('pk', flat=True))
+
+    def process(refund_id):
+        refund = Refund.objects.select_related('payment').get(pk=refund_id)
+        with ratelimit.priority(ratelimit.PRIORITY_BACKGROUND):
+            try:
+                refund.process(update_payment=False)
+            except ValueError, e:
+                # already processed elsewhere, or the payment isn't completed
+                logger.info('Skipped Refund %s: %s', refund_id, e)
+            except api.PaypalAdaptiveApiError, e:
+                logger.warning('Refund %s failed: %s', refund_id, e)
+            except Exception:
+                logger.exception('Refund %s failed', refund_id)
+        return refund
+
+    refunded = []
+    for __, refund in run_concurrently(process, refund_ids, workers=workers):
+        if refund.is_full and refund.status in ('completed', 'pending'):
+            refunded.append(refund.payment_id)
+
+    for i in range(0, len(refunded), batch_size):
+        _mark_refunded(refunded[i:i + batch_size])
+
+    return len(refunded)
+
+
+def _mark_refunded(payment_ids):
+    """Set payments to refunded, logging their transitions"""
+    with atomic():
+        rows = list(Payment.objects.filter(pk__in=payment_ids)
+                                   .exclude(status='refunded')
+                                   .select_for_update()
+                                   .values_list('pk', 'status'))
+        if not rows:
+            return
+
+        ids = [pk for pk, __ in rows]
+        Payment.objects.filter(pk__in=ids).update(status='refunded')
+        StatusTransition.log_many(Payment, rows, 'refunded')
+
+    statuscache.forget(Payment, ids)
+
+
+def recover(refunds):
+    """
+    Resolve refunds left processing by an interrupted call, by checking the
+    payment on Paypal. The amounts Paypal has refunded to each receiver are
+    compared with those of the refunds of the payment already made: a
+    refund is completed if Paypal's amounts cover it as well, and only reset
+    for a retry if they don't go beyond the refunds already made.
+
+    """
+    for refund in refunds.filter(status='processing').select_related(
+            'payment'):
+        payment = refund.payment
+
+        try:
+            with cache.fresh():
+                res, __ = payment.call(api.PaymentDetails,
+                                       payKey=payment.pay_key)
+        except Exception, e:
+            logger.warning('Could not recover Refund %s: %s', refund.pk, e)
+            continue
+
+        infos = res.get('paymentInfoList', {}).get('paymentInfo', [])
+        statuses = [info.get('senderTransactionStatus') for info in infos]
+        refunded = _refunded_amounts(infos)
+        previous = _previous_amounts(refund)
+        receivers = refund.get_receivers()
+
+        if receivers is None:
+            made = statuses and all(s == 'REFUNDED' for s in statuses)
+        else:
+            made = all(refunded.get(r.email, 0) >=
+                       previous.get(r.email, 0) + Decimal(str(r.amount))
+                       for r in receivers.receivers)
+
+        if made and receivers is None:
+            refund.status = 'completed'
+            refund.is_full = True
+            refund.save()
+            payment.status = 'refunded'
+            payment.save()
+        elif made:
+            refund.status = 'completed'
+            refund.save()
+        elif all(amount <= previous.get(email, 0)
+                 for email, amount in refunded.items()):
+            refund.status = 'new'
+            refund.save()
+        else:
+            logger.warning('Could not recover Refund %s: Payment %s is '
+                           'refunded in part', refund.pk, payment.pk)
+
+
+def _refunded_amounts(infos):
+    """Amounts Paypal has refunded of a payment, by receiver email"""
+    amounts = {}
+    for info in infos:
+        email = info.get('receiver', {}).get('email')
+        amounts[email] = Decimal(info.get('refundedAmount') or 0)
+    return amounts
+
+
+def _previous_amounts(refund):
+    """Amounts of the other refunds of the payment made, by receiver email"""
+    amounts = {}
+    others = (refund.payment.refunds.filter(status__in=('pending',
+                                                         'completed'))
+                                    .exclude(pk=refund.pk))
+    for other in others:
+        receivers = other.get_receivers()
+        if receivers is None:
+            continue
+        for receiver in receivers.receivers:
+            amounts[receiver.email] = (amounts.get(receiver.email, 0) +
+                                       Decimal(str(receiver.amount)))
+    return amounts
+
+
+def report(refunds):
+    """Summarize the outcome of a batch of refunds"""
+    counts = dict((status, 0) for status, __ in Refund.STATUS_CHOICES)
+    for row in refunds.values('status').annotate(count=Count('pk')):
+        counts[row['status']] = row['count']
+
+    refunded = {}
+    rows = (refunds.filter(status__in=('completed', 'pending'))
+                   .values_list('money', 'money_currency'))
+    for amount, currency in rows:
+        refunded[currency] = refunded.get(currency, 0) + amount
+
+    return {
+        'refunds': sum(counts.values()),
+        'counts': counts,
+        'refunded': [Money(amount, currency)
+                     for currency, amount in sorted(refunded.items())],
+        'failed': list(refunds.filter(status='error')
+                              .values_list('payment_id', 'status_detail')),
+    }
@@ -0,0 +1,152 @@
+"""
+Replaying logged IPNs through the IPN view.
+
+With PAYPAL_IPN_LOG_ENABLED every incoming IPN is kept as an IPNLog.
+replay() posts the ones Paypal verified to the view again, without asking
+Paypal to verify them once more, either to load test the IPN pipeline with
+real traffic or to reprocess IPNs after a bug fix without waiting for Paypal
+to resend them:
+
+    from paypaladaptive.replay import replay, report
+
+    results = replay(IPNLog.objects.filter(return_status_code=500),
+                     processes=4, rate=20)
+    print report(results)
+
+IPNs Paypal didn't verify, e.g. forged ones it answered INVALID, are never
+replayed, and replayed IPNs are not logged again.
+
+or from the command line with the replay_ipns management command. The
+report lists the IPNs that were answered differently than when they came
+in.
+
+"""
+import ast
+import logging
+import time
+import urllib
+from multiprocessing import Pool
+
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+
+from django.core.urlresolvers import resolve
+from django.db import connection
+from django.http import Http404
+from django.test.client import RequestFactory
+
+from .api.ipn import unverified
+
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 90, 99)
+
+# verify_request_response of IPNLogs that may be replayed
+VERIFIED = 'VERIFIED'
+
+
+def _body(post):
+    """The urlencoded body of a logged IPN"""
+    try:
+        data = json.loads(post)
+    except ValueError:
+        # logged before IPNs were saved as JSON
+        data = ast.literal_eval(post)
+
+    return urllib.urlencode(sorted(
+        (key.encode('utf-8'), unicode(value).encode('utf-8'))
+        for key, value in data.items()))
+
+
+def replay_ipn(item):
+    """
+    Post the IPN (pk, path, body, logged status code) to its view. Returns
+    (pk, logged status code, status code, duration).
+
+    """
+    pk, path, body, logged = item
+    request = RequestFactory().post(
+        path, body, content_type='application/x-www-form-urlencoded')
+
+    start = time.time()
+    try:
+        match = resolve(path)
+        with unverified():
+            status_code = match.func(request, *match.args,
+                                     **match.kwargs).status_code
+    except Http404:
+        status_code = 404
+    except Exception, e:
+        logger.exception('Replay of IPN %s failed: %s', pk, e)
+        status_code = 500
+
+    return pk, logged, status_code, time.time() - start
+
+
+def _paced(items, rate):
+    """Yield items at no more than rate per second"""
+    start = time.time()
+    for i, item in enumerate(items):
+        if rate:
+            delay = start + i / rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        yield item
+
+
+def _close_connection():
+    # forked workers must not share the parent's database connection
+    connection.close()
+
+
+def replay(ipn_logs, processes=1, rate=None):
+    """
+    Replay the IPNLogs of a queryset that Paypal verified in order, at no
+    more than rate IPNs per second, from a pool of processes if more than
+    one. Returns a list of the results of replay_ipn().
+
+    """
+    items = ((pk, path, _body(post), status_code)
+             for pk, path, post, status_code in ipn_logs
+             .filter(verify_request_response=VERIFIED).order_by('pk')
+             .values_list('pk', 'path', 'post', 'return_status_code')
+             .iterator())
+
+    if processes <= 1:
+        return [replay_ipn(item) for item in _paced(items, rate)]
+
+    _close_connection()
+    pool = Pool(processes, initializer=_close_connection)
+    try:
+        return list(pool.imap_unordered(replay_ipn, _paced(items, rate)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def report(results):
+    """Summarize replayed IPNs"""
+    durations = sorted(duration for __, __, __, duration in results)
+    counts = {}
+    for __, __, status_code, __ in results:
+        counts[status_code] = counts.get(status_code, 0) + 1
+
+    latency = {}
+    if durations:
+        for percentile in PERCENTILES:
+            index = min(len(durations) - 1,
+                        len(durations) * percentile // 100)
+            latency['p%s' % percentile] = durations[index]
+        latency['max'] = durations[-1]
+
+    return {
+        'replayed': len(results),
+        'counts': counts,
+        'latency': latency,
+        'changed': sorted((pk, logged, status_code)
+                          for pk, logged, status_code, __ in results
+                          if status_code != logged),
+    }
@@ -28,6 +28,9 @@ IPN_LOG_ENABLED = getattr(settings, 'PAYPAL_IPN_LOG_ENABLED', False)
 USE_DELAYED_UPDATES = getattr(settings, 'PAYPAL_USE_DELAYED_UPDATES', False)
 DELAYED_UPDATE_COUNTDOWN = getattr(
     settings, 'PAYPAL_DELAYED_UPDATE_COUNTDOWN', timedelta(minutes=60))
+# Seconds to wait for Paypal when a user returns, None to not ask Paypal
+RETURN_UPDATE_DEADLINE = getattr(settings, 'PAYPAL_RETURN_UPDATE_DEADLINE',
+                                 None)
 USE_EMBEDDED = getattr(settings, 'PAYPAL_USE_EMBEDDED', True)
 SHIPPING = getattr(settings, 'PAYPAL_USE_SHIPPING', False)
 
@@ -36,5 +39,105 @@ DEFAULT_CURRENCY = getattr(settings, 'DEFAULT_CURRENCY', 'USD')
 DECIMAL_PLACES = getattr(settings, 'PAYPAL_DECIMAL_PLACES', 2)
 MAX_DIGITS = getattr(settings, 'PAYPAL_MAX_DIGITS', 10)
 
+# Read-through cache for read-only endpoints (PaymentDetails etc.)
+RESPONSE_CACHE_ENABLED = getattr(settings, 'PAYPAL_RESPONSE_CACHE_ENABLED',
+                                 False)
+RESPONSE_CACHE_ALIAS = getattr(settings, 'PAYPAL_RESPONSE_CACHE_ALIAS',
+                               'default')
+RESPONSE_CACHE_TIMEOUTS = getattr(settings, 'PAYPAL_RESPONSE_CACHE_TIMEOUTS',
+                                  {})
+
+# Share one call between identical concurrent requests to read-only endpoints
+COALESCE_REQUESTS = getattr(settings, 'PAYPAL_COALESCE_REQUESTS', False)
+COALESCE_ACROSS_PROCESSES = getattr(
+    settings, 'PAYPAL_COALESCE_ACROSS_PROCESSES', False)
+COALESCE_CACHE_ALIAS = getattr(settings, 'PAYPAL_COALESCE_CACHE_ALIAS',
+                               'default')
+COALESCE_TIMEOUT = getattr(settings, 'PAYPAL_COALESCE_TIMEOUT', 30)
+
+# Shared rate limit for calls to Paypal, in calls per second
+RATE_LIMIT = getattr(settings, 'PAYPAL_RATE_LIMIT', None)
+RATE_LIMIT_BURST = getattr(settings, 'PAYPAL_RATE_LIMIT_BURST', None)
+RATE_LIMIT_SHARES = getattr(settings, 'PAYPAL_RATE_LIMIT_SHARES', {
+    'interactive': 1.0,
+    'default': 0.8,
+    'background': 0.5,
+})
+RATE_LIMIT_MAX_WAIT = getattr(settings, 'PAYPAL_RATE_LIMIT_MAX_WAIT', 10)
+RATE_LIMIT_CACHE_ALIAS = getattr(settings, 'PAYPAL_RATE_LIMIT_CACHE_ALIAS',
+                                 'default')
+
+# Fail fast while Paypal is having trouble
+CIRCUIT_BREAKER_ENABLED = getattr(settings, 'PAYPAL_CIRCUIT_BREAKER_ENABLED',
+                                  False)
+CIRCUIT_BREAKER_FAILURE_RATE = getattr(
+    settings, 'PAYPAL_CIRCUIT_BREAKER_FAILURE_RATE', 0.5)
+CIRCUIT_BREAKER_MIN_CALLS = getattr(
+    settings, 'PAYPAL_CIRCUIT_BREAKER_MIN_CALLS', 20)
+CIRCUIT_BREAKER_WINDOW = getattr(settings, 'PAYPAL_CIRCUIT_BREAKER_WINDOW', 60)
+CIRCUIT_BREAKER_RESET_TIMEOUT = getattr(
+    settings, 'PAYPAL_CIRCUIT_BREAKER_RESET_TIMEOUT', 30)
+CIRCUIT_BREAKER_SLOW_CALL = getattr(
+    settings, 'PAYPAL_CIRCUIT_BREAKER_SLOW_CALL', None)
+
+# Concurrent calls allowed per endpoint class name, e.g. {'Refund': 2}
+BULKHEADS = getattr(settings, 'PAYPAL_BULKHEADS', {})
+BULKHEAD_MAX_WAIT = getattr(settings, 'PAYPAL_BULKHEAD_MAX_WAIT', 5)
+
+METRICS_ENABLED = getattr(settings, 'PAYPAL_METRICS_ENABLED', True)
+METRICS_BUCKETS = getattr(settings, 'PAYPAL_METRICS_BUCKETS',
+                          (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+METRICS_SINKS = getattr(settings, 'PAYPAL_METRICS_SINKS', [])
+METRICS_VIEW = getattr(settings, 'PAYPAL_METRICS_VIEW', False)
+
+# Where receivers of status signals run: None (after commit), 'thread' or
+# 'celery'
+SIGNAL_EXECUTOR = getattr(settings, 'PAYPAL_SIGNAL_EXECUTOR', None)
+SIGNAL_WORKERS = getattr(settings, 'PAYPAL_SIGNAL_WORKERS', 2)
+
+# Created payments older than this are expired by paypaladaptive.expiry
+PAYMENT_EXPIRY = getattr(settings, 'PAYPAL_PAYMENT_EXPIRY', timedelta(hours=3))
+EXPIRY_BATCH_SIZE = getattr(settings, 'PAYPAL_EXPIRY_BATCH_SIZE', 1000)
+
+# Pre-created payments for fixed-price checkouts, see paypaladaptive.paykeypool
+PAYKEY_POOLS = getattr(settings, 'PAYPAL_PAYKEY_POOLS', {})
+PAYKEY_POOL_MAX_AGE = getattr(settings, 'PAYPAL_PAYKEY_POOL_MAX_AGE',
+                              timedelta(hours=2))
+
+# Refresh the local ledger of a preapproval from Paypal when older than this
+PREAPPROVAL_LEDGER_MAX_AGE = getattr(
+    settings, 'PAYPAL_PREAPPROVAL_LEDGER_MAX_AGE', timedelta(hours=1))
+
+# Cached statuses served by the status view
+STATUS_CACHE_ALIAS = getattr(settings, 'PAYPAL_STATUS_CACHE_ALIAS', 'default')
+STATUS_CACHE_TIMEOUT = getattr(settings, 'PAYPAL_STATUS_CACHE_TIMEOUT', 3600)
+STATUS_MAX_WAIT = getattr(settings, 'PAYPAL_STATUS_MAX_WAIT', 25)
+STATUS_POLL_INTERVAL = getattr(settings, 'PAYPAL_STATUS_POLL_INTERVAL', 0.5)
+STATUS_MAX_WAITERS = getattr(settings, 'PAYPAL_STATUS_MAX_WAITERS', 10)
+
+# Change feed of status transitions, see paypaladaptive.changes
+CHANGE_FEED_DELAY = getattr(settings, 'PAYPAL_CHANGE_FEED_DELAY', 5)
+CHANGE_FEED_TOKEN = getattr(settings, 'PAYPAL_CHANGE_FEED_TOKEN', None)
+
+# Calls to Paypal taking longer than this many seconds are journaled in
+# SlowCall, see paypaladaptive.slowcalls
+SLOW_CALL_THRESHOLD = getattr(settings, 'PAYPAL_SLOW_CALL_THRESHOLD', None)
+SLOW_CALL_JOURNAL_SIZE = getattr(settings, 'PAYPAL_SLOW_CALL_JOURNAL_SIZE',
+                                 1000)
+
+# Record calls to Paypal to this file, or replay them from it without a
+# network, see paypaladaptive.api.cassette
+CASSETTE = getattr(settings, 'PAYPAL_CASSETTE', None)
+CASSETTE_MODE = getattr(settings, 'PAYPAL_CASSETTE_MODE', 'replay')
+
+# Profile this share of the calls of the IPN and return views and of
+# Payment.process, writing the profiles to PROFILE_DIR, see
+# paypaladaptive.profiling
+PROFILE_DIR = getattr(settings, 'PAYPAL_PROFILE_DIR', None)
+PROFILE_SAMPLE_RATE = getattr(settings, 'PAYPAL_PROFILE_SAMPLE_RATE', 0.01)
+
+# Dotted path of a callable returning an OpenTelemetry compatible tracer
+TRACER = getattr(settings, 'PAYPAL_TRACER', None)
+
 # Should tests hit Paypaladaptive or not? Defaults to using mock responses
 TEST_WITH_MOCK = getattr(settings, 'PAYPAL_TEST_WITH_MOCK', True)
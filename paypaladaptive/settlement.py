@@ -0,0 +1,300 @@
+"""
+Settlement of large numbers of Preapprovals, e.g. all pledges of a
+crowdfunding campaign.
+
+Charge every approved preapproval of a campaign that succeeded:
+
+    from paypaladaptive.settlement import settle
+
+    def receivers(preapproval):
+        return ReceiverList([Receiver(amount=preapproval.amount,
+                                      email='campaign@example.com')])
+
+    report = settle('campaign-42', campaign.preapprovals.all(),
+                    receivers=receivers, workers=8)
+
+or cancel all of them when it failed:
+
+    report = settle('campaign-42-cancel', campaign.preapprovals.all(),
+                    action='cancel', workers=8)
+
+Progress is checkpointed per preapproval in SettlementItem rows. Calling
+settle() again with the same name resumes the settlement, skipping
+preapprovals that have already been settled. Each item is claimed before
+Paypal is called and payments are sent with a trackingId, so items that were
+interrupted mid-call are looked up on Paypal before they are retried and a
+preapproval is never charged twice.
+
+Calls are made with background priority, so they are throttled by the rate
+limiter in favour of checkouts.
+
+"""
+import logging
+
+from django.db.models import Count
+from django.utils import timezone
+
+from moneyed import Money
+
+from . import statuscache
+from .api import (cache, ratelimit, PaymentDetails, PayError,
+                  CancelPreapprovalError, PaypalAdaptiveApiError,
+                  PaypalUnavailableError)
+from .bulk import run_concurrently
+from .models import (Payment, Preapproval, Settlement, SettlementItem,
+                     StatusTransition)
+from .transactions import atomic
+
+
+logger = logging.getLogger(__name__)
+
+
+# errorId Paypal answers PaymentDetails for an unknown payKey or trackingId
+ERROR_UNKNOWN_PAYMENT = '580022'
+
+CHARGEABLE_STATUSES = ('approved',)
+CANCELABLE_STATUSES = ('created', 'returned', 'approved')
+
+
+def settle(name, preapprovals, action='charge', receivers=None, workers=1,
+           batch_size=500, **kwargs):
+    """
+    Charge or cancel all preapprovals in a queryset and return a report.
+
+    receivers is required to charge and is called with each Preapproval to
+    get the ReceiverList of its payment. Extra keyword arguments are passed on
+    to Payment.process().
+
+    """
+    if action == 'charge' and receivers is None:
+        raise ValueError("receivers is required to charge preapprovals")
+
+    settlement, __ = Settlement.objects.get_or_create(
+        name=name, defaults={'action': action})
+
+    if settlement.action != action:
+        raise ValueError("Settlement %s was started to %s preapprovals"
+                         % (name, settlement.action))
+
+    add_items(settlement, preapprovals, batch_size=batch_size)
+    run(settlement, receivers=receivers, workers=workers, **kwargs)
+
+    return report(settlement)
+
+
+def add_items(settlement, preapprovals, batch_size=500):
+    """Add the preapprovals not yet part of the settlement to it"""
+    if settlement.action == 'charge':
+        statuses = CHARGEABLE_STATUSES
+    else:
+        statuses = CANCELABLE_STATUSES
+
+    pks = (preapprovals.filter(status__in=statuses)
+                       .exclude(settlement_items__settlement=settlement)
+                       .values_list('pk', flat=True))
+
+    items = [SettlementItem(settlement=settlement, preapproval_id=pk)
+             for pk in pks]
+    SettlementItem.objects.bulk_create(items, batch_size=batch_size)
+
+    return len(items)
+
+
+def run(settlement, receivers=None, workers=1, **kwargs):
+    """Process all unprocessed items of a settlement"""
+    Settlement.objects.filter(pk=settlement.pk).update(status='running')
+    settlement.status = 'running'
+
+    recover(settlement)
+
+    if settlement.action == 'charge':
+        def process(item_id):
+            with ratelimit.priority(ratelimit.PRIORITY_BACKGROUND):
+                _charge(item_id, receivers, **kwargs)
+    else:
+        def process(item_id):
+            with ratelimit.priority(ratelimit.PRIORITY_BACKGROUND):
+                _cancel(item_id)
+
+    item_ids = list(settlement.items.filter(status='new')
+                                    .values_list('pk', flat=True))
+
+    for __ in run_concurrently(process, item_ids, workers=workers):
+        pass
+
+    if settlement.action == 'charge':
+        _mark_used(settlement)
+
+    if not settlement.items.filter(status__in=('new', 'processing')).exists():
+        settlement.status = 'completed'
+        settlement.completed_date = timezone.now()
+        settlement.save()
+
+
+def _mark_used(settlement):
+    """Set the preapprovals of completed charges to used"""
+    with atomic():
+        rows = list(Preapproval.objects
+                    .filter(settlement_items__settlement=settlement,
+                            settlement_items__status='completed')
+                    .exclude(status='used')
+                    .select_for_update()
+                    .values_list('pk', 'status'))
+        if not rows:
+            return
+
+        ids = [pk for pk, __ in rows]
+        Preapproval.objects.filter(pk__in=ids).update(status='used')
+        StatusTransition.log_many(Preapproval, rows, 'used')
+
+    statuscache.forget(Preapproval, ids)
+
+
+def recover(settlement):
+    """
+    Resolve items left in processing by an interrupted run. Charges are
+    looked up on Paypal by their trackingId and only reset for a retry if
+    Paypal answers that it doesn't know about them, other errors leave them
+    processing.
+
+    """
+    items = (settlement.items.filter(status='processing')
+                             .select_related('payment', 'settlement'))
+
+    for item in items:
+        if settlement.action == 'cancel' or item.payment is None:
+            _set_status(item, 'new')
+            continue
+
+        payment = item.payment
+        try:
+            with cache.fresh():
+                if payment.pay_key:
+                    payment.update()
+                else:
+                    res, __ = payment.call(PaymentDetails,
+                                           trackingId=item.tracking_id)
+                    payment.pay_key = res.get('payKey', '')
+                    payment.status = payment._parse_update_status(res)
+                    payment.save()
+        except PaypalAdaptiveApiError, e:
+            if e.error_id == ERROR_UNKNOWN_PAYMENT:
+                # Paypal doesn't know about the payment, it's safe to retry
+                _set_status(item, 'new')
+            else:
+                # the payment may have gone through, look it up again on
+                # the next run rather than charging twice
+                logger.warning('Could not look up %s: %s', item.tracking_id,
+                               e)
+            continue
+
+        _finish_charge(item, payment)
+
+
+def report(settlement):
+    """Summarize the outcome of a settlement"""
+    counts = dict((status, 0) for status, __ in SettlementItem.STATUS_CHOICES)
+    rows = settlement.items.values('status').annotate(count=Count('pk'))
+    for row in rows:
+        counts[row['status']] = row['count']
+
+    charged = {}
+    payments = (Payment.objects
+                .filter(settlement_items__settlement=settlement,
+                        settlement_items__status='completed')
+                .values_list('money', 'money_currency'))
+    for amount, currency in payments:
+        charged[currency] = charged.get(currency, 0) + amount
+
+    failed = (settlement.items.filter(status='failed')
+                              .values_list('preapproval_id', 'status_detail'))
+
+    return {
+        'name': settlement.name,
+        'action': settlement.action,
+        'status': settlement.status,
+        'items': sum(counts.values()),
+        'counts': counts,
+        'charged': [Money(amount, currency)
+                    for currency, amount in sorted(charged.items())],
+        'failed': list(failed),
+    }
+
+
+def _claim(item_id):
+    """Mark an item as processing unless another worker already did"""
+    return SettlementItem.objects.filter(
+        pk=item_id, status='new').update(status='processing') == 1
+
+
+def _set_status(item, status, detail=''):
+    item.status = status
+    item.status_detail = detail
+    item.save()
+
+
+def _charge(item_id, receivers, **kwargs):
+    if not _claim(item_id):
+        return
+
+    item = (SettlementItem.objects.select_related('preapproval', 'payment')
+                                  .get(pk=item_id))
+    preapproval = item.preapproval
+
+    payment = item.payment
+    if payment is None or payment.status != 'new':
+        payment = Payment(money=preapproval.money)
+        payment.save()
+        item.payment = payment
+        item.save()
+
+    try:
+        payment.process(receivers(preapproval), preapproval=preapproval,
+                        trackingId=item.tracking_id, **kwargs)
+    except PaypalUnavailableError, e:
+        # nothing was sent to Paypal
+        _set_status(item, 'new', unicode(e))
+        return
+    except PayError, e:
+        _set_status(item, 'failed', unicode(e))
+        return
+    except Exception:
+        # The outcome is unknown, leave the item for recover()
+        logger.exception('Charging %s failed', item.tracking_id)
+        return
+
+    _finish_charge(item, payment)
+
+
+def _finish_charge(item, payment):
+    if payment.status == 'completed':
+        _set_status(item, 'completed')
+    elif payment.status in ('error', 'canceled'):
+        _set_status(item, 'failed', payment.status_detail)
+    else:
+        # still pending on Paypal, recover() will check it again
+        _set_status(item, 'processing',
+                    'Payment status is %s' % payment.status)
+
+
+def _cancel(item_id):
+    if not _claim(item_id):
+        return
+
+    item = SettlementItem.objects.select_related('preapproval').get(
+        pk=item_id)
+
+    try:
+        item.preapproval.cancel_preapproval()
+    except PaypalUnavailableError, e:
+        _set_status(item, 'new', unicode(e))
+        return
+    except CancelPreapprovalError, e:
+        _set_status(item, 'failed', unicode(e))
+        return
+    except Exception:
+        logger.exception('Canceling Preapproval %s failed',
+                         item.preapproval_id)
+        return
+
+    _set_status(item, 'completed')
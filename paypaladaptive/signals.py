@@ -0,0 +1,110 @@
+"""
+Signals sent when the status of a payment, preapproval or refund changes.
+
+Signals are sent after the transaction that changed the status has been
+committed, with the instance, its previous status and its new status:
+
+    from paypaladaptive.signals import payment_completed
+
+    def ship_order(sender, instance, old_status, status, **kwargs):
+        ...
+
+    payment_completed.connect(ship_order)
+
+By default receivers run in the process that changed the status, right after
+the commit. Set PAYPAL_SIGNAL_EXECUTOR to 'thread' to run them in a pool of
+background threads, or to 'celery' to run them in a celery task, so slow
+receivers don't delay e.g. the response to an IPN. Errors raised by
+receivers are logged.
+
+"""
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+from django.db import connection
+from django.dispatch import Signal
+
+from . import settings
+from .transactions import on_commit
+
+
+logger = logging.getLogger(__name__)
+
+ARGS = ['instance', 'old_status', 'status']
+
+# sent for every change of status
+status_changed = Signal(providing_args=ARGS)
+
+payment_completed = Signal(providing_args=ARGS)
+payment_failed = Signal(providing_args=ARGS)
+payment_refunded = Signal(providing_args=ARGS)
+preapproval_approved = Signal(providing_args=ARGS)
+preapproval_canceled = Signal(providing_args=ARGS)
+preapproval_used = Signal(providing_args=ARGS)
+refund_completed = Signal(providing_args=ARGS)
+refund_failed = Signal(providing_args=ARGS)
+
+STATUS_SIGNALS = {
+    ('payment', 'completed'): payment_completed,
+    ('payment', 'error'): payment_failed,
+    ('payment', 'canceled'): payment_failed,
+    ('payment', 'expired'): payment_failed,
+    ('payment', 'refunded'): payment_refunded,
+    ('preapproval', 'approved'): preapproval_approved,
+    ('preapproval', 'canceled'): preapproval_canceled,
+    ('preapproval', 'used'): preapproval_used,
+    ('refund', 'completed'): refund_completed,
+    ('refund', 'error'): refund_failed,
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def send_status_signals(instance, old_status, status):
+    """Send status_changed and the signal for the new status, if any"""
+    signals = [status_changed]
+    signal = STATUS_SIGNALS.get((instance._meta.model_name, status))
+    if signal is not None:
+        signals.append(signal)
+
+    for signal in signals:
+        responses = signal.send_robust(instance.__class__, instance=instance,
+                                       old_status=old_status, status=status)
+        for receiver, response in responses:
+            if isinstance(response, Exception):
+                logger.error('Receiver %r failed on status %s of %s %s: %s',
+                             receiver, status, instance.__class__.__name__,
+                             instance.pk, response)
+
+
+def _send_in_thread(instance, old_status, status):
+    try:
+        send_status_signals(instance, old_status, status)
+    finally:
+        connection.close()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(settings.SIGNAL_WORKERS)
+        return _pool
+
+
+def dispatch(instance, old_status):
+    """Send the signals for a change of status once it is committed"""
+    status = instance.status
+    executor = settings.SIGNAL_EXECUTOR
+
+    if executor == 'celery':
+        from .tasks import send_status_signals as task
+        on_commit(lambda: task.delay(instance._meta.model_name, instance.pk,
+                                     old_status, status))
+    elif executor == 'thread':
+        on_commit(lambda: _get_pool().apply_async(
+            _send_in_thread, (instance, old_status, status)))
+    else:
+        on_commit(lambda: send_status_signals(instance, old_status, status))
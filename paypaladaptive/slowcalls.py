@@ -0,0 +1,82 @@
+"""
+Journal of slow calls to Paypal.
+
+With PAYPAL_SLOW_CALL_THRESHOLD set, every call of an endpoint and every
+IPN verification taking longer than that many seconds is saved as a
+SlowCall, with the time spent waiting for the rate limiter and bulkheads,
+connecting, on the TLS handshake, until the first byte and in total. The
+journal keeps the last PAYPAL_SLOW_CALL_JOURNAL_SIZE calls and can be
+browsed in the admin.
+
+"""
+import logging
+import re
+import time
+
+from django.db import DatabaseError
+
+from . import settings
+from .transactions import atomic
+
+
+logger = logging.getLogger(__name__)
+
+CORRELATION_ID_RE = re.compile(r'"correlationId"\s*:\s*"([^"]*)"')
+
+
+def record(endpoint, start, request, request_bytes=None):
+    """
+    Journal the call to endpoint started at start, made with the UrlRequest
+    request, if it was slow. Returns the SlowCall or None.
+
+    """
+    threshold = settings.SLOW_CALL_THRESHOLD
+    if threshold is None:
+        return None
+
+    total = time.time() - start
+    if total < threshold:
+        return None
+
+    from .models import SlowCall
+
+    timings = getattr(request, 'timings', None) or {}
+    response = request.response
+    correlation_id = ''
+    response_bytes = None
+    if isinstance(response, basestring):
+        response_bytes = len(response)
+        match = CORRELATION_ID_RE.search(response)
+        if match is not None:
+            correlation_id = match.group(1)
+
+    slow_call = SlowCall(
+        endpoint=endpoint, status_code=request.code,
+        correlation_id=correlation_id[:50],
+        wait=total - timings['total'] if 'total' in timings else None,
+        connect=timings.get('connect'), tls=timings.get('tls'),
+        first_byte=timings.get('first_byte'), total=total,
+        request_bytes=request_bytes, response_bytes=response_bytes)
+
+    try:
+        with atomic():
+            slow_call.save()
+            trim()
+    except DatabaseError, e:
+        logger.warning('Could not journal slow call to %s: %s', endpoint, e)
+        return None
+
+    return slow_call
+
+
+def trim(size=None):
+    """Delete all but the last size journaled calls"""
+    from .models import SlowCall
+
+    if size is None:
+        size = settings.SLOW_CALL_JOURNAL_SIZE
+
+    ids = list(SlowCall.objects.order_by('-id')
+               .values_list('id', flat=True)[size:size + 1])
+    if ids:
+        SlowCall.objects.filter(id__lte=ids[0]).delete()
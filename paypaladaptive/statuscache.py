@@ -0,0 +1,122 @@
+"""
+Cache of the statuses of payments and preapprovals.
+
+An entry is written whenever the status of an object changes, once the
+transaction saving it commits, so frontends polling for the outcome of a
+checkout are answered without loading the row.
+Objects missing from the cache are loaded from the database once and cached.
+
+Requests long-polling the status view wait on a condition notified by every
+change made in this process. Changes made by other processes are only seen
+when the waiting request reads the cache again, every
+PAYPAL_STATUS_POLL_INTERVAL seconds.
+
+"""
+import threading
+from contextlib import contextmanager
+
+from . import settings
+from .helpers import get_cache
+from .transactions import on_commit
+
+
+KEY_PREFIX = 'paypaladaptive:status'
+
+_changed = threading.Condition()
+_version = 0
+_waiters = 0
+
+
+def make_key(model, pk):
+    return '%s:%s:%s' % (KEY_PREFIX, model._meta.model_name, pk)
+
+
+def _cache():
+    return get_cache(settings.STATUS_CACHE_ALIAS)
+
+
+def publish(obj):
+    """Cache the status of obj once the transaction saving it commits"""
+    key = make_key(obj.__class__, obj.pk)
+    value = (obj.status, obj.secret_uuid)
+
+    def set_status():
+        _cache().set(key, value, settings.STATUS_CACHE_TIMEOUT)
+        _notify()
+
+    on_commit(set_status)
+
+
+def forget(model, pks):
+    """Drop the entries of objects changed without save(), e.g. by update()"""
+    _cache().delete_many([make_key(model, pk) for pk in pks])
+    _notify()
+
+
+def _notify():
+    global _version
+    with _changed:
+        _version += 1
+        _changed.notify_all()
+
+
+def version():
+    """Number of status changes made in this process so far"""
+    return _version
+
+
+def wait_for_change(since, timeout):
+    """
+    Wait up to timeout seconds for a status change in this process after
+    version since, and return the current version.
+
+    """
+    with _changed:
+        if _version == since:
+            _changed.wait(timeout)
+        return _version
+
+
+@contextmanager
+def waiting():
+    """
+    Count a long-polling request against PAYPAL_STATUS_MAX_WAITERS. Yields
+    False if this process already holds as many.
+
+    """
+    global _waiters
+    with _changed:
+        allowed = _waiters < settings.STATUS_MAX_WAITERS
+        if allowed:
+            _waiters += 1
+    try:
+        yield allowed
+    finally:
+        if allowed:
+            with _changed:
+                _waiters -= 1
+
+
+def get_statuses(model, pks):
+    """
+    Return a dict of (status, secret_uuid) tuples by pk. Objects that are
+    not cached are loaded from the database.
+
+    """
+    keys = dict((make_key(model, pk), pk) for pk in pks)
+    cached = _cache().get_many(keys.keys())
+    statuses = dict((keys[key], value) for key, value in cached.items())
+
+    missing = [pk for pk in pks if pk not in statuses]
+    if missing:
+        loaded = dict(
+            (pk, (status, secret_uuid)) for pk, status, secret_uuid in
+            model.objects.filter(pk__in=missing)
+                         .values_list('pk', 'status', 'secret_uuid'))
+        _cache().set_many(
+            dict((make_key(model, pk), value)
+                 for pk, value in loaded.items()),
+            settings.STATUS_CACHE_TIMEOUT)
+        statuses.update(loaded)
+
+    return statuses
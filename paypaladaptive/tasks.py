@@ -1,7 +1,8 @@
 from celery.task import task
 from celery.utils.log import get_task_logger
 
-from .models import Preapproval, Payment
+from .api import cache, ratelimit
+from .models import Preapproval, Payment, Refund
 
 
 logger = get_task_logger(__name__)
@@ -12,7 +13,9 @@ def update_preapproval(preapproval_id):
     preapproval = Preapproval.objects.get(pk=preapproval_id)
     if preapproval.status != 'used':
         logger.info('Updating Preapproval %s', preapproval.id)
-        preapproval.update()
+        with ratelimit.priority(ratelimit.PRIORITY_BACKGROUND), \
+                cache.fresh():
+            preapproval.update()
 
 
 @task
@@ -20,4 +23,34 @@ def update_payment(payment_id):
     payment = Payment.objects.get(pk=payment_id)
     if payment.status != 'completed':
         logger.info('Updating Payment %s', payment.id)
-        payment.update()
+        with ratelimit.priority(ratelimit.PRIORITY_BACKGROUND), \
+                cache.fresh():
+            payment.update()
+
+
+@task
+def expire_stale():
+    from .expiry import sweep
+    counts = sweep()
+    logger.info('Expired %(payments)s payments and %(preapprovals)s '
+                'preapprovals', counts)
+    return counts
+
+
+@task
+def refill_paykey_pools():
+    from .paykeypool import refill_all
+    counts = refill_all()
+    for name, pool_counts in counts.items():
+        logger.info('Paykey pool %s: retired %s, created %s payments',
+                    name, pool_counts['retired'], pool_counts['created'])
+    return counts
+
+
+@task
+def send_status_signals(model_name, pk, old_status, status):
+    from . import signals
+    model = {'payment': Payment,
+             'preapproval': Preapproval,
+             'refund': Refund}[model_name]
+    signals.send_status_signals(model.objects.get(pk=pk), old_status, status)
@@ -7,3 +7,29 @@ from .payment import PaymentDBTest
 from .payment_return_url import TestPaymentReturnURL
 from .payment_response import TestPaymentResponses
 from .payment_update import TestPaymentUpdate
+from .response_cache import TestResponseCache
+from .singleflight import (TestRequestCoalescing, TestSharedCoalescing,
+                           TestGroup)
+from .ratelimit import TestRateLimiter
+from .circuit_breaker import TestCircuitBreaker, TestUrlRequestBreaker
+from .bulkhead import TestBulkhead
+from .settlement import TestSettlement
+from .refund import TestRefund
+from .payouts import TestPlan, TestPayout
+from .expiry import TestExpiry
+from .paykeypool import TestPaykeyPool
+from .preapproval_ledger import TestPreapprovalLedger
+from .status import TestStatusView
+from .deadline import TestDeadline, TestReturnUpdate
+from .signals import TestStatusSignals
+from .changes import TestChangeFeed
+from .metrics import TestEndpointMetrics, TestPrometheus
+from .tracing import TestTracing
+from .logs import TestLogs
+from .slowcalls import TestSlowCalls
+from .emulator import TestEmulator
+from .benchmarks import TestBenchmarks
+from .budgets import TestQueryBudgets
+from .replay import TestReplay
+from .cassette import TestCassette
+from .profiling import TestProfiling
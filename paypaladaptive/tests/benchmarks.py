@@ -0,0 +1,318 @@
+"""
+Benchmarks of the payment and IPN hot paths.
+
+Run them against a stub transport with
+
+    python runtests.py --benchmark [--benchmark-output=results.json]
+        [--benchmark-compare=previous.json]
+
+The results are written as JSON: per benchmark the timings of single calls
+in seconds and the number of database queries a call makes. Comparing two
+result files prints the change of the median of each benchmark.
+
+"""
+import logging
+import platform
+import sys
+import timeit
+import urllib
+from datetime import datetime
+
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+
+import django
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.test import TestCase
+from django.test.client import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from mock import patch
+from moneyed import Money
+
+import paypaladaptive
+from paypaladaptive.api import Pay, PaymentDetails, Receiver, ReceiverList
+from paypaladaptive.api.ipn import IPN, constants
+from paypaladaptive.models import Payment
+
+
+RECEIVERS = 6
+
+
+def _response(**fields):
+    fields['responseEnvelope'] = {
+        'timestamp': '2014-03-04T05:06:07.890-08:00',
+        'ack': 'Success',
+        'correlationId': '3a6f5bbd24f91',
+        'build': '10175386'}
+    return json.dumps(fields)
+
+
+def receiver_list():
+    return ReceiverList([
+        Receiver(amount=10, email='receiver%s@example.com' % i,
+                 primary=False)
+        for i in range(RECEIVERS)])
+
+
+PAY_RESPONSE = _response(payKey='AP-0NH70512RW5938216',
+                         paymentExecStatus='CREATED')
+
+PAYMENT_DETAILS_RESPONSE = _response(
+    payKey='AP-0NH70512RW5938216', status='COMPLETED', actionType='PAY',
+    currencyCode='USD', senderEmail='buyer@example.com',
+    feesPayer='EACHRECEIVER', reverseAllParallelPaymentsOnError='false',
+    returnUrl='http://example.com/return/', cancelUrl='http://example.com/',
+    paymentInfoList={'paymentInfo': [
+        {'receiver': {'email': 'receiver%s@example.com' % i,
+                      'amount': '10.00', 'primary': 'false'},
+         'transactionId': '7GN24593R0%07d' % i,
+         'transactionStatus': 'COMPLETED',
+         'senderTransactionId': '8HJ35604S1%07d' % i,
+         'senderTransactionStatus': 'COMPLETED',
+         'pendingRefund': 'false'}
+        for i in range(RECEIVERS)]})
+
+
+def ipn_data(money):
+    data = {
+        'transaction_type': constants.IPN_TYPE_PAYMENT,
+        'status': 'COMPLETED',
+        'pay_key': 'AP-0NH70512RW5938216',
+        'action_type': 'PAY',
+        'sender_email': 'buyer@example.com',
+        'fees_payer': 'EACHRECEIVER',
+        'payment_request_date': 'Tue Mar 04 05:06:07 PST 2014',
+        'reverse_all_parallel_payments_on_error': 'false',
+        'return_url': 'http://example.com/return/',
+        'cancel_url': 'http://example.com/cancel/',
+        'charset': 'windows-1252',
+        'notify_version': 'UNVERSIONED',
+        'verify_sign': 'AFcWxV21C7fd0v3bYYYRCpSSRl31A2s3fgt9JAUvk7ZZ2FTX'}
+    amount = money.amount / RECEIVERS
+    for i in range(RECEIVERS):
+        prefix = 'transaction[%s].' % i
+        data.update({
+            prefix + 'id': '7GN24593R0%07d' % i,
+            prefix + 'id_for_sender_txn': '8HJ35604S1%07d' % i,
+            prefix + 'receiver': 'receiver%s@example.com' % i,
+            prefix + 'amount': '%s %s' % (money.currency, amount),
+            prefix + 'status': 'Completed',
+            prefix + 'status_for_sender_txn': 'Completed',
+            prefix + 'is_primary_receiver': 'false',
+            prefix + 'pending_reason': 'NONE'})
+    return data
+
+
+class StubRequest(object):
+    """Transport answering each operation with a canned response"""
+
+    responses = {
+        'Pay': PAY_RESPONSE,
+        'PaymentDetails': PAYMENT_DETAILS_RESPONSE,
+        '_notify-validate': 'VERIFIED',
+        }
+
+    code = 200
+    timings = {}
+
+    def call(self, url, data=None, headers=None):
+        self.response = self.responses[url.rsplit('/', 1)[-1]
+                                       .rsplit('=', 1)[-1]]
+        return self
+
+
+class Benchmark(object):
+    """
+    Times rounds single calls of run(). setup() is called before each call
+    and isn't timed; its return value is passed to run().
+
+    """
+
+    name = None
+    rounds = 200
+
+    def setup(self):
+        return None
+
+    def run(self, arg):
+        raise NotImplementedError
+
+    def measure(self, rounds=None):
+        rounds = rounds or self.rounds
+        timings = []
+        queries = 0
+        for i in range(rounds):
+            arg = self.setup()
+            with CaptureQueriesContext(connection) as context:
+                start = timeit.default_timer()
+                self.run(arg)
+                timings.append(timeit.default_timer() - start)
+            queries += len(context.captured_queries)
+        return summarize(self.name, timings, float(queries) / rounds)
+
+
+def summarize(name, timings, queries):
+    timings = sorted(timings)
+    count = len(timings)
+    return {
+        'name': name,
+        'rounds': count,
+        'min': timings[0],
+        'median': timings[count // 2],
+        'mean': sum(timings) / count,
+        'p95': timings[min(count - 1, int(count * 0.95))],
+        'max': timings[-1],
+        'ops_per_second': count / sum(timings) if sum(timings) else None,
+        'queries': queries,
+        }
+
+
+class PayPayload(Benchmark):
+    """Building and serializing a Pay request to six receivers"""
+
+    name = 'pay_payload'
+    rounds = 2000
+
+    def setup(self):
+        return {'money': Money(60, 'USD'),
+                'return_url': 'http://example.com/return/',
+                'cancel_url': 'http://example.com/cancel/',
+                'ipn_url': 'http://example.com/ipn/1/secret/',
+                'receivers': receiver_list()}
+
+    def run(self, kwargs):
+        json.dumps(Pay(**kwargs).data, cls=DjangoJSONEncoder)
+
+
+class ResponseParsing(Benchmark):
+    """A PaymentDetails call of six receivers, parsing the response"""
+
+    name = 'response_parsing'
+    rounds = 2000
+
+    def run(self, arg):
+        PaymentDetails(payKey='AP-0NH70512RW5938216').call()
+
+
+class IPNParsing(Benchmark):
+    """Verifying and parsing an IPN of six transactions"""
+
+    name = 'ipn_parsing'
+    rounds = 1000
+
+    def setup(self):
+        return RequestFactory().post(
+            '/ipn/1/secret/', urllib.urlencode(ipn_data(Money(60, 'USD'))),
+            content_type='application/x-www-form-urlencoded')
+
+    def run(self, request):
+        IPN(request)
+
+
+class IPNView(Benchmark):
+    """An IPN completing a payment, through the test client"""
+
+    name = 'ipn_view'
+
+    def __init__(self):
+        self.client = Client()
+        self.payment = Payment.objects.create(money=Money(60, 'USD'),
+                                              status='created')
+        self.body = urllib.urlencode(ipn_data(self.payment.money))
+
+    def setup(self):
+        Payment.objects.filter(pk=self.payment.pk).update(status='created')
+        return self.payment.ipn_url.split('/', 3)[-1]
+
+    def run(self, path):
+        response = self.client.post(
+            '/' + path, self.body,
+            content_type='application/x-www-form-urlencoded')
+        if response.status_code != 204:
+            raise AssertionError('IPN was answered with %s'
+                                 % response.status_code)
+
+
+class PaymentProcess(Benchmark):
+    """Payment.process() of a saved payment to six receivers"""
+
+    name = 'payment_process'
+
+    def setup(self):
+        return (Payment.objects.create(money=Money(60, 'USD')),
+                receiver_list())
+
+    def run(self, arg):
+        payment, receivers = arg
+        payment.process(receivers)
+
+
+class PaymentUpdate(Benchmark):
+    """Payment.update() of a created payment"""
+
+    name = 'payment_update'
+
+    def setup(self):
+        return Payment.objects.create(money=Money(60, 'USD'),
+                                      status='created',
+                                      pay_key='AP-0NH70512RW5938216')
+
+    def run(self, payment):
+        payment.update()
+
+
+BENCHMARKS = (PayPayload, ResponseParsing, IPNParsing, IPNView,
+              PaymentProcess, PaymentUpdate)
+
+
+def run(names=None, rounds=None):
+    """Run the benchmarks, or those named, and return the results"""
+    results = []
+    logger = logging.getLogger('paypaladaptive')
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        with patch('paypaladaptive.api.endpoints.UrlRequest', StubRequest), \
+                patch('paypaladaptive.api.ipn.endpoints.UrlRequest',
+                      StubRequest):
+            for benchmark in BENCHMARKS:
+                if names and benchmark.name not in names:
+                    continue
+                results.append(benchmark().measure(rounds))
+    finally:
+        logger.setLevel(level)
+
+    return {
+        'version': '.'.join(map(str, paypaladaptive.__version__)),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'date': datetime.utcnow().isoformat(),
+        'results': results,
+        }
+
+
+def compare(old, new, out=sys.stdout):
+    """Print the change of the median of each benchmark in new from old"""
+    previous = dict((r['name'], r) for r in old['results'])
+    for result in new['results']:
+        before = previous.get(result['name'])
+        if before is None:
+            continue
+        change = (result['median'] / before['median'] - 1) * 100
+        out.write('%-20s %10.1fus %10.1fus %+7.1f%% queries %s -> %s\n' % (
+            result['name'], before['median'] * 1e6, result['median'] * 1e6,
+            change, before['queries'], result['queries']))
+
+
+class TestBenchmarks(TestCase):
+    def test_run(self):
+        results = run(rounds=2)
+
+        self.assertEqual([r['name'] for r in results['results']],
+                         [b.name for b in BENCHMARKS])
+        self.assertTrue(all(r['rounds'] == 2 for r in results['results']))
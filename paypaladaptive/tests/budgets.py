@@ -0,0 +1,211 @@
+"""
+Query and write budgets of the payment flows.
+
+Each flow runs against the emulator, in process, and may make at most as
+many database queries and writes (INSERT, UPDATE and DELETE statements) as
+budgeted below. When a change makes a flow cheaper, lower its budget; when
+it has to make a flow more expensive, raise it knowingly.
+
+"""
+import re
+import urllib
+import urlparse
+
+from django.db import connection
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
+
+from mock import patch
+from moneyed import Money
+
+from paypaladaptive import settings
+from paypaladaptive.api import Receiver, ReceiverList
+from paypaladaptive.api.ipn import constants
+from paypaladaptive.emulator import Emulator
+from paypaladaptive.models import Payment, Preapproval
+
+
+# flow: (queries, writes), savepoints of the test transaction included
+BUDGETS = {
+    'payment_process': (5, 3),
+    'payment_process_preapproved': (9, 6),
+    'payment_update': (3, 3),
+    'payment_refund': (8, 8),
+    'payment_return': (5, 2),
+    'preapproval_process': (5, 3),
+    'preapproval_update': (3, 3),
+    'preapproval_return': (5, 2),
+    'ipn_payment': (5, 2),
+    'ipn_payment_logged': (9, 6),
+    'ipn_adjustment': (4, 1),
+    'ipn_preapproval': (5, 2),
+    'ipn_untyped': (5, 1),
+    }
+
+WRITES = ('INSERT', 'UPDATE', 'DELETE')
+
+# sqlite records queries as QUERY = '...' - PARAMS = (...)
+STATEMENT_RE = re.compile(r"\s*(?:QUERY = u?')?\s*(\w*)")
+
+
+def capture(function, *args, **kwargs):
+    """Run function, returning the SQL of all queries and of the writes"""
+    with CaptureQueriesContext(connection) as context:
+        function(*args, **kwargs)
+    queries = [query['sql'] for query in context.captured_queries]
+    writes = [sql for sql in queries
+              if STATEMENT_RE.match(sql).group(1).upper() in WRITES]
+    return queries, writes
+
+
+class TestQueryBudgets(TestCase):
+    def setUp(self):
+        self.ipns = []
+        self.emulator = Emulator(
+            ipn_sender=lambda url, body: self.ipns.append((url, body)))
+        request_class = self.emulator.request_class()
+        for target in ('paypaladaptive.api.endpoints.UrlRequest',
+                       'paypaladaptive.api.ipn.endpoints.UrlRequest'):
+            patcher = patch(target, request_class)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.client = Client()
+        self.receivers = ReceiverList([
+            Receiver(amount=10, email='seller@example.com', primary=False),
+            Receiver(amount=5, email='other@example.com', primary=False)])
+
+    def assertBudget(self, flow, function, *args, **kwargs):
+        queries, writes = capture(function, *args, **kwargs)
+        max_queries, max_writes = BUDGETS[flow]
+        message = '%s made %s queries and %s writes, budget is %s and %s:\n%s'
+        self.assertTrue(
+            len(queries) <= max_queries and len(writes) <= max_writes,
+            message % (flow, len(queries), len(writes), max_queries,
+                       max_writes, '\n'.join(queries)))
+
+    def post_ipn(self, url, body, status_code=204):
+        response = self.client.post(
+            urlparse.urlparse(url).path, body,
+            content_type='application/x-www-form-urlencoded')
+        self.assertEqual(response.status_code, status_code)
+
+    def approve(self, key):
+        """Approve on the emulator, returning the IPN it sent"""
+        self.emulator.approve(key)
+        return self.ipns.pop()
+
+    def created_payment(self):
+        payment = Payment.objects.create(money=Money(15, 'USD'))
+        payment.process(self.receivers)
+        return payment
+
+    def approved_preapproval(self):
+        preapproval = Preapproval.objects.create(money=Money(20, 'USD'))
+        preapproval.process()
+        self.post_ipn(*self.approve(preapproval.preapproval_key))
+        return Preapproval.objects.get(pk=preapproval.pk)
+
+    def test_payment_process(self):
+        payment = Payment.objects.create(money=Money(15, 'USD'))
+        self.assertBudget('payment_process', payment.process, self.receivers)
+        self.assertEqual(payment.status, 'created')
+
+    def test_payment_process_preapproved(self):
+        preapproval = self.approved_preapproval()
+        payment = Payment.objects.create(money=Money(15, 'USD'))
+
+        self.assertBudget('payment_process_preapproved', payment.process,
+                          self.receivers, preapproval=preapproval)
+        self.assertEqual(payment.status, 'completed')
+
+    def test_payment_update(self):
+        payment = self.created_payment()
+        self.emulator.approve(payment.pay_key)
+
+        self.assertBudget('payment_update', payment.update)
+        self.assertEqual(payment.status, 'completed')
+
+    def test_payment_refund(self):
+        payment = self.created_payment()
+        self.post_ipn(*self.approve(payment.pay_key))
+        payment = Payment.objects.get(pk=payment.pk)
+
+        self.assertBudget('payment_refund', payment.refund)
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status,
+                         'refunded')
+
+    def test_payment_return(self):
+        payment = self.created_payment()
+        path = urlparse.urlparse(payment.return_url).path
+
+        self.assertBudget('payment_return', self.client.get, path)
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status,
+                         'returned')
+
+    def test_preapproval_process(self):
+        preapproval = Preapproval.objects.create(money=Money(20, 'USD'))
+        self.assertBudget('preapproval_process', preapproval.process)
+        self.assertEqual(preapproval.status, 'created')
+
+    def test_preapproval_update(self):
+        preapproval = Preapproval.objects.create(money=Money(20, 'USD'))
+        preapproval.process()
+        self.emulator.approve(preapproval.preapproval_key)
+
+        self.assertBudget('preapproval_update', preapproval.update)
+        self.assertEqual(preapproval.status, 'approved')
+
+    def test_preapproval_return(self):
+        preapproval = Preapproval.objects.create(money=Money(20, 'USD'))
+        preapproval.process()
+        path = urlparse.urlparse(preapproval.return_url).path
+
+        self.assertBudget('preapproval_return', self.client.get, path)
+        self.assertEqual(Preapproval.objects.get(pk=preapproval.pk).status,
+                         'returned')
+
+    def test_ipn_payment(self):
+        payment = self.created_payment()
+        url, body = self.approve(payment.pay_key)
+
+        self.assertBudget('ipn_payment', self.post_ipn, url, body)
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status,
+                         'completed')
+
+    def test_ipn_payment_logged(self):
+        payment = self.created_payment()
+        url, body = self.approve(payment.pay_key)
+
+        with patch.object(settings, 'IPN_LOG_ENABLED', True):
+            self.assertBudget('ipn_payment_logged', self.post_ipn, url, body)
+
+    def test_ipn_adjustment(self):
+        payment = self.created_payment()
+        url, body = self.approve(payment.pay_key)
+        fields = dict(urlparse.parse_qsl(body))
+        fields['transaction_type'] = constants.IPN_TYPE_ADJUSTMENT
+        body = urllib.urlencode(sorted(fields.items()))
+        self.emulator.sent_ipns.add(body)
+
+        self.assertBudget('ipn_adjustment', self.post_ipn, url, body)
+
+    def test_ipn_preapproval(self):
+        preapproval = Preapproval.objects.create(money=Money(20, 'USD'))
+        preapproval.process()
+        url, body = self.approve(preapproval.preapproval_key)
+
+        self.assertBudget('ipn_preapproval', self.post_ipn, url, body)
+        self.assertEqual(Preapproval.objects.get(pk=preapproval.pk).status,
+                         'approved')
+
+    def test_ipn_untyped(self):
+        payment = self.created_payment()
+        url, body = self.approve(payment.pay_key)
+        fields = dict(urlparse.parse_qsl(body))
+        del fields['transaction_type']
+        body = urllib.urlencode(sorted(fields.items()))
+        self.emulator.sent_ipns.add(body)
+
+        self.assertBudget('ipn_untyped', self.post_ipn, url, body)
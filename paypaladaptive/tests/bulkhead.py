@@ -0,0 +1,73 @@
+import threading
+
+from django.test import TestCase
+
+from mock import patch
+
+from paypaladaptive import settings
+from paypaladaptive.api import BulkheadFullError, PaymentDetails, bulkhead
+from paypaladaptive.metrics import registry
+
+
+@patch.object(settings, 'BULKHEADS', {'Refund': 1, 'Pay': 2})
+class TestBulkhead(TestCase):
+    def setUp(self):
+        registry.reset()
+
+    def test_unlimited(self):
+        self.assertIsNone(bulkhead.get_bulkhead('PaymentDetails'))
+        with bulkhead.slot('PaymentDetails'):
+            pass
+
+    def test_full(self):
+        with patch.object(settings, 'BULKHEAD_MAX_WAIT', 0):
+            with bulkhead.slot('Refund'):
+                with self.assertRaises(BulkheadFullError):
+                    with bulkhead.slot('Refund'):
+                        pass
+
+                # other classes are not affected
+                with bulkhead.slot('Pay'):
+                    pass
+
+            with bulkhead.slot('Refund'):
+                pass
+
+        counters = registry.snapshot()['counters']
+        self.assertEqual(counters[('paypaladaptive_bulkhead_rejected_total',
+                                   (('bulkhead', 'Refund'),))], 1)
+
+    @patch('paypaladaptive.api.ratelimit.acquire')
+    def test_full_spends_no_token(self, acquire):
+        with patch.object(settings, 'BULKHEADS', {'PaymentDetails': 1}):
+            with patch.object(settings, 'BULKHEAD_MAX_WAIT', 0):
+                with bulkhead.slot('PaymentDetails'):
+                    self.assertRaises(BulkheadFullError,
+                                      PaymentDetails(payKey='AP-1').call)
+
+        self.assertFalse(acquire.called)
+
+    def test_waits_for_slot(self):
+        refunds = bulkhead.get_bulkhead('Refund')
+        refunds.acquire()
+        acquired = threading.Event()
+
+        def wait_for_slot():
+            with bulkhead.slot('Refund'):
+                acquired.set()
+
+        thread = threading.Thread(target=wait_for_slot)
+        thread.start()
+        self.assertFalse(acquired.wait(0.05))
+
+        refunds.release()
+        thread.join()
+        self.assertTrue(acquired.is_set())
+
+    def test_metrics(self):
+        with bulkhead.slot('Pay'):
+            gauges = registry.snapshot()['gauges']
+            self.assertEqual(gauges[('paypaladaptive_bulkhead_in_flight',
+                                     (('bulkhead', 'Pay'),))], 1)
+            self.assertEqual(gauges[('paypaladaptive_bulkhead_limit',
+                                     (('bulkhead', 'Pay'),))], 2)
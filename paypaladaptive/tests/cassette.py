@@ -0,0 +1,120 @@
+import os
+import tempfile
+
+from django.test import TestCase
+
+from mock import patch
+from moneyed import Money
+
+from paypaladaptive import api, settings
+from paypaladaptive.api import CassetteError, Receiver, ReceiverList
+from paypaladaptive.api import cassette
+from paypaladaptive.api.cassette import Cassette, normalize, use_cassette
+from paypaladaptive.emulator import Emulator, serve
+from paypaladaptive.models import Payment
+
+from .emulator import ENDPOINTS
+
+
+URL = 'https://svcs.sandbox.paypal.com/AdaptivePayments/PaymentDetails'
+
+
+def no_network(*args, **kwargs):
+    raise AssertionError('Paypal was called')
+
+
+class TestCassette(TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.cassette')
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def test_record_and_replay(self):
+        server = serve(Emulator())
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        receivers = ReceiverList([
+            Receiver(amount=10, email='seller@example.com', primary=False)])
+        for endpoint in ENDPOINTS:
+            operation = endpoint.url.rsplit('/', 1)[1]
+            patcher = patch.object(
+                endpoint, 'url',
+                '%sAdaptivePayments/%s' % (server.url, operation))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        recorded = Payment.objects.create(money=Money(10, 'USD'))
+        with use_cassette(self.path, mode='record'):
+            recorded.process(receivers)
+            server.emulator.approve(recorded.pay_key)
+            recorded.update()
+        self.assertEqual(recorded.status, 'completed')
+
+        replayed = Payment.objects.create(money=Money(10, 'USD'))
+        with patch('paypaladaptive.api.httpwrapper.urlopen', no_network):
+            with use_cassette(self.path):
+                replayed.process(receivers)
+                replayed.update()
+
+        self.assertEqual(replayed.pay_key, recorded.pay_key)
+        self.assertEqual(replayed.status, 'completed')
+
+    def test_order(self):
+        recording = Cassette(self.path, mode='record')
+        recording.record(URL, '{"payKey": "AP-1"}', 200, 'first')
+        recording.record(URL, '{"payKey": "AP-1"}', 200, 'second')
+        recording.record(URL, '{"payKey": "AP-2"}', None, 'timed out')
+
+        replay = Cassette(self.path)
+        self.assertEqual([replay.play(URL, '{"payKey": "AP-1"}')
+                          for i in range(3)],
+                         [(200, 'first'), (200, 'second'), (200, 'second')])
+        self.assertEqual(replay.play(URL, '{"payKey": "AP-2"}'),
+                         (None, 'timed out'))
+
+        replay.rewind()
+        self.assertEqual(replay.play(URL, '{"payKey": "AP-1"}'),
+                         (200, 'first'))
+
+    def test_missing(self):
+        Cassette(self.path, mode='record')
+
+        with use_cassette(self.path):
+            self.assertRaises(CassetteError,
+                              api.PaymentDetails(payKey='AP-1').call)
+
+    def test_not_a_cassette(self):
+        with open(self.path, 'wb') as f:
+            f.write('{}')
+
+        self.assertRaises(CassetteError, Cassette, self.path)
+
+    def test_cut_short(self):
+        recording = Cassette(self.path, mode='record')
+        recording.record(URL, '', 200, 'complete')
+        recording.record(URL, '{"payKey": "AP-1"}', 200, 'cut short')
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 3)
+
+        replay = Cassette(self.path)
+        self.assertEqual(replay.play(URL, ''), (200, 'complete'))
+        self.assertRaises(CassetteError, replay.play, URL,
+                          '{"payKey": "AP-1"}')
+
+    def test_normalize(self):
+        self.assertEqual(
+            normalize('{"b": 1, "a": 2, "returnUrl": "http://a/1/"}'),
+            normalize('{"a": 2, "b": 1, "returnUrl": "http://a/2/"}'))
+        self.assertEqual(normalize('b=1&a=2'), 'a=2&b=1')
+        self.assertNotEqual(normalize('{"payKey": "AP-1"}'),
+                            normalize('{"payKey": "AP-2"}'))
+
+    def test_settings(self):
+        self.assertIsNone(cassette.get_cassette())
+
+        Cassette(self.path, mode='record')
+        with patch.object(settings, 'CASSETTE', self.path), \
+                patch.dict(cassette._cassettes, clear=True):
+            self.assertEqual(cassette.get_cassette().path, self.path)
+            self.assertIs(cassette.get_cassette(), cassette.get_cassette())
@@ -0,0 +1,74 @@
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from mock import patch
+
+from paypaladaptive import settings
+from paypaladaptive.changes import changes, iter_changes
+from paypaladaptive.models import StatusTransition
+
+from .factories import PaymentFactory, PreapprovalFactory
+
+
+@patch.object(settings, 'CHANGE_FEED_DELAY', 0)
+class TestChangeFeed(TestCase):
+    def setUp(self):
+        self.payment = PaymentFactory.create(status='created')
+        for status in ('returned', 'completed'):
+            self.payment.status = status
+            self.payment.save()
+
+        self.preapproval = PreapprovalFactory.create(status='created')
+        self.preapproval.status = 'approved'
+        self.preapproval.save()
+
+        # saving without a change of status is not logged
+        self.payment.save()
+
+    def test_changes(self):
+        log = changes()
+
+        self.assertEqual(
+            [(c.object_type, c.old_status, c.status) for c in log],
+            [('payment', 'created', 'returned'),
+             ('payment', 'returned', 'completed'),
+             ('preapproval', 'created', 'approved')])
+        self.assertEqual(changes(since=log[1].pk), log[2:])
+        self.assertEqual(changes(object_types=['preapproval']), log[2:])
+
+    def test_iter_changes(self):
+        # batches of one transition each
+        with self.assertNumQueries(4):
+            self.assertEqual(len(list(iter_changes(batch_size=1))), 3)
+
+    def test_delay(self):
+        with patch.object(settings, 'CHANGE_FEED_DELAY', 60):
+            self.assertEqual(changes(), [])
+
+    @patch.object(settings, 'CHANGE_FEED_TOKEN', 'secret')
+    def test_view(self):
+        url = reverse('paypal-adaptive-changes')
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        response = self.client.get(url, {'since': 0, 'limit': 2},
+                                   HTTP_AUTHORIZATION='Token secret')
+        body = json.loads(response.content)
+
+        self.assertEqual([c['status'] for c in body['changes']],
+                         ['returned', 'completed'])
+        self.assertEqual(body['cursor'], body['changes'][-1]['id'])
+
+        response = self.client.get(url, {'since': body['cursor']},
+                                   HTTP_AUTHORIZATION='Token secret')
+        body = json.loads(response.content)
+        self.assertEqual([c['object_id'] for c in body['changes']],
+                         [self.preapproval.pk])
+
+    def test_view_disabled(self):
+        url = reverse('paypal-adaptive-changes')
+        self.assertEqual(self.client.get(url).status_code, 404)
@@ -0,0 +1,163 @@
+import socket
+import urllib2
+
+import django.test as test
+from django.test import TestCase
+
+from mock import patch, Mock
+
+from paypaladaptive import settings
+from paypaladaptive.api import (CircuitOpenError, DeadlineExceeded,
+                                 circuitbreaker, deadline)
+from paypaladaptive.api.httpwrapper import UrlRequest
+
+from .factories import PaymentFactory
+from .ratelimit import FakeClock
+
+
+class TestCircuitBreaker(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = patch('paypaladaptive.api.circuitbreaker.time',
+                        self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = circuitbreaker.CircuitBreaker(
+            'test', failure_rate=0.5, min_calls=4, window=60,
+            reset_timeout=30, slow_call=5)
+
+    def call(self, success=True, duration=0.1):
+        self.breaker.before_call()
+        self.breaker.record(success, duration)
+
+    def test_opens_on_failures(self):
+        self.call()
+        self.call()
+        self.call(success=False)
+        self.assertEqual(self.breaker.state, circuitbreaker.STATE_CLOSED)
+
+        self.call(success=False)
+        self.assertEqual(self.breaker.state, circuitbreaker.STATE_OPEN)
+        self.assertFalse(self.breaker.available)
+
+        with self.assertRaises(CircuitOpenError) as context:
+            self.breaker.before_call()
+        self.assertEqual(context.exception.retry_after, 30)
+
+    def test_slow_calls_count_as_failures(self):
+        for __ in range(4):
+            self.call(duration=10)
+        self.assertEqual(self.breaker.state, circuitbreaker.STATE_OPEN)
+
+    def test_old_results_expire(self):
+        self.call(success=False)
+        self.call(success=False)
+        self.clock.sleep(61)
+        self.call()
+        self.call()
+        self.assertEqual(self.breaker.state, circuitbreaker.STATE_CLOSED)
+
+    def test_half_open_probe(self):
+        for __ in range(4):
+            self.call(success=False)
+
+        self.clock.sleep(30)
+        self.assertTrue(self.breaker.available)
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, circuitbreaker.STATE_HALF_OPEN)
+
+        # only one probe at a time
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+        self.breaker.record(False, 0.1)
+        self.assertEqual(self.breaker.state, circuitbreaker.STATE_OPEN)
+
+        self.clock.sleep(30)
+        self.call()
+        self.assertEqual(self.breaker.state, circuitbreaker.STATE_CLOSED)
+
+
+class TestUrlRequestBreaker(TestCase):
+    def setUp(self):
+        circuitbreaker.reset_all()
+        self.addCleanup(circuitbreaker.reset_all)
+        for name, value in (('CIRCUIT_BREAKER_ENABLED', True),
+                            ('CIRCUIT_BREAKER_MIN_CALLS', 2)):
+            patcher = patch.object(settings, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @patch('paypaladaptive.api.httpwrapper.urlopen',
+           Mock(side_effect=urllib2.URLError('timed out')))
+    def test_fails_fast(self):
+        url = '%sPaymentDetails' % settings.PAYPAL_ENDPOINT
+
+        self.assertEqual(UrlRequest().call(url).code, None)
+        self.assertEqual(UrlRequest().call(url).code, None)
+
+        self.assertFalse(circuitbreaker.is_available())
+        self.assertEqual(
+            circuitbreaker.get_states(),
+            {circuitbreaker.breaker_name(url): circuitbreaker.STATE_OPEN})
+
+        with self.assertRaises(CircuitOpenError):
+            UrlRequest().call(url)
+
+        # other hosts are not affected
+        verify_url = settings.PAYPAL_PAYMENT_HOST
+        self.assertTrue(circuitbreaker.is_available(verify_url))
+
+    def open_breaker(self, url):
+        breaker = circuitbreaker.get_breaker(url)
+        breaker.record(False, 0.1)
+        breaker.record(False, 0.1)
+        breaker.opened_at -= settings.CIRCUIT_BREAKER_RESET_TIMEOUT
+        return breaker
+
+    @patch('paypaladaptive.api.httpwrapper.urlopen',
+           Mock(side_effect=ValueError('unexpected')))
+    def test_probe_raises(self):
+        url = '%sPaymentDetails' % settings.PAYPAL_ENDPOINT
+        breaker = self.open_breaker(url)
+
+        self.assertRaises(ValueError, UrlRequest().call, url)
+
+        self.assertEqual(breaker.state, circuitbreaker.STATE_OPEN)
+        breaker.opened_at -= settings.CIRCUIT_BREAKER_RESET_TIMEOUT
+        self.assertTrue(breaker.available)
+
+    @patch('paypaladaptive.api.httpwrapper.urlopen',
+           Mock(side_effect=urllib2.URLError(socket.timeout('timed out'))))
+    def test_probe_cut_short_by_deadline(self):
+        url = '%sPaymentDetails' % settings.PAYPAL_ENDPOINT
+        breaker = self.open_breaker(url)
+
+        with deadline.within(0.5):
+            self.assertRaises(DeadlineExceeded, UrlRequest().call, url)
+
+        self.assertEqual(breaker.state, circuitbreaker.STATE_HALF_OPEN)
+        self.assertTrue(breaker.available)
+
+    def test_breaker_names(self):
+        self.assertEqual(
+            circuitbreaker.breaker_name(
+                'https://svcs.paypal.com/AdaptivePayments/Pay'),
+            'svcs.paypal.com/AdaptivePayments')
+        self.assertEqual(
+            circuitbreaker.breaker_name(
+                'https://www.paypal.com/webscr?cmd=_notify-validate'),
+            'www.paypal.com/webscr')
+
+    def test_ipn_verification_unavailable(self):
+        payment = PaymentFactory.create(status='created')
+        breaker = circuitbreaker.get_breaker(settings.PAYPAL_PAYMENT_HOST)
+        breaker.record(False, 0.1)
+        breaker.record(False, 0.1)
+
+        response = test.Client().post(
+            payment.ipn_url, data='status=COMPLETED',
+            content_type='application/x-www-form-urlencoded')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '30')
@@ -0,0 +1,122 @@
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+import socket
+import threading
+import time
+
+from django.test import TestCase
+
+from mock import patch
+
+from paypaladaptive import settings
+from paypaladaptive.api import DeadlineExceeded, deadline, singleflight
+from paypaladaptive.api.httpwrapper import UrlRequest
+from paypaladaptive.models import Payment
+
+from .factories import PaymentFactory
+
+
+class MockDetailsRequest(object):
+    status = 'COMPLETED'
+    delay = 0
+
+    def call(self, url, data=None, headers=None):
+        if self.delay:
+            time.sleep(self.delay)
+            deadline.check()
+        self._response = json.dumps({'responseEnvelope': {'ack': 'Success'},
+                                     'status': self.status})
+        return self
+
+    @property
+    def response(self):
+        return self._response
+
+    @property
+    def code(self):
+        return 200
+
+
+class TestDeadline(TestCase):
+    def test_within(self):
+        self.assertIsNone(deadline.remaining())
+        self.assertEqual(deadline.bound(5), 5)
+
+        with deadline.within(1):
+            self.assertTrue(0 < deadline.remaining() <= 1)
+            self.assertTrue(deadline.bound(5) <= 1)
+            self.assertEqual(deadline.bound(0.5), 0.5)
+
+            # nested deadlines can only be shorter
+            with deadline.within(10):
+                self.assertTrue(deadline.remaining() <= 1)
+
+        with deadline.within(0):
+            self.assertRaises(DeadlineExceeded, deadline.check)
+        self.assertIsNone(deadline.check())
+
+    def test_http_timeout(self):
+        with patch('paypaladaptive.api.httpwrapper.urlopen',
+                   side_effect=socket.timeout) as urlopen:
+            with deadline.within(0.5):
+                self.assertRaises(DeadlineExceeded, UrlRequest().call,
+                                  'https://svcs.example.com/Test')
+
+        self.assertTrue(0 < urlopen.call_args[1]['timeout'] <= 0.5)
+
+    def test_coalesced_call(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(1)
+
+        thread = threading.Thread(target=singleflight.do,
+                                  args=('deadline-test', slow))
+        thread.start()
+        started.wait(1)
+        try:
+            with deadline.within(0.05):
+                self.assertRaises(DeadlineExceeded, singleflight.do,
+                                  'deadline-test', slow)
+        finally:
+            release.set()
+            thread.join()
+
+
+@patch.object(settings, 'RETURN_UPDATE_DEADLINE', 0.2)
+@patch.object(settings, 'USE_DELAYED_UPDATES', True)
+@patch('paypaladaptive.tasks.update_payment.delay')
+@patch('paypaladaptive.api.endpoints.UrlRequest', MockDetailsRequest)
+class TestReturnUpdate(TestCase):
+    def setUp(self):
+        MockDetailsRequest.status = 'COMPLETED'
+        MockDetailsRequest.delay = 0
+        self.payment = PaymentFactory.create(status='created',
+                                             pay_key='AP-1')
+
+    def get_payment(self):
+        return Payment.objects.get(pk=self.payment.pk)
+
+    def test_completed(self, delay):
+        self.client.get(self.payment.return_url)
+
+        self.assertEqual(self.get_payment().status, 'completed')
+        self.assertFalse(delay.called)
+
+    def test_still_created(self, delay):
+        MockDetailsRequest.status = 'CREATED'
+        self.client.get(self.payment.return_url)
+
+        self.assertEqual(self.get_payment().status, 'returned')
+        self.assertTrue(delay.called)
+
+    def test_deadline_exceeded(self, delay):
+        MockDetailsRequest.delay = 0.3
+        self.client.get(self.payment.return_url)
+
+        self.assertEqual(self.get_payment().status, 'returned')
+        self.assertTrue(delay.called)
@@ -0,0 +1,127 @@
+import urlparse
+
+from django.test import Client, TestCase
+
+from mock import patch
+from moneyed import Money
+
+from paypaladaptive import api, settings
+from paypaladaptive.api import PayError, Receiver, ReceiverList
+from paypaladaptive.api.httpwrapper import UrlRequest
+from paypaladaptive.emulator import Emulator, serve
+from paypaladaptive.models import Payment, Preapproval
+
+
+ENDPOINTS = (api.Pay, api.PaymentDetails, api.Preapprove,
+             api.PreapprovalDetails, api.Refund, api.CancelPreapproval,
+             api.ConvertCurrency)
+
+
+def send_ipn(url, body):
+    """Deliver IPNs to the views of this test run"""
+    Client().post(urlparse.urlparse(url).path, body,
+                  content_type='application/x-www-form-urlencoded')
+
+
+class TestEmulator(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = serve(Emulator(ipn_sender=send_ipn))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.emulator = self.server.emulator
+        self.emulator.reset()
+
+        patches = [patch.object(settings, 'PAYPAL_PAYMENT_HOST',
+                                self.server.url + 'webscr')]
+        for endpoint in ENDPOINTS:
+            operation = endpoint.url.rsplit('/', 1)[1]
+            patches.append(patch.object(
+                endpoint, 'url',
+                '%sAdaptivePayments/%s' % (self.server.url, operation)))
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.receivers = ReceiverList([
+            Receiver(amount=10, email='seller@example.com', primary=False),
+            Receiver(amount=5, email='other@example.com', primary=False)])
+
+    def test_payment(self):
+        payment = Payment.objects.create(money=Money(15, 'USD'))
+
+        self.assertTrue(payment.process(self.receivers))
+        self.assertEqual(payment.status, 'created')
+
+        self.emulator.approve(payment.pay_key)
+        payment = Payment.objects.get(pk=payment.pk)
+        self.assertEqual(payment.status, 'completed')
+        self.assertEqual(payment.sender_email, 'buyer@example.com')
+
+        payment.update()
+        self.assertEqual(payment.status, 'completed')
+
+        refund = payment.refund()
+        self.assertEqual(refund.status, 'completed')
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status,
+                         'refunded')
+
+    def test_preapproval(self):
+        preapproval = Preapproval.objects.create(money=Money(20, 'USD'))
+        self.assertTrue(preapproval.process())
+
+        self.emulator.approve(preapproval.preapproval_key)
+        preapproval = Preapproval.objects.get(pk=preapproval.pk)
+        self.assertEqual(preapproval.status, 'approved')
+
+        payment = Payment.objects.create(money=Money(15, 'USD'))
+        self.assertTrue(payment.process(self.receivers,
+                                        preapproval=preapproval))
+        self.assertEqual(payment.status, 'completed')
+
+        preapproval.update()
+        self.assertEqual(preapproval.current_number_of_payments, 1)
+
+        # over the maximum total amount
+        payment = Payment.objects.create(money=Money(15, 'USD'))
+        self.assertRaises(PayError, payment.process, self.receivers,
+                          preapproval=preapproval)
+
+    def test_error_injection(self):
+        self.emulator.fail('Pay')
+        payment = Payment.objects.create(money=Money(15, 'USD'))
+
+        self.assertRaises(PayError, payment.process, self.receivers)
+        self.assertEqual(self.emulator.calls[0][0], 'Pay')
+
+    def test_convert_currency(self):
+        response = api.ConvertCurrency(api.MoneyList([Money(10, 'USD')]),
+                                       ['EUR']).call()
+
+        conversion = response['estimatedAmountTable'][
+            'currencyConversionList'][0]
+        self.assertEqual(conversion['currencyList']['currency'],
+                         [{'code': 'EUR', 'amount': '9.20'}])
+
+    def test_ipn_validation(self):
+        url = self.server.url + 'webscr?cmd=_notify-validate'
+
+        self.assertEqual(UrlRequest().call(url, data='forged=1').response,
+                         'INVALID')
+
+    def test_throttling(self):
+        self.emulator.max_rps = 1
+        url = self.server.url + 'AdaptivePayments/PaymentDetails'
+        try:
+            codes = [UrlRequest().call(url, data='{}').code
+                     for i in range(2)]
+        finally:
+            self.emulator.max_rps = None
+
+        # unless the second came in the next second
+        self.assertIn(codes, ([200, None], [200, 200]))
@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from paypaladaptive.expiry import sweep, expire_payments
+from paypaladaptive.metrics import registry
+from paypaladaptive.models import Payment, Preapproval, StatusTransition
+
+from .factories import PaymentFactory, PreapprovalFactory
+
+
+class TestExpiry(TestCase):
+    def setUp(self):
+        registry.reset()
+        now = timezone.now()
+
+        for status in ('new', 'created', 'created', 'completed'):
+            payment = PaymentFactory.create(status=status)
+            Payment.objects.filter(pk=payment.pk).update(
+                created_date=now - timedelta(hours=5))
+        PaymentFactory.create(status='created')
+
+        for status in ('created', 'approved', 'used', 'canceled'):
+            PreapprovalFactory.create(status=status,
+                                      valid_until_date=now - timedelta(1))
+        PreapprovalFactory.create(status='approved')
+
+    def statuses(self, model):
+        return sorted(model.objects.values_list('status', flat=True))
+
+    def test_sweep(self):
+        counts = sweep()
+
+        self.assertEqual(counts, {'payments': 2, 'preapprovals': 2})
+        self.assertEqual(self.statuses(Payment),
+                         ['completed', 'created', 'expired', 'expired',
+                          'new'])
+        self.assertEqual(self.statuses(Preapproval),
+                         ['approved', 'canceled', 'expired', 'expired',
+                          'used'])
+        self.assertEqual(
+            registry.counters[('paypaladaptive_expired_total',
+                               (('model', 'payments'),))], 2)
+
+        self.assertEqual(
+            StatusTransition.objects.filter(status='expired').count(), 4)
+
+        # nothing left to expire
+        self.assertEqual(sweep(), {'payments': 0, 'preapprovals': 0})
+
+    def test_batches(self):
+        # a select, an update and an insert of the transitions per full
+        # batch, then an empty select; the test's transaction adds a
+        # savepoint around each batch
+        with self.assertNumQueries(2 * 3 + 1 + 3 * 2):
+            self.assertEqual(expire_payments(batch_size=1), 2)
@@ -1,3 +1,5 @@
+import urllib
+
 import django.test as test
 
 from mock import patch
@@ -36,6 +38,8 @@ class MockIPNVerifyRequestInvalidCode(UrlRequest):
         return self
 
 @patch('paypaladaptive.api.ipn.endpoints.UrlRequest', MockIPNVerifyRequest)
-def mock_ipn_call(data, url):
+def mock_ipn_call(data, url, **kwargs):
     c = test.Client()
-    return c.post(url, data=data)
+    if kwargs.get('content_type') == 'application/x-www-form-urlencoded':
+        data = urllib.urlencode(data)
+    return c.post(url, data=data, **kwargs)
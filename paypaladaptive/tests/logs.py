@@ -0,0 +1,87 @@
+import logging
+
+from django.test import TestCase
+
+from mock import patch
+
+from paypaladaptive import logs
+from paypaladaptive.api import PaymentDetails
+from paypaladaptive.api import endpoints
+
+from .payment_update import MockUpdateRequest
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestLogs(TestCase):
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.logger = logging.getLogger('paypaladaptive.tests.logs')
+        self.logger.addHandler(self.handler)
+        self.logger.propagate = False
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(logging.NOTSET)
+
+    def test_redact(self):
+        data = {'X-PAYPAL-SECURITY-PASSWORD': 'secret',
+                'receiverList': {'receiver': [
+                    {'email': 'someone@example.com', 'amount': 10}]},
+                'memo': u'Thanks someone@example.com'}
+
+        self.assertEqual(logs.redact(data), {
+            'X-PAYPAL-SECURITY-PASSWORD': logs.REDACTED,
+            'receiverList': {'receiver': [
+                {'email': '***@example.com', 'amount': 10}]},
+            'memo': u'Thanks ***@example.com'})
+
+    def test_fields(self):
+        self.logger.setLevel(logging.DEBUG)
+        logs.log(self.logger, logging.DEBUG, 'Paypal call', endpoint='Pay',
+                 duration=0.25, ack=None, error='Bad thing',
+                 response=logs.redacted('{"email": "a@example.com"}'))
+
+        record = self.handler.records[0]
+        self.assertEqual(
+            record.getMessage(),
+            'Paypal call duration=0.250 endpoint=Pay error="Bad thing" '
+            'response="{\\"email\\": \\"***@example.com\\"}"')
+        self.assertEqual(record.fields['endpoint'], 'Pay')
+
+    def test_lazy(self):
+        self.logger.setLevel(logging.INFO)
+        calls = []
+        value = logs.lazy(calls.append, 1)
+
+        logs.log(self.logger, logging.DEBUG, 'Not logged', value=value)
+        self.assertEqual(calls, [])
+        logs.log(self.logger, logging.INFO, 'Logged', value=value)
+        self.handler.records[0].getMessage()
+        self.assertEqual(calls, [1])
+
+    @patch("paypaladaptive.api.endpoints.UrlRequest", MockUpdateRequest)
+    def test_endpoint(self):
+        MockUpdateRequest.set_response({'status': 'COMPLETED',
+                                        'senderEmail': 'a@example.com'})
+        handler = RecordingHandler()
+        endpoints.logger.addHandler(handler)
+        endpoints.logger.setLevel(logging.DEBUG)
+        try:
+            PaymentDetails(payKey='AP-1').call()
+        finally:
+            endpoints.logger.removeHandler(handler)
+            endpoints.logger.setLevel(logging.NOTSET)
+
+        call, payload = handler.records
+        self.assertEqual(call.fields['endpoint'], 'PaymentDetails')
+        self.assertEqual(call.fields['ack'], 'Success')
+        self.assertIn('***@example.com', payload.getMessage())
+        self.assertNotIn('a@example.com', payload.getMessage())
@@ -0,0 +1,114 @@
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from mock import patch
+
+from paypaladaptive import metrics, settings
+from paypaladaptive.api import PaymentDetails
+from paypaladaptive.metrics import registry
+
+from .payment_update import MockUpdateRequest
+
+
+received = []
+
+
+class RecordingSink(metrics.Sink):
+    def incr(self, name, value, labels):
+        received.append((name, value, labels))
+
+
+@patch("paypaladaptive.api.endpoints.UrlRequest", MockUpdateRequest)
+class TestEndpointMetrics(TestCase):
+    def setUp(self):
+        registry.reset()
+        MockUpdateRequest.set_response({'status': 'COMPLETED'})
+
+    def test_call(self):
+        for i in range(2):
+            PaymentDetails(payKey='AP-1').call()
+
+        snapshot = registry.snapshot()
+        labels = (('endpoint', 'PaymentDetails'),)
+        counts, total = snapshot['histograms'][
+            ('paypaladaptive_request_duration_seconds', labels)]
+        self.assertEqual(sum(counts), 2)
+        self.assertEqual(snapshot['counters'][
+            ('paypaladaptive_responses_total',
+             (('ack', 'Success'), ('endpoint', 'PaymentDetails')))], 2)
+        self.assertEqual(
+            snapshot['counters'][('paypaladaptive_response_bytes_total',
+                                  labels)],
+            2 * len(MockUpdateRequest._response))
+
+    def test_disabled(self):
+        with patch.object(settings, 'METRICS_ENABLED', False):
+            PaymentDetails(payKey='AP-1').call()
+
+        self.assertEqual(registry.snapshot()['counters'], {})
+
+    @patch.object(settings, 'METRICS_SINKS',
+                  ['paypaladaptive.tests.metrics.RecordingSink'])
+    def test_sink(self):
+        del received[:]
+        metrics.incr('paypaladaptive_test_total', 3, endpoint='Pay')
+
+        self.assertEqual(received, [('paypaladaptive_test_total', 3,
+                                     {'endpoint': 'Pay'})])
+
+
+class TestPrometheus(TestCase):
+    def setUp(self):
+        registry.reset()
+
+    def test_render(self):
+        metrics.incr('paypaladaptive_ipns_total', outcome='verified')
+        metrics.set_gauge('paypaladaptive_circuit_open', 0,
+                          breaker='svcs.paypal.com/AdaptivePayments')
+        metrics.observe('paypaladaptive_rate_limit_wait_seconds', 0.5,
+                        priority='default')
+        with patch.object(settings, 'METRICS_BUCKETS', (0.1, 1)):
+            metrics.histogram('paypaladaptive_request_duration_seconds',
+                              0.3, endpoint='Pay')
+            metrics.histogram('paypaladaptive_request_duration_seconds',
+                              2.0, endpoint='Pay')
+            text = metrics.render_prometheus()
+
+        self.assertEqual(text.splitlines(), [
+            '# TYPE paypaladaptive_ipns_total counter',
+            'paypaladaptive_ipns_total{outcome="verified"} 1',
+            '# TYPE paypaladaptive_circuit_open gauge',
+            'paypaladaptive_circuit_open'
+            '{breaker="svcs.paypal.com/AdaptivePayments"} 0',
+            '# TYPE paypaladaptive_rate_limit_wait_seconds summary',
+            'paypaladaptive_rate_limit_wait_seconds_count'
+            '{priority="default"} 1',
+            'paypaladaptive_rate_limit_wait_seconds_sum'
+            '{priority="default"} 0.5',
+            '# TYPE paypaladaptive_rate_limit_wait_seconds_max gauge',
+            'paypaladaptive_rate_limit_wait_seconds_max'
+            '{priority="default"} 0.5',
+            '# TYPE paypaladaptive_request_duration_seconds histogram',
+            'paypaladaptive_request_duration_seconds_bucket'
+            '{endpoint="Pay",le="0.1"} 0',
+            'paypaladaptive_request_duration_seconds_bucket'
+            '{endpoint="Pay",le="1"} 1',
+            'paypaladaptive_request_duration_seconds_bucket'
+            '{endpoint="Pay",le="+Inf"} 2',
+            'paypaladaptive_request_duration_seconds_count'
+            '{endpoint="Pay"} 2',
+            'paypaladaptive_request_duration_seconds_sum'
+            '{endpoint="Pay"} 2.3',
+        ])
+
+    def test_view(self):
+        url = reverse('paypal-adaptive-metrics')
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        metrics.incr('paypaladaptive_ipns_total', outcome='verified')
+        with patch.object(settings, 'METRICS_VIEW', True):
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('paypaladaptive_ipns_total{outcome="verified"} 1',
+                      response.content)
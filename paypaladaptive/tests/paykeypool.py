@@ -0,0 +1,111 @@
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from mock import patch
+from moneyed import Money
+
+from paypaladaptive import settings
+from paypaladaptive.models import Payment
+from paypaladaptive import paykeypool
+from paypaladaptive.paykeypool import claim, refill
+
+
+POOLS = {
+    'tier-25': {
+        'amount': '25.00',
+        'currency': 'USD',
+        'receivers': [{'email': 'campaign@example.com', 'amount': '25.00'}],
+        'size': 3,
+    },
+}
+
+
+class MockPayRequest(object):
+    calls = 0
+    ack = 'Success'
+
+    def call(self, url, data=None, headers=None):
+        MockPayRequest.calls += 1
+        response = {'responseEnvelope': {'ack': self.ack}}
+        if self.ack == 'Success':
+            response.update({'payKey': 'AP-%s' % MockPayRequest.calls,
+                             'paymentExecStatus': 'CREATED'})
+        else:
+            response['error'] = [{'message': 'Internal error'}]
+
+        self._response = json.dumps(response)
+        return self
+
+    @property
+    def response(self):
+        return self._response
+
+    @property
+    def code(self):
+        return 200
+
+
+@patch.object(settings, 'PAYKEY_POOLS', POOLS)
+@patch("paypaladaptive.api.endpoints.UrlRequest", MockPayRequest)
+class TestPaykeyPool(TestCase):
+    def setUp(self):
+        MockPayRequest.calls = 0
+        MockPayRequest.ack = 'Success'
+
+    def test_claim(self):
+        self.assertEqual(refill('tier-25'), {'retired': 0, 'created': 3})
+
+        with self.assertNumQueries(3):
+            payment = claim('tier-25')
+        self.assertEqual(payment.status, 'created')
+        self.assertEqual(payment.money, Money(25, 'USD'))
+        self.assertEqual(payment.pool, '')
+        self.assertEqual(payment.pay_key, 'AP-1')
+
+        # the claimed payment is replaced
+        self.assertEqual(refill('tier-25'), {'retired': 0, 'created': 1})
+        self.assertEqual(MockPayRequest.calls, 4)
+
+    def test_claim_retired(self):
+        refill('tier-25')
+        available = paykeypool._available
+        calls = []
+
+        def retire_first(name, now=None):
+            # the oldest payment is retired between the select and the claim
+            calls.append(name)
+            if len(calls) == 2:
+                Payment.objects.filter(pay_key='AP-1').update(
+                    status='expired')
+            return available(name, now)
+
+        with patch.object(paykeypool, '_available', retire_first):
+            payment = claim('tier-25')
+        self.assertEqual(payment.pay_key, 'AP-2')
+        self.assertEqual(Payment.objects.get(pay_key='AP-1').pool, 'tier-25')
+
+    def test_empty(self):
+        self.assertIsNone(claim('tier-25'))
+
+    def test_retire(self):
+        refill('tier-25')
+        Payment.objects.filter(pay_key='AP-1').update(
+            created_date=timezone.now() - timedelta(hours=2, minutes=1))
+
+        self.assertEqual(refill('tier-25'), {'retired': 1, 'created': 1})
+        self.assertEqual(Payment.objects.get(pay_key='AP-1').status,
+                         'expired')
+        self.assertNotEqual(claim('tier-25').pay_key, 'AP-1')
+
+    def test_failure(self):
+        MockPayRequest.ack = 'Failure'
+
+        self.assertEqual(refill('tier-25'), {'retired': 0, 'created': 0})
+        self.assertEqual(MockPayRequest.calls, 1)
+        self.assertEqual(Payment.objects.count(), 0)
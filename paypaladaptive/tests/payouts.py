@@ -0,0 +1,140 @@
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+import time
+from decimal import Decimal
+
+from django.test import TestCase
+
+from mock import patch
+from moneyed import Money
+
+from paypaladaptive.api import Receiver, ReceiverError
+from paypaladaptive.models import Payment
+from paypaladaptive.payouts import plan, create_payout, execute_payout
+
+
+class MockPayRequest(object):
+    calls = []
+    failing_batches = ()
+
+    def call(self, url, data=None, headers=None):
+        data = json.loads(data)
+        MockPayRequest.calls.append(data)
+        response = {'responseEnvelope': {'ack': 'Success'}}
+
+        batch = int(data['trackingId'].rsplit('-', 1)[1])
+        if batch in self.failing_batches:
+            response['responseEnvelope']['ack'] = 'Failure'
+            response['error'] = [{'message': 'Sender has no funds'}]
+        else:
+            response.update({'payKey': 'AP-%s' % batch,
+                             'paymentExecStatus': 'COMPLETED'})
+
+        self._response = json.dumps(response)
+        return self
+
+    @property
+    def response(self):
+        return self._response
+
+    @property
+    def code(self):
+        return 200
+
+
+def receivers(n, currency='USD', amount=10):
+    return [Receiver(email='seller%s@example.com' % i,
+                     amount=Money(amount, currency))
+            for i in range(n)]
+
+
+class TestPlan(TestCase):
+    def test_batches(self):
+        batches = plan(receivers(14))
+
+        self.assertEqual([len(b.receivers) for b in batches], [6, 6, 2])
+        self.assertEqual(batches[2].money, Money(20, 'USD'))
+        emails = [r.email for b in batches for r in b.receivers.receivers]
+        self.assertEqual(len(set(emails)), 14)
+
+    def test_currencies(self):
+        batches = plan(receivers(2, 'EUR') + receivers(7, 'USD') +
+                       [Receiver(email='plain@example.com', amount=5)],
+                       currency='EUR')
+
+        self.assertEqual([(b.currency, len(b.receivers)) for b in batches],
+                         [('EUR', 3), ('USD', 6), ('USD', 1)])
+        self.assertEqual(batches[0].money, Money(25, 'EUR'))
+
+    def test_chained(self):
+        primary = Receiver(email='platform@example.com',
+                           amount=Money(150, 'USD'), primary=True)
+        batches = plan([primary] + receivers(12))
+
+        self.assertEqual([len(b.receivers) for b in batches], [6, 6, 3])
+        for batch in batches:
+            self.assertTrue(batch.receivers.chained)
+        # the primary keeps 30 for itself, paid with the first batch
+        self.assertEqual([b.money.amount for b in batches],
+                         [Decimal(80), Decimal(50), Decimal(20)])
+
+    def test_chained_errors(self):
+        primary = Receiver(email='platform@example.com',
+                           amount=Money(50, 'USD'), primary=True)
+
+        self.assertRaises(ReceiverError, plan, [primary] + receivers(6))
+        self.assertRaises(ReceiverError, plan, [primary, primary])
+        self.assertRaises(ReceiverError, plan,
+                          [primary] + receivers(1, 'EUR'))
+
+    def test_large_plan(self):
+        start = time.time()
+        batches = plan(receivers(10000))
+
+        self.assertEqual(len(batches), 1667)
+        self.assertTrue(time.time() - start < 1)
+
+
+@patch("paypaladaptive.api.endpoints.UrlRequest", MockPayRequest)
+class TestPayout(TestCase):
+    def setUp(self):
+        MockPayRequest.calls = []
+        MockPayRequest.failing_batches = ()
+
+    def test_create(self):
+        payout = create_payout(receivers(8))
+
+        payments = payout.payments.order_by('payout_batch')
+        self.assertEqual([(p.payout_batch, p.money) for p in payments],
+                         [(0, Money(60, 'USD')), (1, Money(20, 'USD'))])
+        self.assertEqual(len(payout.get_plan()[1]['receivers']), 2)
+        self.assertEqual(payout.status, 'new')
+
+    def test_execute(self):
+        payout = create_payout(receivers(13))
+
+        self.assertEqual(execute_payout(payout), 'completed')
+        self.assertEqual(len(MockPayRequest.calls), 3)
+        self.assertEqual(
+            sorted(c['trackingId'] for c in MockPayRequest.calls),
+            ['payout-%s-%s' % (payout.pk, i) for i in range(3)])
+        self.assertEqual(
+            [len(c['receiverList']['receiver'])
+             for c in sorted(MockPayRequest.calls,
+                             key=lambda c: c['trackingId'])],
+            [6, 6, 1])
+
+    def test_partial(self):
+        MockPayRequest.failing_batches = (1,)
+        payout = create_payout(receivers(8))
+
+        self.assertEqual(execute_payout(payout), 'partial')
+        failed = Payment.objects.get(payout=payout, payout_batch=1)
+        self.assertEqual(failed.status, 'error')
+
+        # already processed payments are not sent again
+        MockPayRequest.calls = []
+        execute_payout(payout)
+        self.assertEqual(MockPayRequest.calls, [])
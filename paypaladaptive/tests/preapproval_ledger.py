@@ -0,0 +1,105 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.test import TestCase
+from django.utils import timezone
+
+from mock import patch
+from moneyed import Money
+
+from paypaladaptive.api import Receiver, ReceiverList
+from paypaladaptive.models import Payment, Preapproval
+
+from .factories import PreapprovalFactory
+from .helpers import mock_ipn_call
+from .preapproval_update import MockUpdateRequest
+from .settlement import MockPaypal
+
+
+class TestPreapprovalLedger(TestCase):
+    def setUp(self):
+        self.preapproval = PreapprovalFactory.create(
+            status='approved', preapproval_key='PA-1',
+            ledger_updated_date=timezone.now())
+
+    def get_preapproval(self):
+        return Preapproval.objects.get(pk=self.preapproval.pk)
+
+    @patch("paypaladaptive.api.endpoints.UrlRequest", MockPaypal)
+    def test_record_payment(self):
+        self.preapproval.max_number_of_payments = 2
+        self.preapproval.save()
+
+        for i in range(2):
+            payment = Payment(money=Money(400, 'SEK'))
+            payment.save()
+            payment.process(ReceiverList([Receiver(
+                amount=400, email='campaign@example.com')]),
+                preapproval=self.preapproval)
+
+        preapproval = self.get_preapproval()
+        self.assertEqual(preapproval.current_number_of_payments, 2)
+        self.assertEqual(preapproval.current_total_amount, Decimal(800))
+        self.assertEqual(preapproval.status, 'used')
+
+    def test_can_charge(self):
+        with self.assertNumQueries(0):
+            self.assertTrue(self.preapproval.can_charge(Money(1400, 'SEK')))
+            self.assertFalse(self.preapproval.can_charge(Money(1401, 'SEK')))
+            self.assertFalse(self.preapproval.can_charge(Money(10, 'USD')))
+
+        self.preapproval.current_total_amount = Decimal(1000)
+        self.assertFalse(self.preapproval.can_charge(Money(500, 'SEK')))
+
+        self.preapproval.max_number_of_payments = 1
+        self.preapproval.current_number_of_payments = 1
+        self.assertFalse(self.preapproval.can_charge(Money(1, 'SEK')))
+
+    def test_can_charge_per_period(self):
+        self.preapproval.max_number_of_payments_per_period = 2
+        self.preapproval.current_period_attempts = 1
+        self.assertTrue(self.preapproval.can_charge(Money(1, 'SEK')))
+
+        self.preapproval.current_period_attempts = 2
+        self.assertFalse(self.preapproval.can_charge(Money(1, 'SEK')))
+
+    @patch("paypaladaptive.api.endpoints.UrlRequest", MockUpdateRequest)
+    def test_stale_ledger(self):
+        self.preapproval.ledger_updated_date = (
+            timezone.now() - timedelta(hours=2))
+        MockUpdateRequest.set_response({
+            'status': 'ACTIVE', 'approved': 'true', 'curPayments': '1',
+            'curPaymentsAmount': '1000.00', 'curPeriodAttempts': '1',
+            'maxNumberOfPayments': '3', 'maxNumberOfPaymentsPerPeriod': '1'})
+
+        self.assertFalse(self.preapproval.can_charge(Money(500, 'SEK')))
+
+        preapproval = self.get_preapproval()
+        self.assertFalse(preapproval.ledger_is_stale)
+        self.assertEqual(preapproval.current_number_of_payments, 1)
+        self.assertEqual(preapproval.current_total_amount, Decimal(1000))
+        self.assertEqual(preapproval.max_number_of_payments, 3)
+        self.assertEqual(preapproval.max_number_of_payments_per_period, 1)
+
+    def test_ipn(self):
+        data = {'status': 'ACTIVE',
+                'approved': 'true',
+                'preapproval_key': 'PA-1',
+                'transaction_type': 'Adaptive Payment PREAPPROVAL',
+                'currency_code': 'SEK',
+                'max_total_amount_of_all_payments': '1400.00',
+                'max_number_of_payments': '5',
+                'current_number_of_payments': '2',
+                'current_total_amount_of_all_payments': 'SEK 600.00',
+                'current_period_attempts': '1'}
+        response = mock_ipn_call(data, self.preapproval.ipn_url,
+                                 content_type='application/'
+                                              'x-www-form-urlencoded')
+        self.assertEqual(response.status_code, 204)
+
+        preapproval = self.get_preapproval()
+        self.assertEqual(preapproval.current_number_of_payments, 2)
+        self.assertEqual(preapproval.current_total_amount, Decimal(600))
+        self.assertEqual(preapproval.max_number_of_payments, 5)
+        self.assertTrue(preapproval.can_charge(Money(800, 'SEK'),
+                                               refresh=False))
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from mock import patch
+from moneyed import Money
+
+from paypaladaptive import profiling, settings
+from paypaladaptive.api.datatypes import Receiver, ReceiverList
+
+from .factories import PaymentFactory
+from .payment_response import MockPaymentRequest
+
+
+@profiling.profiled('outer')
+def outer():
+    return inner()
+
+
+@profiling.profiled('inner')
+def inner():
+    return sum(range(10))
+
+
+def calls(stats, module, function_name):
+    return sum(stat[1] for (path, __, name), stat in stats.stats.items()
+               if name == function_name and
+               os.path.splitext(path)[0].endswith(module))
+
+
+class TestProfiling(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        profiling.reset()
+        self.addCleanup(profiling.reset)
+
+        for name, value in (('PROFILE_DIR', self.directory),
+                            ('PROFILE_SAMPLE_RATE', 1)):
+            patcher = patch.object(settings, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_disabled(self):
+        with patch.object(settings, 'PROFILE_DIR', None):
+            self.assertEqual(outer(), 45)
+
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_sample_rate(self):
+        with patch.object(settings, 'PROFILE_SAMPLE_RATE', 0):
+            outer()
+
+        self.assertIsNone(profiling.load('outer'))
+
+    def test_aggregated(self):
+        self.assertEqual(outer(), 45)
+        outer()
+
+        self.assertEqual(os.listdir(self.directory),
+                         ['outer.%s.prof' % os.getpid()])
+        stats = profiling.load('outer')
+        self.assertEqual(calls(stats, 'tests/profiling', 'inner'), 2)
+
+    def test_nested(self):
+        outer()
+
+        self.assertIsNone(profiling.load('inner'))
+
+    @patch('paypaladaptive.api.endpoints.UrlRequest', MockPaymentRequest)
+    def test_payment_process(self):
+        MockPaymentRequest._response = (
+            u'{"responseEnvelope":{"ack":"Success"},'
+            u'"payKey":"AP-1","paymentExecStatus":"CREATED"}')
+        payment = PaymentFactory.create(money=Money(100, 'USD'))
+        receivers = ReceiverList([Receiver(amount=100, email='a@example.com',
+                                           primary=True)])
+
+        self.assertTrue(payment.process(receivers))
+
+        stats = profiling.load('Payment.process')
+        self.assertEqual(calls(stats, 'paypaladaptive/models', 'process'), 1)
@@ -0,0 +1,74 @@
+from django.test import TestCase
+
+from mock import patch
+
+from paypaladaptive import settings
+from paypaladaptive.api import ratelimit, RateLimitExceeded
+from paypaladaptive.helpers import get_cache
+from paypaladaptive.metrics import registry
+
+
+class FakeClock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestRateLimiter(TestCase):
+    def setUp(self):
+        get_cache(settings.RATE_LIMIT_CACHE_ALIAS).clear()
+        registry.reset()
+        self.clock = FakeClock()
+        patcher = patch('paypaladaptive.api.ratelimit.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.limiter = ratelimit.RateLimiter('test', rate=4, burst=4)
+
+    def test_priority_shares(self):
+        background = ratelimit.PRIORITY_BACKGROUND
+        interactive = ratelimit.PRIORITY_INTERACTIVE
+
+        self.limiter.acquire(background, max_wait=0)
+        self.limiter.acquire(background, max_wait=0)
+        with self.assertRaises(RateLimitExceeded):
+            self.limiter.acquire(background, max_wait=0)
+
+        # interactive calls can still use the rest of the bucket
+        self.limiter.acquire(interactive, max_wait=0)
+        self.limiter.acquire(interactive, max_wait=0)
+        with self.assertRaises(RateLimitExceeded):
+            self.limiter.acquire(interactive, max_wait=0)
+
+    def test_waits_for_refill(self):
+        for __ in range(4):
+            self.assertEqual(
+                self.limiter.acquire(ratelimit.PRIORITY_INTERACTIVE), 0)
+
+        waited = self.limiter.acquire(ratelimit.PRIORITY_INTERACTIVE,
+                                      max_wait=5)
+        self.assertEqual(waited, 1.0)
+
+        summaries = registry.snapshot()['summaries']
+        key = ('paypaladaptive_rate_limit_wait_seconds',
+               (('priority', 'interactive'),))
+        self.assertEqual(summaries[key], (5, 1.0, 1.0))
+
+    def test_priority_context(self):
+        self.assertEqual(ratelimit.get_priority(), 'default')
+        self.assertEqual(ratelimit.get_priority('interactive'),
+                         'interactive')
+
+        with ratelimit.priority(ratelimit.PRIORITY_BACKGROUND):
+            self.assertEqual(ratelimit.get_priority('interactive'),
+                             'background')
+
+        self.assertEqual(ratelimit.get_priority(), 'default')
+
+    def test_disabled(self):
+        with patch.object(settings, 'RATE_LIMIT', None):
+            self.assertIsNone(ratelimit.get_limiter())
@@ -0,0 +1,216 @@
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+
+from django.test import TestCase
+
+from mock import patch
+from moneyed import Money
+
+from paypaladaptive.api import Receiver, ReceiverList, RefundError
+from paypaladaptive import statuscache
+from paypaladaptive.models import Payment, Refund, StatusTransition
+from paypaladaptive.refunds import refund_payments
+
+from .factories import PaymentFactory
+
+
+class MockRefundRequest(object):
+    calls = []
+    refund_status = 'REFUNDED'
+    sender_status = 'COMPLETED'
+    refunded_amount = None
+
+    def call(self, url, data=None, headers=None):
+        data = json.loads(data)
+        operation = url.rsplit('/', 1)[1]
+        MockRefundRequest.calls.append((operation, data))
+        response = {'responseEnvelope': {'ack': 'Success'}}
+
+        if operation == 'Refund':
+            receivers = data.get('receiverList', {}).get(
+                'receiver', [{'email': 'seller@example.com'}])
+            if self.refund_status is None:
+                response['responseEnvelope']['ack'] = 'Failure'
+                response['error'] = [{'message': 'Refund not allowed'}]
+            response['refundInfoList'] = {'refundInfo': [
+                {'receiver': {'email': r['email']},
+                 'refundStatus': self.refund_status,
+                 'refundHasBecomeFull': 'false'}
+                for r in receivers]}
+        elif operation == 'PaymentDetails':
+            info = {'receiver': {'email': 'seller@example.com'},
+                    'senderTransactionStatus': self.sender_status}
+            if self.refunded_amount is not None:
+                info['refundedAmount'] = self.refunded_amount
+            response.update({'status': 'COMPLETED', 'paymentInfoList': {
+                'paymentInfo': [info]}})
+
+        self._response = json.dumps(response)
+        return self
+
+    @property
+    def response(self):
+        return self._response
+
+    @property
+    def code(self):
+        return 200
+
+
+@patch("paypaladaptive.api.endpoints.UrlRequest", MockRefundRequest)
+class TestRefund(TestCase):
+    def setUp(self):
+        MockRefundRequest.calls = []
+        MockRefundRequest.refund_status = 'REFUNDED'
+        MockRefundRequest.sender_status = 'COMPLETED'
+        MockRefundRequest.refunded_amount = None
+        self.payment = PaymentFactory.create(status='completed',
+                                             pay_key='AP-1')
+
+    def get_payment(self, payment=None):
+        return Payment.objects.get(pk=(payment or self.payment).pk)
+
+    def test_full_refund(self):
+        refund = self.payment.refund()
+
+        self.assertEqual(refund.status, 'completed')
+        self.assertTrue(refund.is_full)
+        self.assertEqual(refund.money, self.payment.money)
+        self.assertEqual(self.get_payment().status, 'refunded')
+        self.assertEqual(MockRefundRequest.calls,
+                         [('Refund', {'payKey': 'AP-1', 'requestEnvelope':
+                                      {'errorLanguage': 'en_US'}})])
+
+        with self.assertRaises(ValueError):
+            refund.process()
+
+    def test_partial_refund(self):
+        receivers = ReceiverList([Receiver(email='seller@example.com',
+                                           amount=100)])
+        refund = self.payment.refund(receivers=receivers)
+
+        self.assertEqual(refund.status, 'completed')
+        self.assertFalse(refund.is_full)
+        self.assertEqual(refund.money, Money(100, 'SEK'))
+        self.assertEqual(self.get_payment().status, 'completed')
+
+        __, data = MockRefundRequest.calls[0]
+        self.assertEqual(data['currencyCode'], 'SEK')
+        self.assertEqual(data['receiverList']['receiver'],
+                         [{'email': 'seller@example.com', 'amount': 100,
+                           'primary': False}])
+
+    def test_pending_refund(self):
+        MockRefundRequest.refund_status = 'REFUNDED_PENDING'
+        refund = self.payment.refund()
+
+        self.assertEqual(refund.status, 'pending')
+        self.assertEqual(self.get_payment().status, 'refunded')
+
+    def test_failed_refund(self):
+        MockRefundRequest.refund_status = None
+
+        with self.assertRaises(RefundError):
+            self.payment.refund()
+
+        refund = Refund.objects.get(payment=self.payment)
+        self.assertEqual(refund.status, 'error')
+        self.assertEqual(refund.status_detail, 'Refund not allowed')
+
+    def test_refund_incomplete_payment(self):
+        self.payment.status = 'created'
+
+        with self.assertRaises(ValueError):
+            self.payment.refund()
+
+    def test_bulk_refund(self):
+        payments = [self.payment] + [
+            PaymentFactory.create(status='completed', pay_key='AP-%s' % i)
+            for i in range(2, 5)]
+        PaymentFactory.create(status='created', pay_key='AP-CREATED')
+
+        result = refund_payments(Payment.objects.all())
+
+        self.assertEqual(len(MockRefundRequest.calls), 4)
+        self.assertEqual(result['counts']['completed'], 4)
+        self.assertEqual(result['refunded'], [Money(5600, 'SEK')])
+        for payment in payments:
+            self.assertEqual(self.get_payment(payment).status, 'refunded')
+        self.assertEqual(
+            StatusTransition.objects.filter(object_type='payment',
+                                            status='refunded').count(), 4)
+        self.assertEqual(
+            statuscache.get_statuses(Payment, [self.payment.pk]),
+            {self.payment.pk: ('refunded', self.payment.secret_uuid)})
+
+        # running again doesn't refund anything twice
+        MockRefundRequest.calls = []
+        result = refund_payments(Payment.objects.all())
+
+        self.assertEqual(MockRefundRequest.calls, [])
+        self.assertEqual(result['refunds'], 4)
+
+    def test_bulk_recover(self):
+        refund = Refund.objects.create(payment=self.payment,
+                                       money=self.payment.money,
+                                       status='processing')
+
+        # Paypal has not refunded anything, so the refund is sent again
+        refund_payments(Payment.objects.all())
+        self.assertEqual([op for op, __ in MockRefundRequest.calls],
+                         ['PaymentDetails', 'Refund'])
+        self.assertEqual(Refund.objects.get(pk=refund.pk).status,
+                         'completed')
+
+    def test_bulk_recover_refunded(self):
+        MockRefundRequest.sender_status = 'REFUNDED'
+        refund = Refund.objects.create(payment=self.payment,
+                                       money=self.payment.money,
+                                       status='processing')
+
+        refund_payments(Payment.objects.all())
+
+        self.assertEqual([op for op, __ in MockRefundRequest.calls],
+                         ['PaymentDetails'])
+        self.assertEqual(Refund.objects.get(pk=refund.pk).status,
+                         'completed')
+        self.assertEqual(self.get_payment().status, 'refunded')
+
+    def test_bulk_recover_partially_refunded(self):
+        MockRefundRequest.sender_status = 'PARTIALLY_REFUNDED'
+        MockRefundRequest.refunded_amount = '100.00'
+        refund = Refund(payment=self.payment, status='processing')
+        refund.set_receivers(ReceiverList([
+            Receiver(amount=100, email='seller@example.com')]))
+        refund.save()
+
+        refund_payments(Payment.objects.all())
+
+        self.assertEqual([op for op, __ in MockRefundRequest.calls],
+                         ['PaymentDetails'])
+        refund = Refund.objects.get(pk=refund.pk)
+        self.assertEqual(refund.status, 'completed')
+        self.assertFalse(refund.is_full)
+        self.assertEqual(self.get_payment().status, 'completed')
+
+    def test_bulk_recover_after_partial_refund(self):
+        # Paypal only shows the amount of the earlier refund
+        MockRefundRequest.sender_status = 'PARTIALLY_REFUNDED'
+        MockRefundRequest.refunded_amount = '50.00'
+        earlier = Refund(payment=self.payment, status='completed')
+        earlier.set_receivers(ReceiverList([
+            Receiver(amount=50, email='seller@example.com')]))
+        earlier.save()
+        refund = Refund(payment=self.payment, status='processing')
+        refund.set_receivers(ReceiverList([
+            Receiver(amount=25, email='seller@example.com')]))
+        refund.save()
+
+        refund_payments(Payment.objects.all())
+
+        self.assertEqual([op for op, __ in MockRefundRequest.calls],
+                         ['PaymentDetails', 'Refund'])
+        self.assertEqual(Refund.objects.get(pk=refund.pk).status,
+                         'completed')
@@ -0,0 +1,131 @@
+import urlparse
+from StringIO import StringIO
+
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from mock import patch
+from moneyed import Money
+
+from paypaladaptive import settings
+from paypaladaptive.api.ipn import endpoints, unverified
+from paypaladaptive.metrics import registry
+from paypaladaptive.models import IPNLog, Payment
+from paypaladaptive.replay import replay, report
+
+from .factories import PaymentFactory
+
+
+class FailingVerifyRequest(object):
+    def call(self, url, data=None, headers=None):
+        raise AssertionError('IPN was verified with Paypal')
+
+
+@patch('paypaladaptive.api.ipn.endpoints.UrlRequest', FailingVerifyRequest)
+class TestReplay(TestCase):
+    def setUp(self):
+        self.payment = PaymentFactory.create(status='created',
+                                             money=Money(10, 'USD'))
+        self.path = urlparse.urlparse(self.payment.ipn_url).path
+
+    def log(self, path=None, status_code=None, verified='VERIFIED',
+            **data):
+        post = {'status': 'COMPLETED',
+                'transaction_type': 'Adaptive Payment PAY',
+                'transaction[0].id': '1',
+                'transaction[0].amount': 'USD 10.00',
+                'transaction[0].status': 'COMPLETED'}
+        post.update(data)
+        return IPNLog.objects.create(path=path or self.path,
+                                     post=json.dumps(post),
+                                     verify_request_response=verified,
+                                     return_status_code=status_code)
+
+    def test_replay(self):
+        ipn_log = self.log()
+
+        results = replay(IPNLog.objects.all())
+
+        self.assertEqual([result[:3] for result in results],
+                         [(ipn_log.pk, None, 204)])
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status,
+                         'completed')
+
+    def test_report(self):
+        unchanged = self.log(status_code=204)
+        missing = self.log(path='/ipn/999/nope/', status_code=400)
+
+        summary = report(replay(IPNLog.objects.all(), rate=1000))
+
+        self.assertEqual(summary['replayed'], 2)
+        self.assertEqual(summary['counts'], {204: 1, 404: 1})
+        self.assertEqual(summary['changed'], [(missing.pk, 400, 404)])
+        self.assertTrue(0 <= summary['latency']['p50'] <=
+                        summary['latency']['max'])
+        self.assertNotIn(unchanged.pk,
+                         [pk for pk, __, __ in summary['changed']])
+
+    def test_not_logged_again(self):
+        ipn_log = self.log()
+
+        with patch.object(settings, 'IPN_LOG_ENABLED', True):
+            replay(IPNLog.objects.all())
+
+        self.assertEqual(list(IPNLog.objects.all()), [ipn_log])
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status,
+                         'completed')
+
+    @patch.object(settings, 'METRICS_ENABLED', True)
+    def test_counted_as_replayed(self):
+        registry.reset()
+        self.log()
+
+        replay(IPNLog.objects.all())
+
+        counters = registry.snapshot()['counters']
+        self.assertEqual(counters[('paypaladaptive_ipns_total',
+                                   (('outcome', 'replayed'),))], 1)
+        self.assertNotIn(('paypaladaptive_ipns_total',
+                          (('outcome', 'verified'),)), counters)
+
+    def test_nested_unverified(self):
+        with unverified():
+            with unverified():
+                pass
+            self.assertTrue(endpoints._local.unverified)
+        self.assertFalse(endpoints._local.unverified)
+
+    def test_invalid_refused(self):
+        self.log(verified='INVALID')
+        self.log(verified='')
+
+        self.assertEqual(replay(IPNLog.objects.all()), [])
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status,
+                         'created')
+
+    def test_verified_outside_replay(self):
+        self.assertRaises(
+            AssertionError, self.client.post, self.path, 'status=COMPLETED',
+            content_type='application/x-www-form-urlencoded')
+
+    def test_command(self):
+        self.log(status_code=204)
+        answered = self.log(path='/ipn/999/nope/', status_code=204)
+        self.log(path='/ipn/999/nope/')
+        self.log(path='/ipn/999/nope/', status_code=204, verified='INVALID')
+        out = StringIO()
+
+        call_command('replay_ipns', path='/ipn/999/', status='204',
+                     stdout=out)
+
+        output = out.getvalue()
+        self.assertIn("Skipped 1 IPNs Paypal didn't verify", output)
+        self.assertIn('Replayed 1 IPNs', output)
+        self.assertIn('IPNLog %s: 204 -> 404' % answered.pk, output)
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status,
+                         'created')
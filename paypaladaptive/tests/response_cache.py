@@ -0,0 +1,118 @@
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+
+from django.test import TestCase
+
+from mock import patch
+
+from paypaladaptive.api import PaymentDetails, Pay, cache
+from paypaladaptive.helpers import get_cache
+from paypaladaptive import settings
+from paypaladaptive.views import update_on_return
+
+from .factories import PaymentFactory
+from .helpers import mock_ipn_call
+
+
+class MockCountingRequest(object):
+    calls = 0
+    status = 'COMPLETED'
+
+    def call(self, *args, **kwargs):
+        MockCountingRequest.calls += 1
+        return self
+
+    @property
+    def response(self):
+        return json.dumps({'responseEnvelope': {'ack': 'Success'},
+                           'status': MockCountingRequest.status})
+
+    @property
+    def code(self):
+        return 200
+
+
+@patch("paypaladaptive.api.endpoints.UrlRequest", MockCountingRequest)
+@patch.object(settings, 'RESPONSE_CACHE_ENABLED', True)
+class TestResponseCache(TestCase):
+    def setUp(self):
+        get_cache(settings.RESPONSE_CACHE_ALIAS).clear()
+        MockCountingRequest.calls = 0
+        MockCountingRequest.status = 'COMPLETED'
+        self.payment = PaymentFactory.create(
+            status='created', pay_key='AP-9HW83863H61516232')
+
+    def test_cached_call(self):
+        first = PaymentDetails(payKey=self.payment.pay_key).call()
+        second = PaymentDetails(payKey=self.payment.pay_key).call()
+
+        self.assertEqual(first, second)
+        self.assertEqual(MockCountingRequest.calls, 1)
+
+        PaymentDetails(payKey='AP-OTHER').call()
+        self.assertEqual(MockCountingRequest.calls, 2)
+
+    def test_timeout_override(self):
+        with patch.object(settings, 'RESPONSE_CACHE_TIMEOUTS',
+                          {'PaymentDetails': None}):
+            PaymentDetails(payKey=self.payment.pay_key).call()
+            PaymentDetails(payKey=self.payment.pay_key).call()
+
+        self.assertEqual(MockCountingRequest.calls, 2)
+
+    def test_uncached_endpoint(self):
+        self.assertIsNone(Pay.cache_timeout)
+
+    def test_invalidate(self):
+        self.payment.update()
+        self.payment.invalidate_update_cache()
+        self.payment.update()
+
+        self.assertEqual(MockCountingRequest.calls, 2)
+
+    def test_ipn_invalidates(self):
+        self.payment.update()
+        MockCountingRequest.status = 'CREATED'
+        self.payment.update()
+        self.assertEqual(self.payment.status, 'completed')
+
+        money = "%s %s" % (self.payment.money.currency,
+                           self.payment.money.amount)
+        data = {'status': 'COMPLETED',
+                'transaction_type': 'Adaptive Payment PAY',
+                'pay_key': self.payment.pay_key,
+                'transaction[0].id': '1',
+                'transaction[0].amount': money,
+                'transaction[0].status': 'COMPLETED'}
+        response = mock_ipn_call(data, self.payment.ipn_url,
+                                 content_type='application/'
+                                              'x-www-form-urlencoded')
+        self.assertEqual(response.status_code, 204)
+
+        self.payment.update()
+        self.assertEqual(self.payment.status, 'created')
+        self.assertEqual(MockCountingRequest.calls, 2)
+
+    def test_fresh(self):
+        self.payment.update()
+        MockCountingRequest.status = 'CREATED'
+
+        with cache.fresh():
+            self.payment.update()
+        self.assertEqual(self.payment.status, 'created')
+
+        self.payment.update()
+        self.assertEqual(self.payment.status, 'created')
+        self.assertEqual(MockCountingRequest.calls, 2)
+
+    def test_return_is_fresh(self):
+        MockCountingRequest.status = 'CREATED'
+        self.payment.update()
+        MockCountingRequest.status = 'COMPLETED'
+
+        with patch.object(settings, 'RETURN_UPDATE_DEADLINE', 5):
+            self.assertTrue(update_on_return(self.payment))
+        self.assertEqual(self.payment.status, 'completed')
+        self.assertEqual(MockCountingRequest.calls, 2)
@@ -0,0 +1,174 @@
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+
+from django.test import TestCase
+
+from mock import patch
+from moneyed import Money
+
+from paypaladaptive import statuscache
+from paypaladaptive.api import Receiver, ReceiverList
+from paypaladaptive.models import (Payment, Preapproval, Settlement,
+                                   SettlementItem, StatusTransition)
+from paypaladaptive.settlement import settle, run, report
+
+from .factories import PreapprovalFactory
+
+
+class MockPaypal(object):
+    """Answers Pay, PaymentDetails and CancelPreapproval calls"""
+    calls = []
+    failing_keys = ()
+    known_tracking_ids = {}
+    details_error_id = '580022'
+
+    def call(self, url, data=None, headers=None):
+        data = json.loads(data)
+        operation = url.rsplit('/', 1)[1]
+        MockPaypal.calls.append((operation, data))
+        response = {'responseEnvelope': {'ack': 'Success'}}
+
+        if operation == 'Pay':
+            if data['preapprovalKey'] in self.failing_keys:
+                response['responseEnvelope']['ack'] = 'Failure'
+                response['error'] = [{'message': 'Preapproval invalid'}]
+            else:
+                response.update({'payKey': 'AP-%s' % data['preapprovalKey'],
+                                 'paymentExecStatus': 'COMPLETED'})
+        elif operation == 'PaymentDetails':
+            status = self.known_tracking_ids.get(data.get('trackingId'))
+            if status is None:
+                response['responseEnvelope']['ack'] = 'Failure'
+                response['error'] = [{'message': 'Not found',
+                                      'errorId': self.details_error_id}]
+            else:
+                response.update({'payKey': 'AP-FOUND', 'status': status})
+
+        self._response = json.dumps(response)
+        return self
+
+    @property
+    def response(self):
+        return self._response
+
+    @property
+    def code(self):
+        return 200
+
+
+def receivers(preapproval):
+    return ReceiverList([Receiver(amount=preapproval.amount,
+                                  email='campaign@example.com')])
+
+
+@patch("paypaladaptive.api.endpoints.UrlRequest", MockPaypal)
+class TestSettlement(TestCase):
+    def setUp(self):
+        MockPaypal.calls = []
+        MockPaypal.failing_keys = ()
+        MockPaypal.known_tracking_ids = {}
+        MockPaypal.details_error_id = '580022'
+        self.preapprovals = [
+            PreapprovalFactory.create(status='approved',
+                                      preapproval_key='PA-%s' % i)
+            for i in range(4)]
+        PreapprovalFactory.create(status='canceled', preapproval_key='PA-X')
+
+    def operations(self):
+        return [operation for operation, __ in MockPaypal.calls]
+
+    def test_charge(self):
+        MockPaypal.failing_keys = ('PA-3',)
+
+        result = settle('campaign', Preapproval.objects.all(),
+                        receivers=receivers)
+
+        self.assertEqual(self.operations(), ['Pay'] * 4)
+        self.assertEqual(result['status'], 'completed')
+        self.assertEqual(result['items'], 4)
+        self.assertEqual(result['counts']['completed'], 3)
+        self.assertEqual(result['counts']['failed'], 1)
+        self.assertEqual(result['charged'], [Money(4200, 'SEK')])
+        self.assertEqual(result['failed'],
+                         [(self.preapprovals[3].pk, 'Preapproval invalid')])
+
+        self.assertEqual(
+            Preapproval.objects.filter(status='used').count(), 3)
+        self.assertEqual(
+            StatusTransition.objects.filter(object_type='preapproval',
+                                            status='used').count(), 3)
+        pk = self.preapprovals[0].pk
+        self.assertEqual(statuscache.get_statuses(Preapproval, [pk])[pk][0],
+                         'used')
+        self.assertEqual(
+            Payment.objects.filter(status='completed').count(), 3)
+
+        tracking_ids = [data['trackingId'] for __, data in MockPaypal.calls]
+        self.assertEqual(len(set(tracking_ids)), 4)
+
+    def test_resume_is_idempotent(self):
+        settle('campaign', Preapproval.objects.all(), receivers=receivers)
+        MockPaypal.calls = []
+
+        # a new preapproval was approved in the meantime
+        PreapprovalFactory.create(status='approved', preapproval_key='PA-4')
+        result = settle('campaign', Preapproval.objects.all(),
+                        receivers=receivers)
+
+        self.assertEqual(self.operations(), ['Pay'])
+        self.assertEqual(result['counts']['completed'], 5)
+
+    def test_recover_interrupted_items(self):
+        settlement = Settlement.objects.create(name='campaign',
+                                               action='charge')
+        charged, unknown = self.preapprovals[:2]
+
+        for preapproval in (charged, unknown):
+            payment = Payment.objects.create(money=preapproval.money)
+            SettlementItem.objects.create(
+                settlement=settlement, preapproval=preapproval,
+                payment=payment, status='processing')
+
+        item = settlement.items.get(preapproval=charged)
+        MockPaypal.known_tracking_ids = {item.tracking_id: 'COMPLETED'}
+
+        run(settlement, receivers=receivers)
+
+        # only the charge Paypal didn't know about is made again
+        self.assertEqual(self.operations(),
+                         ['PaymentDetails', 'PaymentDetails', 'Pay'])
+        self.assertEqual(report(settlement)['counts']['completed'], 2)
+        self.assertEqual(settlement.items.get(preapproval=charged)
+                                         .payment.pay_key, 'AP-FOUND')
+
+    def test_recover_transient_error(self):
+        settlement = Settlement.objects.create(name='campaign',
+                                               action='charge')
+        payment = Payment.objects.create(money=self.preapprovals[0].money)
+        SettlementItem.objects.create(
+            settlement=settlement, preapproval=self.preapprovals[0],
+            payment=payment, status='processing')
+        MockPaypal.details_error_id = '520002'
+
+        run(settlement, receivers=receivers)
+
+        # the charge may have gone through, it's not made again
+        self.assertEqual(self.operations(), ['PaymentDetails'])
+        self.assertEqual(settlement.items.get().status, 'processing')
+        self.assertEqual(settlement.status, 'running')
+
+    def test_cancel(self):
+        result = settle('campaign-cancel', Preapproval.objects.all(),
+                        action='cancel')
+
+        self.assertEqual(self.operations(), ['CancelPreapproval'] * 4)
+        self.assertEqual(result['counts']['completed'], 4)
+        self.assertEqual(
+            Preapproval.objects.filter(status='canceled').count(), 5)
+
+    def test_action_mismatch(self):
+        settle('campaign', Preapproval.objects.none(), receivers=receivers)
+        with self.assertRaises(ValueError):
+            settle('campaign', Preapproval.objects.none(), action='cancel')
@@ -0,0 +1,139 @@
+from django.db import transaction
+from django.test import TransactionTestCase
+
+from mock import patch
+
+from paypaladaptive import settings, transactions
+from paypaladaptive.models import Payment
+from paypaladaptive.signals import (payment_completed, payment_failed,
+                                    status_changed)
+
+from .factories import PaymentFactory
+from .helpers import mock_ipn_call
+
+
+class TestStatusSignals(TransactionTestCase):
+    def setUp(self):
+        transactions.discard_pending()
+        self.received = []
+        payment_completed.connect(self.receiver)
+        status_changed.connect(self.receiver)
+        self.payment = PaymentFactory.create(status='created',
+                                             pay_key='AP-1')
+
+    def tearDown(self):
+        payment_completed.disconnect(self.receiver)
+        status_changed.disconnect(self.receiver)
+        payment_failed.disconnect(self.failing_receiver)
+
+    def receiver(self, signal, sender, instance, old_status, status,
+                 **kwargs):
+        # the change is visible to other connections
+        committed = Payment.objects.get(pk=instance.pk).status
+        self.received.append((signal, old_status, status, committed))
+
+    def failing_receiver(self, **kwargs):
+        raise ValueError('Out of stock')
+
+    def test_ipn(self):
+        money = "%s %s" % (self.payment.money.currency,
+                           self.payment.money.amount)
+        data = {'status': 'COMPLETED',
+                'transaction_type': 'Adaptive Payment PAY',
+                'pay_key': self.payment.pay_key,
+                'transaction[0].id': '1',
+                'transaction[0].amount': money,
+                'transaction[0].status': 'COMPLETED'}
+        response = mock_ipn_call(data, self.payment.ipn_url,
+                                 content_type='application/'
+                                              'x-www-form-urlencoded')
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(sorted(self.received), sorted([
+            (status_changed, 'created', 'completed', 'completed'),
+            (payment_completed, 'created', 'completed', 'completed')]))
+
+    def test_after_commit(self):
+        with transactions.atomic():
+            self.payment.status = 'completed'
+            self.payment.save()
+            with transactions.atomic():
+                self.payment.status = 'refunded'
+                self.payment.save()
+            self.assertEqual(self.received, [])
+
+        self.assertEqual([status for __, __, status, __ in self.received],
+                         ['completed', 'completed', 'refunded'])
+
+    def test_rollback(self):
+        try:
+            with transactions.atomic():
+                self.payment.status = 'completed'
+                self.payment.save()
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(self.received, [])
+
+        # a rolled back savepoint drops only its own signals
+        with transactions.atomic():
+            self.payment.status = 'error'
+            self.payment.save()
+            try:
+                with transactions.atomic():
+                    self.payment.status = 'completed'
+                    self.payment.save()
+                    raise ValueError()
+            except ValueError:
+                pass
+
+        self.assertEqual([status for __, __, status, __ in self.received],
+                         ['error'])
+
+    def test_django_atomic(self):
+        # e.g. ATOMIC_REQUESTS or a celery task, outside of any request
+        with transaction.atomic():
+            with transaction.atomic():
+                self.payment.status = 'completed'
+                self.payment.save()
+            self.assertEqual(self.received, [])
+
+        self.assertEqual([status for __, __, status, __ in self.received],
+                         ['completed', 'completed'])
+
+    def test_django_atomic_rollback(self):
+        try:
+            with transaction.atomic():
+                self.payment.status = 'completed'
+                self.payment.save()
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(self.received, [])
+        # nothing is left to be sent by a later transaction or request
+        with transactions.atomic():
+            pass
+        self.client.get('/')
+        self.assertEqual(self.received, [])
+
+    def test_failing_receiver(self):
+        payment_failed.connect(self.failing_receiver)
+
+        self.payment.status = 'error'
+        self.payment.save()
+
+        self.assertEqual(len(self.received), 1)
+
+    @patch.object(settings, 'SIGNAL_EXECUTOR', 'celery')
+    @patch('paypaladaptive.tasks.send_status_signals.delay')
+    def test_celery(self, delay):
+        with transactions.atomic():
+            self.payment.status = 'completed'
+            self.payment.save()
+            self.assertFalse(delay.called)
+
+        delay.assert_called_once_with('payment', self.payment.pk, 'created',
+                                      'completed')
+        self.assertEqual(self.received, [])
@@ -0,0 +1,170 @@
+import threading
+import time
+
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+
+from django.test import TestCase
+
+from mock import patch
+
+from paypaladaptive import settings
+from paypaladaptive.api import (DeadlineExceeded, PaymentDetails,
+                                 singleflight)
+from paypaladaptive.helpers import get_cache
+
+
+class MockBlockingRequest(object):
+    calls = 0
+    release = None
+
+    def call(self, *args, **kwargs):
+        MockBlockingRequest.calls += 1
+        MockBlockingRequest.release.wait(5)
+        return self
+
+    @property
+    def response(self):
+        return json.dumps({'responseEnvelope': {'ack': 'Success'},
+                           'status': 'COMPLETED'})
+
+    @property
+    def code(self):
+        return 200
+
+
+@patch("paypaladaptive.api.endpoints.UrlRequest", MockBlockingRequest)
+@patch.object(settings, 'COALESCE_REQUESTS', True)
+class TestRequestCoalescing(TestCase):
+    def setUp(self):
+        MockBlockingRequest.calls = 0
+        MockBlockingRequest.release = threading.Event()
+
+    def call_concurrently(self, endpoints):
+        results = []
+
+        def run(endpoint):
+            results.append(endpoint.call())
+
+        threads = [threading.Thread(target=run, args=(e,))
+                   for e in endpoints]
+        for thread in threads:
+            thread.start()
+
+        while not singleflight._group.in_flight(endpoints[0].cache_key):
+            time.sleep(0.01)
+        time.sleep(0.05)
+        MockBlockingRequest.release.set()
+
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def test_identical_calls_share_request(self):
+        endpoints = [PaymentDetails(payKey='AP-1') for __ in range(5)]
+        results = self.call_concurrently(endpoints)
+
+        self.assertEqual(MockBlockingRequest.calls, 1)
+        self.assertEqual(len(results), 5)
+        for result in results:
+            self.assertEqual(result, results[0])
+        for endpoint in endpoints:
+            self.assertEqual(endpoint.response['status'], 'COMPLETED')
+
+    def test_different_calls_are_not_shared(self):
+        self.call_concurrently([PaymentDetails(payKey='AP-1'),
+                                PaymentDetails(payKey='AP-2')])
+
+        self.assertEqual(MockBlockingRequest.calls, 2)
+
+    def test_disabled(self):
+        with patch.object(settings, 'COALESCE_REQUESTS', False):
+            MockBlockingRequest.release.set()
+            PaymentDetails(payKey='AP-1').call()
+            PaymentDetails(payKey='AP-1').call()
+
+        self.assertEqual(MockBlockingRequest.calls, 2)
+
+
+class TestGroup(TestCase):
+    def setUp(self):
+        self.group = singleflight.Group()
+        self.release = threading.Event()
+
+    def lead(self, result):
+        """Start a call for 'key' in a thread, answered once released"""
+        def func():
+            self.release.wait(5)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        def run():
+            try:
+                self.group.do('key', func)
+            except Exception:
+                # raised to the follower as well
+                pass
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.addCleanup(thread.join)
+        while not self.group.in_flight('key'):
+            time.sleep(0.01)
+        threading.Timer(0.05, self.release.set).start()
+
+    def test_followers_get_copies(self):
+        leader_result = {'status': 'COMPLETED', 'payments': []}
+        self.lead(leader_result)
+
+        result = self.group.do('key', lambda: 'own result')
+
+        self.assertEqual(result, leader_result)
+        self.assertIsNot(result['payments'], leader_result['payments'])
+
+    def test_leader_deadline_exceeded(self):
+        self.lead(DeadlineExceeded('Call to Paypal timed out'))
+
+        self.assertEqual(self.group.do('key', lambda: 'own result'),
+                         'own result')
+
+    def test_leader_failed(self):
+        self.lead(ValueError('failed'))
+
+        self.assertRaises(ValueError, self.group.do, 'key',
+                          lambda: 'own result')
+
+
+class TestSharedCoalescing(TestCase):
+    def setUp(self):
+        self.cache = get_cache(settings.COALESCE_CACHE_ALIAS)
+        self.cache.clear()
+
+    def test_leader(self):
+        result = singleflight.do('key', lambda: 'result',
+                                 across_processes=True)
+
+        self.assertEqual(result, 'result')
+        self.assertIsNone(
+            self.cache.get('%s:lock:key' % singleflight.KEY_PREFIX))
+
+    def test_waits_for_other_process(self):
+        self.cache.set('%s:lock:key' % singleflight.KEY_PREFIX, 'token')
+        self.cache.set('%s:result:key:token' % singleflight.KEY_PREFIX,
+                       'shared result')
+
+        def fail():
+            raise AssertionError("should not be called")
+
+        self.assertEqual(singleflight.do('key', fail, across_processes=True),
+                         'shared result')
+
+    def test_other_process_failed(self):
+        self.cache.set('%s:lock:key' % singleflight.KEY_PREFIX, 'token', 0.1)
+
+        self.assertEqual(singleflight.do('key', lambda: 'own result',
+                                         across_processes=True),
+                         'own result')
@@ -0,0 +1,81 @@
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from django.test import TestCase
+
+from mock import patch
+
+from paypaladaptive import settings, slowcalls
+from paypaladaptive.api import PaymentDetails
+from paypaladaptive.api.httpwrapper import UrlRequest
+from paypaladaptive.models import SlowCall
+
+from .payment_update import MockUpdateRequest
+
+
+class OkHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write('ok')
+
+    def log_message(self, *args):
+        pass
+
+
+@patch("paypaladaptive.api.endpoints.UrlRequest", MockUpdateRequest)
+class TestSlowCalls(TestCase):
+    def setUp(self):
+        MockUpdateRequest._response = (
+            '{"responseEnvelope": {"ack": "Success", '
+            '"correlationId": "8c8a0e8c2f3b1"}, "status": "COMPLETED"}')
+
+    def test_disabled(self):
+        with patch.object(settings, 'SLOW_CALL_THRESHOLD', None):
+            PaymentDetails(payKey='AP-1').call()
+
+        self.assertEqual(SlowCall.objects.count(), 0)
+
+    def test_threshold(self):
+        with patch.object(settings, 'SLOW_CALL_THRESHOLD', 60):
+            PaymentDetails(payKey='AP-1').call()
+        self.assertEqual(SlowCall.objects.count(), 0)
+
+        endpoint = PaymentDetails(payKey='AP-1')
+        with patch.object(settings, 'SLOW_CALL_THRESHOLD', 0):
+            endpoint.call()
+
+        slow_call = SlowCall.objects.get()
+        self.assertEqual(slow_call.endpoint, 'PaymentDetails')
+        self.assertEqual(slow_call.correlation_id, '8c8a0e8c2f3b1')
+        self.assertEqual(slow_call.response_bytes,
+                         len(MockUpdateRequest._response))
+        self.assertTrue(slow_call.request_bytes > 0)
+        self.assertIsNone(slow_call.first_byte)
+
+    def test_trim(self):
+        for i in range(5):
+            SlowCall.objects.create(endpoint='Pay', total=i)
+
+        slowcalls.trim(3)
+
+        self.assertEqual(
+            list(SlowCall.objects.values_list('total', flat=True)),
+            [4, 3, 2])
+
+    def test_timings(self):
+        server = HTTPServer(('127.0.0.1', 0), OkHandler)
+        thread = threading.Thread(target=server.handle_request)
+        thread.start()
+        try:
+            request = UrlRequest().call('http://127.0.0.1:%s/' %
+                                        server.server_port)
+        finally:
+            thread.join()
+            server.server_close()
+
+        self.assertEqual(request.response, 'ok')
+        timings = request.timings
+        self.assertTrue(0 <= timings['connect'] <= timings['first_byte'] <=
+                        timings['total'])
+        self.assertIn('tls', timings)
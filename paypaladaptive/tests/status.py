@@ -0,0 +1,157 @@
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+import threading
+import time
+
+from django.core.urlresolvers import reverse
+from django.test import TransactionTestCase
+
+from mock import patch
+
+from paypaladaptive import settings, statuscache, transactions
+from paypaladaptive.helpers import get_cache
+from paypaladaptive.models import Payment
+
+from .factories import PaymentFactory, PreapprovalFactory
+
+
+class TestStatusView(TransactionTestCase):
+    def setUp(self):
+        transactions.discard_pending()
+        get_cache(settings.STATUS_CACHE_ALIAS).clear()
+        self.payments = [PaymentFactory.create(status='created')
+                         for i in range(2)]
+        self.preapproval = PreapprovalFactory.create(status='approved')
+        self.url = reverse('paypal-adaptive-status')
+
+    def token(self, obj):
+        return '%s:%s' % (obj.pk, obj.secret_uuid)
+
+    def get(self, payments=None, wait=None, **headers):
+        query = {'payment': ','.join(self.token(p)
+                                     for p in payments or self.payments),
+                 'preapproval': self.token(self.preapproval)}
+        if wait is not None:
+            query['wait'] = wait
+        return self.client.get(self.url, query, **headers)
+
+    def test_statuses(self):
+        # statuses are cached when they change, nothing is loaded
+        with self.assertNumQueries(0):
+            response = self.get()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {
+            'payment': {str(self.payments[0].pk): 'created',
+                        str(self.payments[1].pk): 'created'},
+            'preapproval': {str(self.preapproval.pk): 'approved'}})
+
+    def test_cache_miss(self):
+        get_cache(settings.STATUS_CACHE_ALIAS).clear()
+
+        with self.assertNumQueries(2):
+            self.get()
+        with self.assertNumQueries(0):
+            self.get()
+
+    def test_rollback(self):
+        payment = self.payments[0]
+        try:
+            with transactions.atomic():
+                payment.status = 'completed'
+                payment.save()
+                raise ValueError()
+        except ValueError:
+            pass
+
+        statuses = json.loads(self.get().content)['payment']
+        self.assertEqual(statuses[str(payment.pk)], 'created')
+
+    def test_wrong_secret(self):
+        response = self.client.get(self.url, {
+            'payment': '%s:wrong' % self.payments[0].pk})
+        self.assertEqual(json.loads(response.content),
+                         {'payment': {str(self.payments[0].pk): None}})
+
+        response = self.client.get(self.url, {'payment': 'wrong'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_etag(self):
+        etag = self.get()['ETag']
+
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        payment = Payment.objects.get(pk=self.payments[0].pk)
+        payment.status = 'completed'
+        payment.save()
+
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @patch.object(settings, 'STATUS_POLL_INTERVAL', 0.01)
+    def test_long_poll(self):
+        etag = self.get()['ETag']
+
+        def complete():
+            time.sleep(0.05)
+            payment = self.payments[1]
+            payment.status = 'completed'
+            statuscache.publish(payment)
+
+        thread = threading.Thread(target=complete)
+        thread.start()
+        start = time.time()
+        # waiting only reads the cache
+        with self.assertNumQueries(0):
+            response = self.get(wait=5, HTTP_IF_NONE_MATCH=etag)
+        thread.join()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(
+            json.loads(response.content)['payment'][str(self.payments[1].pk)],
+            'completed')
+
+    @patch.object(settings, 'STATUS_POLL_INTERVAL', 0.01)
+    def test_long_poll_timeout(self):
+        etag = self.get()['ETag']
+
+        response = self.get(wait='0.05', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    @patch.object(settings, 'STATUS_POLL_INTERVAL', 10)
+    def test_long_poll_notified(self):
+        etag = self.get()['ETag']
+
+        def complete():
+            time.sleep(0.05)
+            payment = self.payments[1]
+            payment.status = 'completed'
+            statuscache.publish(payment)
+
+        thread = threading.Thread(target=complete)
+        thread.start()
+        start = time.time()
+        response = self.get(wait=5, HTTP_IF_NONE_MATCH=etag)
+        thread.join()
+
+        # the change wakes the request before the next cache read
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(time.time() - start < 2)
+
+    @patch.object(settings, 'STATUS_MAX_WAITERS', 0)
+    def test_long_poll_max_waiters(self):
+        etag = self.get()['ETag']
+
+        response = self.get(wait=5, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+        # requests that don't wait aren't counted
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
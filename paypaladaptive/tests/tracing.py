@@ -0,0 +1,118 @@
+from contextlib import contextmanager
+
+from django.test import TestCase
+
+from mock import patch
+from moneyed import Money
+
+from paypaladaptive import settings, tracing
+from paypaladaptive.api.datatypes import Receiver, ReceiverList
+from paypaladaptive.api.ipn import constants
+
+from .factories import PaymentFactory
+from .helpers import MockIPNVerifyRequest, mock_ipn_call
+from .payment_response import MockPaymentRequest
+
+
+spans = []
+
+
+class RecordingSpan(object):
+    def __init__(self, name, parent):
+        self.name = name
+        self.parent = parent
+        self.attributes = {}
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class RecordingTracer(object):
+    def __init__(self):
+        self.current = None
+
+    @contextmanager
+    def start_as_current_span(self, name):
+        span = RecordingSpan(name, self.current)
+        spans.append(span)
+        self.current = span
+        try:
+            yield span
+        finally:
+            self.current = span.parent
+
+
+def get_span(name):
+    return [span for span in spans if span.name == name][0]
+
+
+@patch.object(settings, 'TRACER', 'paypaladaptive.tests.tracing.RecordingTracer')
+class TestTracing(TestCase):
+    def setUp(self):
+        del spans[:]
+
+    def test_noop(self):
+        with patch.object(settings, 'TRACER', None):
+            with tracing.span('test', key='value') as span:
+                span.set_attribute('status', 'ok')
+                self.assertIs(tracing.current_span(), tracing.NOOP_SPAN)
+
+        self.assertEqual(spans, [])
+
+    def test_current_span(self):
+        with tracing.span('outer', skipped=None, endpoint='Pay') as outer:
+            with tracing.span('inner'):
+                tracing.current_span().set_attribute('status', 'ok')
+            self.assertIs(tracing.current_span(), outer)
+
+        inner = get_span('inner')
+        self.assertEqual(outer.attributes, {'endpoint': 'Pay'})
+        self.assertEqual(inner.attributes, {'status': 'ok'})
+        self.assertIs(inner.parent, outer)
+        self.assertIs(tracing.current_span(), tracing.NOOP_SPAN)
+
+    @patch("paypaladaptive.api.endpoints.UrlRequest", MockPaymentRequest)
+    def test_payment_process(self):
+        MockPaymentRequest._response = (
+            u'{"responseEnvelope":{"ack":"Success"},'
+            u'"payKey":"AP-1","paymentExecStatus":"CREATED"}')
+        payment = PaymentFactory.create(money=Money(100, 'USD'))
+        receivers = ReceiverList([Receiver(amount=100, email='a@example.com',
+                                           primary=True)])
+
+        self.assertTrue(payment.process(receivers))
+
+        process = get_span('paypaladaptive.Payment.process')
+        call = get_span('paypaladaptive.call')
+        self.assertEqual(process.attributes, {
+            'paypal.pay_key_hash': tracing.key_hash('AP-1'),
+            'paypal.status': 'created'})
+        self.assertEqual(call.attributes['paypal.endpoint'], 'Pay')
+        self.assertIs(call.parent, process)
+        self.assertIs(get_span('paypaladaptive.urls').parent, process)
+        self.assertIs(get_span('paypaladaptive.save').parent, call)
+
+    def test_ipn(self):
+        payment = PaymentFactory.create(status='created',
+                                        money=Money(10, 'USD'))
+        data = {'status': 'COMPLETED',
+                'pay_key': 'AP-2',
+                'transaction_type': constants.IPN_TYPE_PAYMENT,
+                'transaction[0].id': '1',
+                'transaction[0].amount': 'USD 10',
+                'transaction[0].status': 'COMPLETED'}
+
+        with patch('paypaladaptive.api.ipn.endpoints.UrlRequest',
+                   MockIPNVerifyRequest):
+            mock_ipn_call(data, payment.ipn_url,
+                          content_type='application/x-www-form-urlencoded')
+
+        ipn = get_span('paypaladaptive.ipn')
+        parse = get_span('paypaladaptive.ipn.parse')
+        self.assertIs(get_span('paypaladaptive.ipn.verify').parent, ipn)
+        self.assertIs(parse.parent, ipn)
+        self.assertEqual(parse.attributes['paypal.pay_key_hash'],
+                         tracing.key_hash('AP-2'))
+        self.assertEqual(
+            get_span('paypaladaptive.ipn.save').attributes['paypal.status'],
+            'completed')
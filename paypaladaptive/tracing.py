@@ -0,0 +1,137 @@
+"""
+Tracing of the payment flow.
+
+Spans are opened around the calls to Paypal, IPN verification and parsing
+and the database work in between. Nothing is traced unless
+PAYPAL_TRACER is the dotted path of a callable returning an OpenTelemetry
+compatible tracer, e.g.:
+
+    def get_tracer():
+        from opentelemetry import trace
+        return trace.get_tracer('paypaladaptive')
+
+Tracing code in this app uses ``span`` and ``traced``; attributes can be
+added to the innermost span with ``current_span().set_attribute()``, which
+does nothing when tracing is off.
+
+"""
+import hashlib
+import threading
+from functools import wraps
+
+try:
+    from django.utils.module_loading import import_string
+except ImportError:
+    from django.utils.module_loading import import_by_path as import_string
+
+from . import settings
+
+
+class NoopSpan(object):
+    """Stands in for a span when tracing is off"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def record_exception(self, exception, *args, **kwargs):
+        pass
+
+    def is_recording(self):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+_local = threading.local()
+
+_tracer = (None, None)
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """Returns the configured tracer or None"""
+    global _tracer
+    path, tracer = _tracer
+    if path != settings.TRACER:
+        with _tracer_lock:
+            path = settings.TRACER
+            tracer = import_string(path)() if path else None
+            _tracer = (path, tracer)
+    return tracer
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+class Span(object):
+    """Context manager around a span started on the tracer"""
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self._manager = None
+
+    def __enter__(self):
+        self._manager = self.tracer.start_as_current_span(self.name)
+        span = self._manager.__enter__()
+        for key, value in self.attributes.items():
+            if value is not None:
+                span.set_attribute(key, value)
+        _stack().append(span)
+        return span
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _stack().pop()
+        return self._manager.__exit__(exc_type, exc_value, tb)
+
+
+def span(name, **attributes):
+    """
+    Returns a context manager tracing the block as a span called name.
+    Attributes set to None are left out.
+
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        return NOOP_SPAN
+    return Span(tracer, name, attributes)
+
+
+def traced(name):
+    """Decorator tracing each call of the function as a span"""
+    def decorator(function):
+        @wraps(function)
+        def _traced(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return _traced
+    return decorator
+
+
+def current_span():
+    """The innermost span opened by this app in this thread"""
+    stack = getattr(_local, 'stack', None)
+    if not stack:
+        return NOOP_SPAN
+    return stack[-1]
+
+
+def key_hash(key):
+    """Short hash of a pay or preapproval key, safe to put on a span"""
+    if not key:
+        return None
+    return hashlib.sha1(key).hexdigest()[:16]
@@ -0,0 +1,108 @@
+"""
+Callbacks run after the current transaction commits.
+
+transaction.on_commit() (Django 1.9+) or connection.on_commit() from
+django-transaction-hooks is used when available. Otherwise every atomic
+block of the default database, ours or Django's, e.g. ATOMIC_REQUESTS or an
+atomic block in a celery task, keeps track of the callbacks registered
+within it. They run when the outermost block commits and are dropped when
+the block they were registered in rolls back.
+
+"""
+import logging
+import threading
+
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+NATIVE_ON_COMMIT = (hasattr(transaction, 'on_commit') or
+                    hasattr(connection, 'on_commit'))
+
+
+def _pending():
+    if not hasattr(_local, 'pending'):
+        _local.pending = []
+    return _local.pending
+
+
+def _markers():
+    if not hasattr(_local, 'markers'):
+        _local.markers = []
+    return _local.markers
+
+
+def on_commit(func):
+    """Call func once the current transaction commits, or now if there is
+    no transaction"""
+    if hasattr(transaction, 'on_commit'):
+        transaction.on_commit(func)
+    elif hasattr(connection, 'on_commit'):
+        connection.on_commit(func)
+    elif connection.in_atomic_block:
+        _pending().append(func)
+    else:
+        func()
+
+
+def run_pending():
+    pending = _pending()
+    while pending:
+        func = pending.pop(0)
+        try:
+            func()
+        except Exception:
+            logger.exception('Error in on_commit callback %r', func)
+
+
+def discard_pending():
+    del _pending()[:]
+
+
+def _tracked(atomic):
+    return (atomic.using or DEFAULT_DB_ALIAS) == DEFAULT_DB_ALIAS
+
+
+def _enter(self):
+    if not _tracked(self):
+        return _django_enter(self)
+
+    _markers().append(len(_pending()))
+    try:
+        _django_enter(self)
+    except Exception:
+        _markers().pop()
+        raise
+
+
+def _exit(self, exc_type, exc_value, traceback):
+    if not _tracked(self):
+        return _django_exit(self, exc_type, exc_value, traceback)
+
+    marker = _markers().pop()
+    conn = transaction.get_connection(self.using)
+    rolled_back = (exc_type is not None or conn.needs_rollback or
+                   getattr(conn, 'closed_in_transaction', False))
+    try:
+        _django_exit(self, exc_type, exc_value, traceback)
+    except Exception:
+        del _pending()[marker:]
+        raise
+
+    if rolled_back:
+        # the block and the callbacks registered within it are undone
+        del _pending()[marker:]
+    elif not conn.in_atomic_block:
+        run_pending()
+
+
+atomic = transaction.atomic
+
+if not NATIVE_ON_COMMIT:
+    _django_enter = transaction.Atomic.__enter__
+    _django_exit = transaction.Atomic.__exit__
+    transaction.Atomic.__enter__ = _enter
+    transaction.Atomic.__exit__ = _exit
@@ -23,6 +23,12 @@ urlpatterns = patterns(
 
     url(r'^pre/return/(?P<preapproval_id>\d+)/(?P<secret_uuid>\w+)/$',
         views.preapproval_return, name="paypal-adaptive-preapproval-return"),
+
+    url(r'^status/$', views.status, name="paypal-adaptive-status"),
+
+    url(r'^changes/$', views.changes, name="paypal-adaptive-changes"),
+
+    url(r'^metrics/$', views.metrics, name="paypal-adaptive-metrics"),
 )
 
 if settings.USE_IPN:
@@ -2,24 +2,35 @@
 Paypal Adaptive Payments supporting views
 
 """
+import hashlib
 import logging
+import math
 import time
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
 
 from django.contrib.auth.decorators import login_required
-from django.db import transaction
 from django.http import (HttpResponseServerError, HttpResponseRedirect,
-                         HttpResponseBadRequest, HttpResponse, Http404)
+                         HttpResponseBadRequest, HttpResponseForbidden,
+                         HttpResponse, Http404)
 from django.shortcuts import render_to_response
 from django.template.context import RequestContext
 from django.shortcuts import get_object_or_404
 from django.utils.translation import ugettext_lazy as _
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_GET, require_POST
 
-from . import settings
+from . import profiling, settings, statuscache, tracing
+from . import metrics as paypal_metrics
+from .changes import changes as get_changes
+from .api import (PaymentDetails, PreapprovalDetails, PaypalAdaptiveApiError,
+                  cache, deadline, ratelimit)
 from .api.ipn import constants
 from .models import Payment, Preapproval
 from .decorators import takes_ipn
+from .transactions import atomic
 
 
 logger = logging.getLogger(__name__)
@@ -39,8 +50,49 @@ def render(request, template, template_vars=None):
     return render_to_response(template, d, context)
 
 
+def invalidate_cached_responses(obj, ipn):
+    """Drop cached details of everything an incoming IPN refers to"""
+    obj.invalidate_update_cache()
+
+    if ipn.pay_key:
+        PaymentDetails.invalidate_cache(payKey=ipn.pay_key)
+
+    if ipn.preapproval_key:
+        PreapprovalDetails.invalidate_cache(preapprovalKey=ipn.preapproval_key)
+
+
+def update_on_return(obj):
+    """
+    Ask Paypal for the status of an object the user returned from, giving up
+    after PAYPAL_RETURN_UPDATE_DEADLINE seconds. Returns True if the object
+    has a final status.
+
+    """
+    if settings.RETURN_UPDATE_DEADLINE is None:
+        return False
+
+    returned_status = obj.status
+    try:
+        with deadline.within(settings.RETURN_UPDATE_DEADLINE):
+            with ratelimit.priority(ratelimit.PRIORITY_INTERACTIVE), \
+                    cache.fresh():
+                obj.update(save=False)
+    except PaypalAdaptiveApiError, e:
+        logger.info('Could not update %s %s on return: %s',
+                    obj.__class__.__name__, obj.id, e)
+        return False
+
+    if obj.status in ('created', 'returned'):
+        # still waiting for the user or Paypal
+        obj.status = returned_status
+        return False
+
+    obj.save()
+    return True
+
+
 @login_required
-@transaction.atomic
+@atomic
 def payment_cancel(request, payment_id, secret_uuid,
                    template="paypaladaptive/cancel.html"):
     """Handle incoming cancellation from paypal"""
@@ -59,7 +111,8 @@ def payment_cancel(request, payment_id, secret_uuid,
     return render(request, template, template_vars)
 
 
-@transaction.atomic
+@profiling.profiled('views.payment_return')
+@atomic
 def payment_return(request, payment_id, secret_uuid,
                    template="paypaladaptive/return.html"):
     """
@@ -91,7 +144,9 @@ def payment_return(request, payment_id, secret_uuid,
         payment.status = 'returned'
         payment.save()
 
-    if settings.USE_DELAYED_UPDATES:
+    updated = payment.status != 'completed' and update_on_return(payment)
+
+    if settings.USE_DELAYED_UPDATES and not updated:
         from .tasks import update_payment
         update_payment.delay(payment_id=payment.id)
 
@@ -99,7 +154,7 @@ def payment_return(request, payment_id, secret_uuid,
     return render(request, template, template_vars)
 
 
-@transaction.atomic
+@atomic
 def preapproval_cancel(request, preapproval_id,
                        template="paypaladaptive/cancel.html"):
     """Incoming preapproval cancellation from paypal"""
@@ -112,7 +167,8 @@ def preapproval_cancel(request, preapproval_id,
     return render(request, template, template_vars)
 
 
-@transaction.atomic
+@profiling.profiled('views.preapproval_return')
+@atomic
 def preapproval_return(request, preapproval_id, secret_uuid,
                        template="paypaladaptive/return.html"):
     """
@@ -144,7 +200,10 @@ def preapproval_return(request, preapproval_id, secret_uuid,
         preapproval.status = 'returned'
         preapproval.save()
 
-    if settings.USE_DELAYED_UPDATES:
+    updated = (preapproval.status != 'approved'
+               and update_on_return(preapproval))
+
+    if settings.USE_DELAYED_UPDATES and not updated:
         from .tasks import update_preapproval
         update_preapproval.delay(preapproval_id=preapproval.id)
 
@@ -153,9 +212,131 @@ def preapproval_return(request, preapproval_id, secret_uuid,
     return render(request, template, template_vars)
 
 
+def _read_statuses(requested):
+    """Map requested (model, pk, secret_uuid) tuples to a JSON body"""
+    body = {}
+    for model, pks in requested.items():
+        statuses = statuscache.get_statuses(model, pks.keys())
+        body[model._meta.model_name] = dict(
+            (str(pk), statuses[pk][0]
+             if statuses.get(pk, (None, None))[1] == secret else None)
+            for pk, secret in pks.items())
+    return json.dumps(body, sort_keys=True)
+
+
+@require_GET
+def status(request):
+    """
+    Statuses of payments and preapprovals as JSON, e.g.
+    ?payment=12:<secret_uuid>,13:<secret_uuid>&preapproval=4:<secret_uuid>
+    answers {"payment": {"12": "completed", "13": "created"},
+    "preapproval": {"4": "approved"}}. Unknown objects are null.
+
+    Responses carry an ETag. With If-None-Match and ?wait=<seconds> the
+    request waits until a status changes or the time is up, and answers
+    304 if nothing changed. A waiting request holds its worker, so each
+    process only lets PAYPAL_STATUS_MAX_WAITERS wait and answers 503 beyond.
+
+    """
+    requested = {}
+    for name, model in (('payment', Payment), ('preapproval', Preapproval)):
+        for param in request.GET.getlist(name):
+            for token in param.split(','):
+                try:
+                    pk, secret_uuid = token.split(':', 1)
+                    pk = int(pk)
+                except ValueError:
+                    return HttpResponseBadRequest('Invalid %s' % name)
+                requested.setdefault(model, {})[pk] = secret_uuid
+
+    try:
+        wait = min(float(request.GET.get('wait', 0)), settings.STATUS_MAX_WAIT)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid wait')
+
+    # read before the statuses, so a change in between isn't waited for
+    version = statuscache.version()
+    body = _read_statuses(requested)
+    etag = '"%s"' % hashlib.sha1(body).hexdigest()
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+
+    if wait and etag == if_none_match:
+        with statuscache.waiting() as allowed:
+            if not allowed:
+                response = HttpResponse('too many waiting requests',
+                                        status=503)
+                response['Retry-After'] = int(
+                    math.ceil(settings.STATUS_POLL_INTERVAL))
+                return response
+
+            deadline = time.time() + wait
+            while etag == if_none_match and time.time() < deadline:
+                version = statuscache.wait_for_change(
+                    version, min(settings.STATUS_POLL_INTERVAL,
+                                 max(deadline - time.time(), 0)))
+                body = _read_statuses(requested)
+                etag = '"%s"' % hashlib.sha1(body).hexdigest()
+
+    if etag == if_none_match:
+        response = HttpResponse(status=304)
+        response['ETag'] = etag
+        return response
+
+    response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@require_GET
+def changes(request):
+    """
+    Status changes after the cursor ?since=<id> as JSON, for services
+    mirroring statuses. Requires an "Authorization: Token <token>" header
+    matching PAYPAL_CHANGE_FEED_TOKEN and is disabled if that is not set.
+
+    """
+    if settings.CHANGE_FEED_TOKEN is None:
+        raise Http404
+
+    expected = 'Token %s' % settings.CHANGE_FEED_TOKEN
+    if request.META.get('HTTP_AUTHORIZATION') != expected:
+        return HttpResponseForbidden()
+
+    try:
+        since = int(request.GET.get('since', 0))
+        limit = min(int(request.GET.get('limit', 100)), 1000)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid since or limit')
+
+    batch = get_changes(since, limit, request.GET.getlist('type'))
+    body = {
+        'changes': [{'id': change.pk,
+                     'type': change.object_type,
+                     'object_id': change.object_id,
+                     'old_status': change.old_status,
+                     'status': change.status,
+                     'date': change.created_date.isoformat()}
+                    for change in batch],
+        'cursor': batch[-1].pk if batch else since,
+    }
+    return HttpResponse(json.dumps(body), content_type='application/json')
+
+
+@require_GET
+def metrics(request):
+    """Metrics in the Prometheus text format, if PAYPAL_METRICS_VIEW is set"""
+    if not settings.METRICS_VIEW:
+        raise Http404
+
+    return HttpResponse(paypal_metrics.render_prometheus(),
+                        content_type='text/plain; version=0.0.4')
+
+
 @csrf_exempt
 @require_POST
-@transaction.atomic
+@profiling.profiled('views.ipn')
+@atomic
 @takes_ipn
 def ipn(request, object_id, object_secret_uuid, ipn):
     """
@@ -196,7 +377,9 @@ def ipn(request, object_id, object_secret_uuid, ipn):
         obj.status_detail = ('IPN secret "%s" did not match db'
                              % object_secret_uuid)
         logger.info("Error detail: %s", obj.status_detail)
-        obj.save()
+        with tracing.span('paypaladaptive.ipn.save',
+                          **{'paypal.status': obj.status}):
+            obj.save()
         return HttpResponseBadRequest()
 
     # IPN type-specific operations
@@ -244,6 +427,18 @@ def ipn(request, object_id, object_secret_uuid, ipn):
             logger.debug("Error detail: %s", obj.status_detail)
         else:
             obj.status = 'approved'
+
+        # IPN.process_int() returns 'null' for missing values
+        counts = [None if value == 'null' else value for value in
+                  (ipn.current_number_of_payments,
+                   ipn.current_period_attempts,
+                   ipn.max_number_of_payments)]
+        amount = ipn.current_total_amount_of_all_payments
+        obj.set_ledger(
+            number=counts[0],
+            amount=amount.amount if amount is not None else None,
+            period_attempts=counts[1],
+            max_number=counts[2])
     else:
         logger.warning(
             'No action found for IPN Type "%s" with '
@@ -251,7 +446,10 @@ def ipn(request, object_id, object_secret_uuid, ipn):
             ipn.type, ipn.status, obj.id, obj.secret_uuid
             )
 
-    obj.save()
+    with tracing.span('paypaladaptive.ipn.save',
+                      **{'paypal.status': obj.status}):
+        obj.save()
+        invalidate_cached_responses(obj, ipn)
 
     status_code = 204  # 200
     if ipn.ipn_log is not None:
@@ -259,7 +457,8 @@ def ipn(request, object_id, object_secret_uuid, ipn):
         ipn_log.return_status_code = status_code
         if ipn_log._start_time:
             ipn_log.duration = time.time() - ipn_log._start_time
-        ipn_log.save()
+        with tracing.span('paypaladaptive.ipn.save_log'):
+            ipn_log.save()
 
     return HttpResponse(status=status_code)
 
@@ -30,6 +30,14 @@ def main():
     parser.add_option("--DATABASE_USER", dest="DATABASE_USER", default="")
     parser.add_option("--DATABASE_PASSWORD", dest="DATABASE_PASSWORD", default="")
     parser.add_option("--SITE_ID", dest="SITE_ID", type="int", default=1)
+    parser.add_option("--benchmark", dest="benchmark", action="store_true",
+                      default=False, help="run the benchmarks, not the tests")
+    parser.add_option("--benchmark-rounds", dest="benchmark_rounds",
+                      type="int", default=None)
+    parser.add_option("--benchmark-output", dest="benchmark_output",
+                      default=None, help="write results to this JSON file")
+    parser.add_option("--benchmark-compare", dest="benchmark_compare",
+                      default=None, help="compare with this results file")
 
     options, args = parser.parse_args()
 
@@ -99,11 +107,40 @@ def main():
 
     from django_nose import NoseTestSuiteRunner
 
+    if options.benchmark:
+        return benchmark(NoseTestSuiteRunner(verbosity=0), options, args)
+
     test_runner = NoseTestSuiteRunner(verbosity=1)
     failures = test_runner.run_tests(["."])
 
     if failures:
         sys.exit(failures)
 
+
+def benchmark(runner, options, names):
+    """Run the benchmarks in paypaladaptive.tests.benchmarks"""
+    import json
+
+    from paypaladaptive.tests import benchmarks
+
+    runner.setup_test_environment()
+    old_config = runner.setup_databases()
+    try:
+        results = benchmarks.run(names, options.benchmark_rounds)
+    finally:
+        runner.teardown_databases(old_config)
+        runner.teardown_test_environment()
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if options.benchmark_output:
+        with open(options.benchmark_output, 'w') as f:
+            f.write(output)
+    else:
+        print output
+
+    if options.benchmark_compare:
+        with open(options.benchmark_compare) as f:
+            benchmarks.compare(json.load(f), results, sys.stderr)
+
 if __name__ == "__main__":
     main()